@@ -0,0 +1,370 @@
+"""Asyncio based API server.
+
+Alternative to the ``ThreadingHTTPServer`` in ``scanner_api`` with the same
+endpoints (``/check``, ``/batch``, ``/stats``, ``/search``, ``/token``,
+``/health``, ``/ready``, ``/metrics``). All connections
+are served by one event loop and HTTP/1.1 connections stay open between
+requests. CPU-bound model work runs on a fixed-size thread pool; admission
+is bounded and uploads beyond the queue limit are answered with ``503`` and
+``Retry-After`` before their body is read. With ``--processes N`` the
+models run in separate worker processes (see ``worker_pool``).
+
+Start with ``python async_server.py --port 8000``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import Parser
+from http import HTTPStatus
+from http.client import HTTPMessage
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import metrics
+import multipart
+import scanner_api
+import token_manager
+import worker_pool
+from modules import preload
+from scanner_api import MAX_BATCH_SIZE, MAX_IMAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("PIXAI_WORKERS", str(os.cpu_count() or 4)))
+MAX_QUEUE = int(os.getenv("PIXAI_MAX_QUEUE", "32"))
+KEEPALIVE_TIMEOUT = 15.0
+MAX_HEADER_BYTES = 16 * 1024
+RETRY_AFTER = 1
+
+
+class Overloaded(Exception):
+    """The inference queue is full."""
+
+
+class InferencePool:
+    """Fixed-size executor with bounded admission.
+
+    ``pending`` is only touched from the event loop thread, so no lock is
+    needed.
+    """
+
+    def __init__(self, workers: int = WORKERS, max_queue: int = MAX_QUEUE):
+        self.workers = workers
+        self.limit = workers + max_queue
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="inference")
+        self.pending = 0
+
+    @property
+    def full(self) -> bool:
+        return self.pending >= self.limit
+
+    def acquire(self) -> None:
+        if self.full:
+            raise Overloaded()
+        self.pending += 1
+
+    def release(self) -> None:
+        self.pending -= 1
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args))
+
+
+class Response:
+    __slots__ = ("status", "body", "ctype", "headers", "close")
+
+    def __init__(
+        self,
+        status: int,
+        body: bytes = b"",
+        ctype: str = "application/json",
+        *,
+        headers: Optional[Dict[str, str]] = None,
+        close: bool = False,
+    ):
+        self.status = status
+        self.body = body
+        self.ctype = ctype
+        self.headers = headers or {}
+        self.close = close
+
+
+def json_response(status: int, payload, **kwargs) -> Response:
+    return Response(status, json.dumps(payload).encode(), "application/json", **kwargs)
+
+
+def text_response(status: int, text: str, **kwargs) -> Response:
+    return Response(status, text.encode(), "text/plain; charset=utf-8", **kwargs)
+
+
+def _parse_head(head: bytes):
+    """Split a raw request head into method, target, version and headers."""
+    text = head.decode("latin-1")
+    request_line, _, header_text = text.partition("\r\n")
+    parts = request_line.split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise ValueError(f"bad request line: {request_line!r}")
+    headers = Parser(_class=HTTPMessage).parsestr(header_text)
+    return parts[0].upper(), parts[1], parts[2], headers
+
+
+def _keep_alive(version: str, headers) -> bool:
+    conn = (headers.get("Connection") or "").lower()
+    if version == "HTTP/1.0":
+        return conn == "keep-alive"
+    return conn != "close"
+
+
+def _log_raw(peer, note: str) -> None:
+    try:
+        with open("raw_connections.log", "a", encoding="utf-8", errors="replace") as f:
+            f.write(f"\n[Fehlversuch] {peer} → {note}\n")
+    except Exception:
+        pass
+
+
+class APIServer:
+    """Connection handler sharing the endpoint logic of ``scanner_api``."""
+
+    def __init__(self, pool: InferencePool):
+        self.pool = pool
+        # Token- und Statistik-Zugriffe sollen keine Inferenz-Slots belegen
+        self.io_executor = ThreadPoolExecutor(2, thread_name_prefix="api-io")
+        metrics.gauge(
+            "pixai_inference_pending",
+            "Admitted uploads (running or queued for the inference pool)",
+            callback=lambda: self.pool.pending,
+        )
+
+    async def _io(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_executor, functools.partial(fn, *args))
+
+    # ---------- connection ----------
+    async def handle_connection(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ):
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT
+                    )
+                except asyncio.LimitOverrunError:
+                    await self._write(
+                        writer,
+                        json_response(431, {"error": "headers too large"}, close=True),
+                    )
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                try:
+                    method, target, version, headers = _parse_head(head)
+                except ValueError:
+                    _log_raw(peer, "Ungültige Anfragezeile")
+                    await self._write(
+                        writer, json_response(400, {"error": "bad request"}, close=True)
+                    )
+                    break
+                try:
+                    resp = await self.dispatch(peer, method, target, headers, reader, writer)
+                except Exception as exc:
+                    logger.exception("%s %s failed", method, target)
+                    resp = json_response(500, {"error": str(exc)}, close=True)
+                if not _keep_alive(version, headers):
+                    resp.close = True
+                await self._write(writer, resp)
+                if resp.close:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, resp: Response) -> None:
+        phrase = HTTPStatus(resp.status).phrase
+        lines = [
+            f"HTTP/1.1 {resp.status} {phrase}",
+            f"Content-Type: {resp.ctype}",
+            f"Content-Length: {len(resp.body)}",
+            f"Connection: {'close' if resp.close else 'keep-alive'}",
+        ]
+        lines += [f"{k}: {v}" for k, v in resp.headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + resp.body)
+        await writer.drain()
+
+    # ---------- routing ----------
+    async def dispatch(self, peer, method: str, target: str, headers, reader, writer=None) -> Response:
+        url = urlparse(target)
+        has_body = (headers.get("Content-Length") or "0") != "0"
+        if method == "GET":
+            resp = await self._handle_get(url, headers)
+            # Ungelesene Bodys bei GET: Verbindung nicht weiterverwenden
+            resp.close = resp.close or has_body
+            return resp
+        if method == "POST":
+            return await self._handle_post(peer, url.path, headers, reader, writer)
+        return json_response(501, {"error": "unsupported method"}, close=True)
+
+    async def _authorized(self, peer, headers) -> bool:
+        tok = headers.get("Authorization")
+        if tok and await self._io(token_manager.is_valid_token, tok):
+            return True
+        _log_raw(peer, "Token ungültig oder fehlt")
+        return False
+
+    async def _handle_get(self, url, headers) -> Response:
+        if url.path == "/token":
+            code, payload = await self._io(scanner_api.token_response, url.query)
+            if isinstance(payload, dict):
+                return json_response(code, payload)
+            return text_response(code, payload)
+        if url.path in ("/health", "/ready"):
+            return json_response(*scanner_api.health_response(url.path))
+        if url.path == "/metrics":
+            return Response(200, metrics.render().encode(), metrics.CONTENT_TYPE)
+        if url.path == "/stats":
+            if not await self._authorized(None, headers):
+                return json_response(403, {"error": "forbidden"})
+            return json_response(200, await self._io(scanner_api.get_stats, url.query))
+        if url.path == "/search":
+            if not await self._authorized(None, headers):
+                return json_response(403, {"error": "forbidden"})
+            return json_response(*await self._io(scanner_api.search_response, url.query))
+        return json_response(404, {"error": "not found"})
+
+    async def _handle_post(self, peer, path: str, headers, reader, writer=None) -> Response:
+        # Bis der Body gelesen ist, endet jede Fehlerantwort die Verbindung
+        if not multipart.is_supported(headers.get("Content-Type", "")):
+            _log_raw(peer, "Ungültiger Content-Type")
+            return json_response(403, {"error": "invalid content-type"}, close=True)
+        if path not in ("/check", "/batch"):
+            _log_raw(peer, f"Ungültiger POST-Pfad: {path}")
+            return json_response(403, {"error": "invalid path"}, close=True)
+        with metrics.request(path[1:]) as req:
+            resp = await self._handle_upload(peer, path, headers, reader, writer)
+            req["status"] = resp.status
+        return resp
+
+    async def _handle_upload(self, peer, path: str, headers, reader, writer=None) -> Response:
+        if not await self._authorized(peer, headers):
+            return json_response(403, {"error": "forbidden"}, close=True)
+        try:
+            self.pool.acquire()
+        except Overloaded:
+            return json_response(
+                503,
+                {"error": "server busy"},
+                headers={"Retry-After": str(RETRY_AFTER)},
+                close=True,
+            )
+        try:
+            if path == "/check":
+                field, limit = "image", MAX_IMAGE_SIZE
+            else:
+                field, limit = "file", MAX_BATCH_SIZE
+            try:
+                with metrics.stage("multipart"):
+                    # "100 Continue" erst nach Token, Zulassung und Größenprüfung
+                    form = await multipart.read_body_async(
+                        reader, headers, limit, default_name=field, writer=writer
+                    )
+            except multipart.PayloadTooLarge:
+                return json_response(413, {"error": "payload too large"}, close=True)
+            except Exception:
+                logger.exception("multipart parse failed")
+                _log_raw(peer, "Multipart parse exception")
+                return json_response(400, {"error": f"{field} missing"}, close=True)
+            part = form.get(field)
+            if part is None:
+                _log_raw(peer, f"{field} fehlt im Upload")
+                return json_response(400, {"error": f"{field} missing"})
+            metrics.UPLOAD_BYTES.observe(len(part.data), endpoint=path[1:])
+
+            if path == "/check":
+                code, payload = await self.pool.run(scanner_api.check_upload, part.data)
+                return json_response(code, payload)
+            try:
+                # Hash und Cache-Zugriffe laufen im Pool, nicht auf der Event-Loop
+                result = await scanner_api.scan_upload(
+                    part.data, scanner_api.upload_mime(part), self.pool.executor
+                )
+            except Exception as exc:
+                logger.exception("batch failed")
+                return json_response(500, {"error": str(exc)})
+            return json_response(200, result)
+        finally:
+            self.pool.release()
+
+
+async def serve(
+    port: int = 8000,
+    workers: int = WORKERS,
+    max_queue: int = MAX_QUEUE,
+    preload_models: bool = preload.ENABLED,
+    processes: int = worker_pool.PROCESSES,
+):
+    # läuft im Hintergrund, /health und /ready antworten sofort
+    scanner_api.start_models(preload_models, processes)
+    scanner_api.retention.start()
+    pool = InferencePool(workers, max_queue)
+    # scan_batch nutzt den Default-Executor -> ebenfalls auf den festen Pool legen
+    asyncio.get_running_loop().set_default_executor(pool.executor)
+    api = APIServer(pool)
+    server = await asyncio.start_server(
+        api.handle_connection, port=port, limit=MAX_HEADER_BYTES, reuse_address=True
+    )
+    logger.info("Async API listening on port %d (%d workers)", port, workers)
+    async with server:
+        await server.serve_forever()
+
+
+def run(
+    port: int = 8000,
+    workers: int = WORKERS,
+    max_queue: int = MAX_QUEUE,
+    preload_models: bool = preload.ENABLED,
+    processes: int = worker_pool.PROCESSES,
+):
+    asyncio.run(serve(port, workers, max_queue, preload_models, processes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Asyncio PixAI scanner API")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--queue", type=int, default=MAX_QUEUE)
+    parser.add_argument(
+        "--preload",
+        action="store_true",
+        default=preload.ENABLED,
+        help="load and warm up all models at startup",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=worker_pool.PROCESSES,
+        help="run the models in N worker processes (0 = in the API process)",
+    )
+    args = parser.parse_args()
+    run(args.port, args.workers, args.queue, args.preload, args.processes)
+
+
+if __name__ == "__main__":
+    main()
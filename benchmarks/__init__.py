@@ -0,0 +1,14 @@
+"""Benchmarks for the scanner.
+
+Run individual benchmarks as modules:
+
+``python -m benchmarks.inference_latency``
+    ``model.predict`` vs. the compiled inference path.
+``python -m benchmarks.module_latency``
+    ``process_image`` of every module on stub models, no weights needed.
+``python -m benchmarks.load_generator``
+    Concurrent ``/check`` and ``/batch`` requests against a running server.
+
+All of them write the JSON format of :mod:`benchmarks.results`;
+``python -m benchmarks.results base.json new.json`` compares two runs.
+"""
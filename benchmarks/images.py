@@ -0,0 +1,77 @@
+"""Synthetic test images for the benchmarks.
+
+Images are a smooth random field with fine noise: they compress like
+photos rather than like pure noise, and every seed has a different
+perceptual hash, so distinct images are not served from the result cache.
+"""
+
+from __future__ import annotations
+
+import io
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+Size = Tuple[int, int]
+
+
+def parse_size(text: str) -> Size:
+    """``"640x480"`` -> ``(640, 480)``."""
+    width, _, height = text.lower().partition("x")
+    try:
+        size = int(width), int(height)
+    except ValueError:
+        raise ValueError(f"invalid size {text!r}, expected WIDTHxHEIGHT") from None
+    if min(size) <= 0:
+        raise ValueError(f"invalid size {text!r}")
+    return size
+
+
+def parse_mix(specs: List[str]) -> List[Tuple[Size, int]]:
+    """``["640x480:3", "1920x1080"]`` -> sizes with weights (default 1)."""
+    mix = []
+    for spec in specs:
+        size, _, weight = spec.partition(":")
+        mix.append((parse_size(size), int(weight or 1)))
+    return mix
+
+
+def pick_sizes(mix: List[Tuple[Size, int]], count: int, seed: int = 0) -> List[Size]:
+    """``count`` sizes drawn from ``mix`` in proportion to the weights."""
+    sizes = [size for size, _ in mix]
+    weights = np.asarray([w for _, w in mix], dtype=float)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(sizes), size=count, p=weights / weights.sum())
+    return [sizes[i] for i in picks]
+
+
+def make_array(size: Size, seed: int) -> np.ndarray:
+    """``HxWx3`` uint8 RGB array."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    coarse = Image.fromarray(rng.integers(0, 256, (9, 16, 3), dtype=np.uint8))
+    arr = np.asarray(coarse.resize((width, height), Image.BILINEAR), dtype=np.int16)
+    arr += rng.integers(-12, 13, arr.shape, dtype=np.int16)
+    return np.clip(arr, 0, 255).astype(np.uint8)
+
+
+def make_image(size: Size, seed: int, fmt: str = "JPEG") -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(make_array(size, seed)).save(buf, format=fmt)
+    return buf.getvalue()
+
+
+def make_animation(size: Size, seed: int, frames: int = 8, duration_ms: int = 100) -> bytes:
+    """Animated GIF with ``frames`` different frames."""
+    images = [Image.fromarray(make_array(size, seed * 1000 + i)) for i in range(frames)]
+    buf = io.BytesIO()
+    images[0].save(
+        buf,
+        format="GIF",
+        save_all=True,
+        append_images=images[1:],
+        duration=duration_ms,
+        loop=0,
+    )
+    return buf.getvalue()
@@ -0,0 +1,99 @@
+"""Per-call CPU latency of ``model.predict`` vs. the compiled inference path.
+
+Example::
+
+    python -m benchmarks.inference_latency --model mobilenet --batch 1 4
+    python -m benchmarks.inference_latency --model modules/deepdanbooru_model/model-resnet_custom_v3.h5
+
+Without a model file MobileNetV2 is built without pretrained weights, so
+the benchmark runs offline; latency does not depend on the weights.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+
+# Nur CPU messen
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+
+from benchmarks import results  # noqa: E402
+from modules import inference  # noqa: E402
+
+
+def build_model(name: str):
+    """Return ``(model, input_shape)`` for ``mobilenet`` or an ``.h5`` path."""
+    import tensorflow as tf
+
+    if name == "mobilenet":
+        from tensorflow.keras.applications.mobilenet_v2 import MobileNetV2
+
+        return MobileNetV2(weights=None), (224, 224, 3)
+    model = tf.keras.models.load_model(name, compile=False)
+    return model, tuple(model.input_shape[1:])
+
+
+def measure(fn: Callable, batch: np.ndarray, iterations: int, warmup: int = 3) -> Dict[str, float]:
+    """Call ``fn(batch)`` repeatedly; returns latency figures in ms."""
+    for _ in range(warmup):
+        fn(batch)
+    samples: List[float] = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(batch)
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return results.summarize(samples)
+
+
+def run(model_name: str, batches: List[int], iterations: int) -> Dict[str, object]:
+    model, shape = build_model(model_name)
+    compiled = inference.compile_model(model, shape)
+    paths = {"predict": lambda b: model.predict(b, verbose=0), "compiled": compiled}
+    rows = []
+    for size in batches:
+        batch = np.random.default_rng(0).random((size, *shape), dtype=np.float32)
+        for label, fn in paths.items():
+            row = {
+                "name": f"{label} batch={size}",
+                "path": label,
+                "batch": size,
+                **measure(fn, batch, iterations),
+            }
+            rows.append(row)
+            print(
+                f"{label:>9}  batch={size:<3} mean={row['mean_ms']:8.2f} ms"
+                f"  p50={row['p50_ms']:8.2f} ms  p95={row['p95_ms']:8.2f} ms"
+            )
+    return {"model": model_name, "input_shape": list(shape), "results": rows}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="mobilenet", help="'mobilenet' or path to an .h5 file")
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    args = parser.parse_args(argv)
+    if inference.tf is None:
+        print("TensorFlow is not installed", file=sys.stderr)
+        return 1
+    report = run(args.model, args.batch, args.iterations)
+    if args.json:
+        config = {
+            "model": report["model"],
+            "input_shape": report["input_shape"],
+            "batch": args.batch,
+            "iterations": args.iterations,
+        }
+        results.write(args.json, results.document("inference_latency", config, report["results"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
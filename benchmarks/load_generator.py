@@ -0,0 +1,252 @@
+"""End-to-end load generator for ``/check`` and ``/batch``.
+
+Example::
+
+    PIXAI_BACKEND=stub PIXAI_STUB_DELAY_MS=20 python async_server.py &
+    python -m benchmarks.load_generator --concurrency 1 8 32 --requests 300
+    python -m benchmarks.load_generator --endpoint batch --sizes 480x270 --frames 16
+    python -m benchmarks.load_generator --sizes 640x480:3 1920x1080:1 --json new.json
+
+Each concurrency level runs a closed loop: N client threads send the next
+request as soon as their previous one is answered, each over its own
+keep-alive connection. Latency is measured
+from sending the request to reading the full response; ``images_per_s``
+counts successful uploads (an animation counts as one upload).
+
+All uploads are generated before the clock starts. ``--distinct`` limits
+how many different images are generated; repeats are answered from the
+server's result cache, which is measured as well then.
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse
+
+from benchmarks import images, results
+
+FIELDS = {"check": ("image", "image/jpeg", "jpg"), "batch": ("file", "image/gif", "gif")}
+TIMEOUT = 120.0  # seconds
+WARMUP_OFFSET = 10**6  # Bildnummern der Aufwärm-Anfragen
+
+
+def multipart_body(field: str, filename: str, mime: str, data: bytes) -> Tuple[bytes, str]:
+    """Encoded ``multipart/form-data`` body and its content type."""
+    boundary = f"pixai-bench-{secrets.token_hex(8)}"
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: {mime}\r\n\r\n"
+    ).encode()
+    return head + data + f"\r\n--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+class Target:
+    """``host:port`` of the API plus the token header.
+
+    Every client thread keeps one keep-alive connection, as real clients
+    do; a connection the server closed is reopened once per request.
+    """
+
+    def __init__(self, url: str, token: str = ""):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 8000
+        self.token = token
+        self._local = threading.local()
+
+    def _connection(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """The thread's connection and whether it was used before."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn, True
+        conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=TIMEOUT)
+        return conn, False
+
+    def close(self) -> None:
+        """Close the calling thread's connection."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def request(self, method: str, path: str, body: bytes = None, headers: Dict[str, str] = None):
+        """Send one request on the thread's connection; returns ``(status, body)``."""
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = self.token
+        while True:
+            conn, reused = self._connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                payload = response.read()
+            except (OSError, http.client.HTTPException):
+                self.close()
+                if reused:
+                    continue  # Keep-alive-Verbindung inzwischen geschlossen
+                raise
+            if response.will_close:
+                self.close()
+            return response.status, payload
+
+    def fetch_token(self, email: str) -> str:
+        status, body = self.request("GET", f"/token?email={email}")
+        if status != 200:
+            raise RuntimeError(f"/token answered {status}: {body[:200]!r}")
+        return body.decode().strip()
+
+
+def build_uploads(
+    endpoint: str,
+    mix: List[Tuple[images.Size, int]],
+    count: int,
+    distinct: int,
+    frames: int,
+    offset: int = 0,
+) -> List[Tuple[bytes, str]]:
+    """``count`` request bodies following the size mix.
+
+    Images are numbered from ``offset``; the same number gives the same image.
+    """
+    field, mime, ext = FIELDS[endpoint]
+    sizes = images.pick_sizes(mix, count)
+    cache: Dict[int, Tuple[bytes, str]] = {}
+    uploads = []
+    for i, size in enumerate(sizes):
+        key = offset + (i % distinct if distinct else i)
+        if key not in cache:
+            seed = key * 7919 + size[0] * size[1]
+            if endpoint == "batch":
+                data = images.make_animation(size, seed, frames)
+            else:
+                data = images.make_image(size, seed)
+            cache[key] = multipart_body(field, f"bench_{key}.{ext}", mime, data)
+        uploads.append(cache[key])
+    return uploads
+
+
+def run_level(target: Target, endpoint: str, uploads: List[Tuple[bytes, str]], concurrency: int) -> Dict[str, object]:
+    """Send all ``uploads`` with ``concurrency`` parallel clients."""
+    latencies: List[float] = []
+    sent = [0]  # Bytes erfolgreicher Uploads
+    statuses: Counter = Counter()
+    errors: Counter = Counter()
+    lock = threading.Lock()
+    cursor = iter(range(len(uploads)))
+
+    def client():
+        while True:
+            with lock:
+                index = next(cursor, None)
+            if index is None:
+                target.close()
+                return
+            body, ctype = uploads[index]
+            start = time.perf_counter()
+            try:
+                status, payload = target.request("POST", f"/{endpoint}", body, {"Content-Type": ctype})
+                failed = status != 200 or "error" in json.loads(payload)
+            except (OSError, ValueError, http.client.HTTPException) as exc:
+                status, failed = type(exc).__name__, True
+            elapsed = (time.perf_counter() - start) * 1000.0
+            with lock:
+                statuses[str(status)] += 1
+                if failed:
+                    errors[str(status)] += 1
+                else:
+                    latencies.append(elapsed)
+                    sent[0] += len(body)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    duration = time.perf_counter() - started
+    ok = len(latencies)
+    row = {
+        "name": f"{endpoint} c={concurrency}",
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(uploads),
+        "ok": ok,
+        "failed": sum(errors.values()),
+        "status": dict(statuses),
+        "duration_s": round(duration, 3),
+        **results.summarize(latencies),
+        "images_per_s": round(ok / duration, 2) if duration else 0.0,
+        "mb_per_s": round(sent[0] / duration / 1e6, 2) if duration else 0.0,
+    }
+    return row
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", default="", help="API token (default: fetched via /token)")
+    parser.add_argument("--email", default="benchmark@localhost", help="email for /token")
+    parser.add_argument("--endpoint", nargs="+", choices=sorted(FIELDS), default=["check"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests before each endpoint")
+    parser.add_argument("--sizes", nargs="+", default=["640x480:3", "1280x720:2", "1920x1080:1"],
+                        help="WIDTHxHEIGHT[:WEIGHT] mix of upload sizes")
+    parser.add_argument("--frames", type=int, default=8, help="frames per /batch animation")
+    parser.add_argument("--distinct", type=int, default=0, help="different images per level (0 = all)")
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    args = parser.parse_args(argv)
+    mix = images.parse_mix(args.sizes)
+
+    target = Target(args.url)
+    try:
+        target.token = args.token or target.fetch_token(args.email)
+    except (OSError, RuntimeError) as exc:
+        print(f"cannot reach {args.url}: {exc}", file=sys.stderr)
+        return 1
+
+    rows = []
+    for endpoint in args.endpoint:
+        if args.warmup:
+            # eigene Bildnummern, damit die Messung keine Cache-Treffer daraus erbt
+            warmup = build_uploads(endpoint, mix, args.warmup, 0, args.frames, offset=WARMUP_OFFSET)
+            run_level(target, endpoint, warmup, 1)
+        uploads = build_uploads(endpoint, mix, args.requests, args.distinct, args.frames)
+        for level, concurrency in enumerate(args.concurrency):
+            if level and not args.distinct:
+                # jede Stufe mit neuen Bildern, sonst antwortet ab Stufe 2 der Cache
+                uploads = build_uploads(
+                    endpoint, mix, args.requests, 0, args.frames, offset=level * args.requests
+                )
+            row = run_level(target, endpoint, uploads, concurrency)
+            rows.append(row)
+            print(
+                f"{row['name']:<14} ok={row['ok']:<5} failed={row['failed']:<4}"
+                f" p50={row['p50_ms']:8.1f} ms  p95={row['p95_ms']:8.1f} ms  p99={row['p99_ms']:8.1f} ms"
+                f"  {row['images_per_s']:7.1f} img/s"
+            )
+    config = {
+        "url": args.url,
+        "endpoints": args.endpoint,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "sizes": args.sizes,
+        "frames": args.frames,
+        "distinct": args.distinct,
+    }
+    if args.json:
+        results.write(args.json, results.document("load_generator", config, rows))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
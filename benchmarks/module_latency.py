@@ -0,0 +1,187 @@
+"""Per-module ``process_image`` latency, runnable without model weights.
+
+Example::
+
+    python -m benchmarks.module_latency --sizes 640x480 1920x1080 --iterations 50
+    python -m benchmarks.module_latency --delay-ms 20 --json new.json
+    python -m benchmarks.module_latency --backend tensorflow
+
+By default the models run on the ``stub`` backend (see
+``modules.inference``): same input and output shapes as the real models,
+random weights, no ``.h5`` files. That measures decoding, preprocessing,
+batching and post-processing; ``--delay-ms`` stands in for the model's own
+compute time. Every iteration gets a fresh :class:`ImageContext`, so each
+module's figures include decoding and its own resize; ``decode`` alone is
+listed separately and ``pipeline`` runs all modules as ``scanner_api`` does.
+
+Single calls include the batch window (``PIXAI_BATCH_MAX_WAIT_MS``). The
+benchmark runs in a temporary directory, so ``scanned/`` is not touched.
+"""
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import importlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from benchmarks import images, results
+
+ROOT = Path(__file__).resolve().parents[1]
+MODULES_CFG = ROOT / "modules.cfg"
+
+
+def _workdir() -> Path:
+    """Switch to a temp dir, removed after the modules' own exit handlers."""
+    path = Path(tempfile.mkdtemp(prefix="pixai-bench-"))
+    os.chdir(path)
+    # vor den Modul-Imports registriert -> läuft nach deren atexit-Handlern
+    atexit.register(shutil.rmtree, path, True)
+    return path
+
+
+def configured_modules() -> List[str]:
+    with open(MODULES_CFG, "r", encoding="utf-8") as cfg:
+        return [line.strip() for line in cfg if line.strip() and not line.startswith("#")]
+
+
+def load_modules(names: List[str]) -> Dict[str, object]:
+    loaded = {}
+    for name in names:
+        try:
+            loaded[name] = importlib.import_module(name)
+        except Exception as exc:
+            print(f"skipping {name}: {exc}", file=sys.stderr)
+    return loaded
+
+
+def measure(fn: Callable[[], object], iterations: int, warmup: int) -> Dict[str, object]:
+    """Time ``fn()``; the last result is returned as ``sample``."""
+    result = None
+    for _ in range(warmup):
+        result = fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return {"samples": samples, "sample": result}
+
+
+def _error_of(result) -> str:
+    if isinstance(result, dict) and "error" in result:
+        return str(result["error"])
+    return ""
+
+
+def run(
+    names: List[str],
+    sizes: List[images.Size],
+    iterations: int,
+    warmup: int,
+) -> List[Dict[str, object]]:
+    import pipeline
+    from modules.image_context import ImageContext, call_process_image
+
+    modules = load_modules(names)
+    stages = pipeline.build_stages(modules)
+    graph = pipeline.Pipeline(modules)
+    rows = []
+    for width, height in sizes:
+        data = images.make_image((width, height), seed=width * height)
+        label = f"{width}x{height}"
+        # ein Pipeline-Lauf liefert die Eingaben der konsumierenden Module
+        products = {"started": time.monotonic()}
+        first = graph.run(ImageContext(data), dict(products)).results
+        for stage in stages:
+            for product, key in stage.produces.items():
+                out = first.get(stage.name)
+                products[product] = out if key is None or not isinstance(out, dict) else out.get(key)
+
+        def decode():
+            return ImageContext(data).image
+
+        cases: Dict[str, Callable[[], object]] = {"decode": decode}
+        for stage in stages:
+            def call(stage=stage):
+                kwargs = {arg: products.get(p) for arg, p in stage.consumes.items()}
+                return call_process_image(stage.module.process_image, ImageContext(data), **kwargs)
+
+            cases[stage.name] = call
+        cases["pipeline"] = lambda: graph.run(ImageContext(data), {"started": time.monotonic()}).results
+
+        for case, fn in cases.items():
+            try:
+                timing = measure(fn, iterations, warmup)
+            except Exception as exc:
+                rows.append({"name": f"{case} {label}", "module": case, "size": label, "error": str(exc)})
+                print(f"{case:<28} {label:>10}  FAILED {exc}")
+                continue
+            row = {
+                "name": f"{case} {label}",
+                "module": case,
+                "size": label,
+                "bytes": len(data),
+                **results.summarize(timing["samples"]),
+            }
+            row["calls_per_s"] = round(1000.0 / row["mean_ms"], 1) if row["mean_ms"] else 0.0
+            error = _error_of(timing["sample"])
+            if error:
+                row["error"] = error
+            rows.append(row)
+            print(
+                f"{case:<28} {label:>10}  p50={row['p50_ms']:8.2f} ms  p95={row['p95_ms']:8.2f} ms"
+                f"  p99={row['p99_ms']:8.2f} ms{'  ERROR ' + error if error else ''}"
+            )
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", nargs="+", help="module names (default: modules.cfg)")
+    parser.add_argument("--sizes", nargs="+", default=["640x480", "1920x1080"])
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--backend", default="stub", help="model backend, see PIXAI_BACKEND")
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="stub model latency per call")
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show module logging")
+    args = parser.parse_args(argv)
+    sizes = [images.parse_size(s) for s in args.sizes]
+    names = args.modules or configured_modules()
+    json_path = args.json.resolve() if args.json else None
+
+    # vor dem Import der Module setzen, sie lesen die Variablen beim Laden
+    os.environ["PIXAI_BACKEND"] = args.backend
+    os.environ["PIXAI_STUB_DELAY_MS"] = str(args.delay_ms)
+    sys.path.insert(0, str(ROOT))
+    _workdir()
+    # Modulfehler stehen in den Ergebniszeilen, Tracebacks nur mit --verbose
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.CRITICAL,
+        format="%(levelname)s %(name)s: %(message)s",
+    )
+
+    rows = run(names, sizes, args.iterations, args.warmup)
+    config = {
+        "modules": names,
+        "sizes": args.sizes,
+        "iterations": args.iterations,
+        "warmup": args.warmup,
+        "backend": args.backend,
+        "delay_ms": args.delay_ms,
+    }
+    if json_path:
+        results.write(json_path, results.document("module_latency", config, rows))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
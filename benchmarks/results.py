@@ -0,0 +1,166 @@
+"""Shared JSON result format of the benchmarks and a comparison tool.
+
+Every benchmark writes one document::
+
+    {"format": 1, "benchmark": "module_latency", "created": "...",
+     "environment": {"commit": "...", "dirty": false, "python": "...", ...},
+     "config": {...},
+     "results": [{"name": "nsfw_scanner 640x480", "p50_ms": 3.1, ...}, ...]}
+
+Rows are matched by ``name``; every ``*_ms`` and ``*_per_s`` field is a
+metric. Compare two runs, e.g. before and after a commit::
+
+    python -m benchmarks.results base.json new.json
+    python -m benchmarks.results base.json new.json --fail-above 10
+
+With ``--fail-above`` the exit code is 1 if a latency grew or a throughput
+dropped by more than that many percent.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+FORMAT = 1
+ROOT = Path(__file__).resolve().parents[1]
+PERCENTILES = (50, 95, 99)
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", *args], cwd=ROOT, capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() if out.returncode == 0 else None
+
+
+def environment() -> Dict[str, object]:
+    """Commit, interpreter, machine and ``PIXAI_*`` settings of this run."""
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "settings": {k: v for k, v in sorted(os.environ.items()) if k.startswith("PIXAI_")},
+    }
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * q // 100))  # aufrunden
+    return ordered[min(len(ordered), int(rank)) - 1]
+
+
+def summarize(samples_ms: Iterable[float]) -> Dict[str, float]:
+    """Count, mean, p50/p95/p99 and max of latency samples in ms."""
+    ordered = sorted(samples_ms)
+    summary = {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered), 3) if ordered else 0.0,
+    }
+    for q in PERCENTILES:
+        summary[f"p{q}_ms"] = round(percentile(ordered, q), 3)
+    summary["max_ms"] = round(ordered[-1], 3) if ordered else 0.0
+    return summary
+
+
+def document(benchmark: str, config: Dict[str, object], results: List[Dict[str, object]]) -> Dict[str, object]:
+    return {
+        "format": FORMAT,
+        "benchmark": benchmark,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "config": config,
+        "results": results,
+    }
+
+
+def write(path: Path, doc: Dict[str, object]) -> None:
+    Path(path).write_text(json.dumps(doc, indent=2), encoding="utf-8")
+
+
+def load(path: Path) -> Dict[str, object]:
+    doc = json.loads(Path(path).read_text(encoding="utf-8"))
+    if doc.get("format") != FORMAT:
+        raise ValueError(f"{path}: unsupported result format {doc.get('format')!r}")
+    return doc
+
+
+def _is_metric(key: str) -> bool:
+    return key.endswith("_ms") or key.endswith("_per_s")
+
+
+def compare(base: Dict[str, object], new: Dict[str, object]) -> List[Dict[str, object]]:
+    """One row per metric present in both runs, with the change in percent.
+
+    ``worse`` is the change in the unfavourable direction: positive when a
+    latency grew or a throughput dropped.
+    """
+    old_rows = {r["name"]: r for r in base["results"]}
+    rows = []
+    for row in new["results"]:
+        old = old_rows.get(row["name"])
+        if old is None:
+            continue
+        for key, value in row.items():
+            before = old.get(key)
+            if not _is_metric(key) or not isinstance(value, (int, float)) or not before:
+                continue
+            change = (value - before) / before * 100.0
+            rows.append(
+                {
+                    "name": row["name"],
+                    "metric": key,
+                    "base": before,
+                    "new": value,
+                    "change_pct": round(change, 1),
+                    "worse": round(-change if key.endswith("_per_s") else change, 1),
+                }
+            )
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("base", type=Path)
+    parser.add_argument("new", type=Path)
+    parser.add_argument("--metric", nargs="+", help="only these metrics, e.g. p95_ms images_per_s")
+    parser.add_argument("--fail-above", type=float, help="exit 1 on a regression above this percentage")
+    args = parser.parse_args(argv)
+    base, new = load(args.base), load(args.new)
+    if base["benchmark"] != new["benchmark"]:
+        print(f"different benchmarks: {base['benchmark']} vs {new['benchmark']}", file=sys.stderr)
+        return 2
+    print(f"base {base['environment'].get('commit')}  new {new['environment'].get('commit')}")
+    regressions = 0
+    for row in compare(base, new):
+        if args.metric and row["metric"] not in args.metric:
+            continue
+        flag = ""
+        if args.fail_above is not None and row["worse"] > args.fail_above:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(
+            f"{row['name']:<32} {row['metric']:<14} {row['base']:>10.2f} -> {row['new']:>10.2f}"
+            f"  {row['change_pct']:+7.1f}%{flag}"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""Offline conversion of the scanner models to ONNX and TFLite.
+
+``convert`` exports the NSFW, MobileNetV2 and DeepDanbooru models as
+float32 and int8 (dynamic range quantized) variants into
+``modules/converted/``, where ``modules.inference`` picks them up when
+``PIXAI_BACKEND`` selects ``onnxruntime`` or ``tflite``.
+
+``report`` runs every available variant and the TensorFlow reference on a
+directory of sample images and prints the accuracy delta and latency, so
+the precision/throughput trade-off is visible before switching backends.
+
+Examples::
+
+    python convert_models.py convert --models deepdanbooru --formats onnx
+    python convert_models.py report --samples samples/ --json report.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from modules import deepdanbooru_tags, inference, nsfw_scanner, tagging
+from modules.image_context import ImageContext
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"onnx": "onnxruntime", "tflite": "tflite"}
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif"}
+REPORT_BATCH = 16
+ONNX_OPSET = 13
+
+
+@dataclass
+class ModelSpec:
+    module: object
+    input_shape: tuple
+    build: Callable[[], object]
+    threshold: Optional[float] = None  # Multi-Label: Tag-Übereinstimmung messen
+
+
+def _load_nsfw():
+    import tensorflow as tf
+
+    if nsfw_scanner.predict is not None:
+        try:
+            return nsfw_scanner.predict.load_model(str(nsfw_scanner.MODEL_PATH))
+        except Exception:
+            logger.exception("predict.load_model fehlgeschlagen, versuche tf.keras")
+    return tf.keras.models.load_model(str(nsfw_scanner.MODEL_PATH), compile=False)
+
+
+def _load_mobilenet():
+    from tensorflow.keras.applications.mobilenet_v2 import MobileNetV2
+
+    return MobileNetV2(weights="imagenet")
+
+
+def _load_deepdanbooru():
+    import tensorflow as tf
+
+    return tf.keras.models.load_model(str(deepdanbooru_tags.MODEL_FILE), compile=False)
+
+
+MODELS: Dict[str, ModelSpec] = {
+    nsfw_scanner.BACKEND_NAME: ModelSpec(nsfw_scanner, nsfw_scanner.INPUT_SHAPE, _load_nsfw),
+    tagging.BACKEND_NAME: ModelSpec(tagging, tagging.INPUT_SHAPE, _load_mobilenet),
+    deepdanbooru_tags.BACKEND_NAME: ModelSpec(
+        deepdanbooru_tags,
+        deepdanbooru_tags.INPUT_SHAPE,
+        _load_deepdanbooru,
+        deepdanbooru_tags.THRESHOLD,
+    ),
+}
+
+
+# ---------- conversion ----------
+def _concrete(model, input_shape):
+    import tensorflow as tf
+
+    spec = tf.TensorSpec((None, *input_shape), tf.float32, name="images")
+    fn = tf.function(
+        lambda x: model(x, training=False), input_signature=[spec], autograph=False
+    )
+    return fn, spec
+
+
+def to_tflite(model, target: Path, *, int8: bool = False) -> None:
+    import tensorflow as tf
+
+    # from_keras_model übernimmt die Gewichte; Batch bleibt dynamisch
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if int8:
+        # Dynamic-Range-Quantisierung: int8-Gewichte, float32 Ein-/Ausgabe
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    target.write_bytes(converter.convert())
+
+
+def to_onnx(model, input_shape, target: Path) -> None:
+    import tf2onnx
+
+    fn, spec = _concrete(model, input_shape)
+    tf2onnx.convert.from_function(
+        fn, input_signature=[spec], opset=ONNX_OPSET, output_path=str(target)
+    )
+
+
+def quantize_onnx(source: Path, target: Path) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(source), str(target), weight_type=QuantType.QInt8)
+
+
+def convert(names: Sequence[str], formats: Sequence[str], out_dir: Path) -> List[Path]:
+    """Write float32 and int8 variants of ``names`` in ``formats``."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+    for name in names:
+        spec = MODELS[name]
+        model = spec.build()
+        for fmt in formats:
+            backend = FORMATS[fmt]
+            f32 = out_dir / inference.converted_path(name, backend, "float32").name
+            i8 = out_dir / inference.converted_path(name, backend, "int8").name
+            start = time.perf_counter()
+            if fmt == "onnx":
+                to_onnx(model, spec.input_shape, f32)
+                quantize_onnx(f32, i8)
+            else:
+                to_tflite(model, f32)
+                to_tflite(model, i8, int8=True)
+            for path in (f32, i8):
+                print(f"{path}  {path.stat().st_size / 1e6:8.1f} MB")
+            logger.info("%s/%s konvertiert in %.1fs", name, fmt, time.perf_counter() - start)
+            written += [f32, i8]
+    return written
+
+
+# ---------- accuracy report ----------
+def load_samples(directory: Path, limit: int) -> List[ImageContext]:
+    contexts = []
+    for path in sorted(directory.iterdir()):
+        if path.suffix.lower() not in IMAGE_SUFFIXES:
+            continue
+        ctx = ImageContext(path.read_bytes())
+        if ctx.is_valid():
+            contexts.append(ctx)
+        if len(contexts) >= limit:
+            break
+    return contexts
+
+
+def _run(predict: Callable, batch: np.ndarray):
+    """Predict in chunks; returns ``(outputs, ms per image)``."""
+    outputs = []
+    start = time.perf_counter()
+    for i in range(0, len(batch), REPORT_BATCH):
+        outputs.append(np.asarray(predict(batch[i:i + REPORT_BATCH]), dtype=np.float32))
+    elapsed = (time.perf_counter() - start) * 1000.0
+    return np.concatenate(outputs), round(elapsed / len(batch), 2)
+
+
+def compare(reference: np.ndarray, output: np.ndarray, threshold: Optional[float]) -> Dict[str, float]:
+    """Accuracy delta of ``output`` against the TF ``reference``."""
+    diff = np.abs(reference - output)
+    delta = {
+        "max_abs": round(float(diff.max()), 5),
+        "mean_abs": round(float(diff.mean()), 6),
+        "top1_agreement": round(
+            float((reference.argmax(axis=1) == output.argmax(axis=1)).mean()), 4
+        ),
+    }
+    if threshold is not None:
+        ref, out = reference > threshold, output > threshold
+        union = (ref | out).sum(axis=1)
+        jaccard = np.where(union > 0, (ref & out).sum(axis=1) / np.maximum(union, 1), 1.0)
+        delta["tag_jaccard"] = round(float(jaccard.mean()), 4)
+    return delta
+
+
+def report(names: Sequence[str], contexts: List[ImageContext], converted_dir: Path) -> Dict[str, object]:
+    results: Dict[str, object] = {"samples": len(contexts), "models": {}}
+    for name in names:
+        spec = MODELS[name]
+        batch = np.stack([spec.module.preprocess(c) for c in contexts])
+        reference, ref_ms = _run(inference.compile_model(spec.build(), spec.input_shape), batch)
+        rows = {"tensorflow": {"ms_per_image": ref_ms}}
+        for backend in FORMATS.values():
+            for precision in inference.PRECISIONS:
+                path = converted_dir / inference.converted_path(name, backend, precision).name
+                if not path.exists():
+                    continue
+                output, ms = _run(inference.open_converted(path, backend), batch)
+                rows[f"{backend}/{precision}"] = {
+                    "ms_per_image": ms,
+                    "size_mb": round(path.stat().st_size / 1e6, 1),
+                    **compare(reference, output, spec.threshold),
+                }
+        results["models"][name] = rows
+    return results
+
+
+def _print_report(result: Dict[str, object]) -> None:
+    print(f"samples: {result['samples']}")
+    for name, rows in result["models"].items():
+        print(f"\n{name}")
+        for variant, row in rows.items():
+            fields = "  ".join(f"{k}={v}" for k, v in row.items())
+            print(f"  {variant:<22} {fields}")
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Convert models to ONNX/TFLite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    conv = sub.add_parser("convert", help="write float32 and int8 variants")
+    conv.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    conv.add_argument("--formats", nargs="+", choices=list(FORMATS), default=list(FORMATS))
+    conv.add_argument("--out", type=Path, default=inference.CONVERTED_DIR)
+
+    rep = sub.add_parser("report", help="accuracy delta against TensorFlow")
+    rep.add_argument("--samples", type=Path, required=True, help="directory with sample images")
+    rep.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    rep.add_argument("--converted", type=Path, default=inference.CONVERTED_DIR)
+    rep.add_argument("--limit", type=int, default=200)
+    rep.add_argument("--json", type=Path, help="also write the report to this file")
+
+    args = parser.parse_args(argv)
+    if inference.tf is None:
+        print("TensorFlow is required for conversion and reference runs", file=sys.stderr)
+        return 1
+    if args.command == "convert":
+        convert(args.models, args.formats, args.out)
+        return 0
+
+    contexts = load_samples(args.samples, args.limit)
+    if not contexts:
+        print(f"no images in {args.samples}", file=sys.stderr)
+        return 1
+    result = report(args.models, contexts, args.converted)
+    _print_report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
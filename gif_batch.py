@@ -1,11 +1,35 @@
 # gif_batch.py
-import asyncio, subprocess, tempfile, uuid, os, shutil, mimetypes
+import asyncio, logging, re, subprocess, tempfile, threading, uuid, os
 from pathlib import Path
+
+import numpy as np
+
+import metrics
 from modules import nsfw_scanner, tagging, deepdanbooru_tags
+from modules.image_context import ImageContext, call_process_image
+
+logger = logging.getLogger(__name__)
 
 GIF_STEP   = 5
 VIDEO_STEP = 20
 MAX_OUT_FRAMES = 60                     # hard cap für ffmpeg
+FRAME_SIZE = 512                        # Rohframes in DeepDanbooru-Größe
+# ffmpeg liefert Kandidaten im Schritt step // SAMPLE_REFINE; bewertet wird
+# regulär jeder SAMPLE_REFINE-te, an Szenenwechseln jeder Kandidat
+SAMPLE_REFINE = int(os.getenv("PIXAI_GIF_SAMPLE_REFINE", "2"))
+# max. Hamming-Abstand (von 64 Bit), ab dem Frames als Duplikat gelten
+DEDUP_DISTANCE = int(os.getenv("PIXAI_GIF_DEDUP_DISTANCE", "6"))
+# Abstand zweier regulärer Samples, ab dem dazwischen dicht gesampelt wird
+SCENE_DISTANCE = int(os.getenv("PIXAI_GIF_SCENE_DISTANCE", "12"))
+# Frames pro predict-Aufruf und Modell
+MAX_FRAME_BATCH = int(os.getenv("PIXAI_GIF_MAX_BATCH", "16"))
+MAX_TAGS = 200
+TERMINAL_RISK = 1.0                     # ab hier steht das Urteil fest
+# Opt-in: NSFW-Score, ab dem nach dem aktuellen Chunk abgebrochen wird, z. B.
+# 0.95. Standard 1.1 = nie, denn sonst fehlen Tags der restlichen Frames
+# gegenüber dem Vollscan; ohne Angabe endet der Scan nur bei TERMINAL_RISK.
+NSFW_DECISIVE = float(os.getenv("PIXAI_GIF_NSFW_DECISIVE", "1.1"))
+
 FFMPEG = Path(
     os.getenv(
         "FFMPEG_BIN",
@@ -14,76 +38,315 @@ FFMPEG = Path(
     )
 )
 
+
+# ───────── Frame-Puffer ─────────
+class FramePool:
+    """Reusable ``FRAME_SIZE x FRAME_SIZE x 3`` uint8 frame buffers."""
+
+    def __init__(self, size: int = FRAME_SIZE, limit: int = 4 * MAX_OUT_FRAMES):
+        self.shape = (size, size, 3)
+        self.limit = limit
+        self._free: list[np.ndarray] = []
+        self._lock = threading.Lock()
+
+    def checkout(self) -> np.ndarray:
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return np.empty(self.shape, dtype=np.uint8)
+
+    def release(self, frames) -> None:
+        with self._lock:
+            for frame in frames:
+                if len(self._free) >= self.limit:
+                    break
+                self._free.append(frame)
+
+
+_POOL = FramePool()
+
+
 # ───────── Frame-Extraktion ─────────
-def _extract_frames(src: Path) -> tuple[list[Path], Path]:
-    out_dir = Path(tempfile.mkdtemp())
-    cmd = [
-        str(FFMPEG), "-hide_banner", "-loglevel", "error",
-        "-i", str(src),
-        "-vframes", str(MAX_OUT_FRAMES),        # ⟵ hart limitieren
-        f"{out_dir}/frame_%05d.png",
+def _max_samples(step: int) -> int:
+    return -(-MAX_OUT_FRAMES // step) + 1
+
+# eine showinfo-Zeile pro Quellframe (vor dem Sampling)
+_SHOWINFO_RE = re.compile(rb"\[Parsed_showinfo[^\]]*\] n:\s*\d+")
+
+def _ffmpeg_cmd(src: str, step: int) -> list[str]:
+    # Sampling direkt in ffmpeg: jedes step-te der ersten MAX_OUT_FRAMES
+    # Frames plus das letzte davon; alle anderen werden nie ausgegeben.
+    # showinfo vor select protokolliert jeden Quellframe -> frameCount.
+    last = MAX_OUT_FRAMES - 1
+    vf = (
+        f"trim=end_frame={MAX_OUT_FRAMES},showinfo,"
+        f"select=max(not(mod(n\\,{step}))\\,eq(n\\,{last})),"
+        f"scale={FRAME_SIZE}:{FRAME_SIZE}"
+    )
+    return [
+        str(FFMPEG), "-hide_banner", "-loglevel", "info",
+        "-i", src,
+        "-vf", vf, "-fps_mode", "passthrough",
+        "-frames:v", str(_max_samples(step)),   # ⟵ hart limitieren
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1",
     ]
-    subprocess.run(cmd, check=True)
-    return sorted(out_dir.glob("frame_*.png")), out_dir
-
-def _sample_indices(total: int, step: int) -> list[int]:
-    idx = {0, total - 1} | set(range(0, total, step))
-    return sorted(i for i in idx if i < total)
-
-def _risk_from(nsfw_res, ddb_res) -> float:
-    if not isinstance(nsfw_res, dict):
-        return 0.0
-    base = max(nsfw_res.get(k, 0.0) for k in ("hentai", "porn", "sexy"))
-    if isinstance(ddb_res, list):
-        if any(isinstance(t, dict) and t.get("label") == "rating:explicit"      for t in ddb_res):
-            base = max(base, 1.0)
-        if any(isinstance(t, dict) and t.get("label") == "rating:questionable" for t in ddb_res):
-            base = max(base, 0.7)
-    return round(base, 3)
+
+def _feed(stdin, buf) -> None:
+    try:
+        stdin.write(buf)
+    except (BrokenPipeError, OSError):
+        pass                                    # ffmpeg hat genug gelesen
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+def _drain(stream, out: list) -> None:
+    out.append(stream.read())                   # stderr parallel leeren, sonst blockiert ffmpeg
+
+def _read_frame(stream, frame: np.ndarray) -> bool:
+    view = memoryview(frame).cast("B")
+    got = 0
+    while got < len(view):
+        n = stream.readinto(view[got:])
+        if not n:
+            return False                        # EOF (Rest eines Frames verwerfen)
+        got += n
+    return True
+
+def _run_ffmpeg(buf, step: int, src: str | None = None) -> tuple[list[np.ndarray], int]:
+    proc = subprocess.Popen(
+        _ffmpeg_cmd(src or "pipe:0", step),
+        stdin=subprocess.PIPE if src is None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    feeder = None
+    if src is None:
+        feeder = threading.Thread(target=_feed, args=(proc.stdin, buf), daemon=True)
+        feeder.start()
+    errors: list[bytes] = []
+    reader = threading.Thread(target=_drain, args=(proc.stderr, errors), daemon=True)
+    reader.start()
+    frames: list[np.ndarray] = []
+    try:
+        while len(frames) < _max_samples(step):
+            frame = _POOL.checkout()
+            if not _read_frame(proc.stdout, frame):
+                _POOL.release([frame])
+                break
+            frames.append(frame)
+        proc.stdout.read()
+        proc.wait()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        _POOL.release(frames)
+        raise
+    finally:
+        if feeder is not None:
+            feeder.join()
+        reader.join()
+        proc.stdout.close()
+        proc.stderr.close()
+    err = b"".join(errors)
+    if proc.returncode != 0 and not frames:
+        raise subprocess.CalledProcessError(proc.returncode, str(FFMPEG), stderr=err)
+    return frames, len(_SHOWINFO_RE.findall(err))
+
+def _extract_frames(buf, step: int) -> tuple[list[np.ndarray], int]:
+    """Decode the sampled frames of ``buf`` as ``FRAME_SIZE`` RGB arrays.
+
+    Also returns the number of source frames (up to ``MAX_OUT_FRAMES``).
+    The upload is streamed to ffmpeg on stdin. Containers that need seeking
+    (e.g. MP4 with the index at the end) fall back to a temp file.
+    """
+    try:
+        return _run_ffmpeg(buf, step)
+    except subprocess.CalledProcessError:
+        tmp = Path(tempfile.gettempdir()) / f"batch_{uuid.uuid4()}.bin"
+        try:
+            tmp.write_bytes(buf)
+            return _run_ffmpeg(None, step, str(tmp))
+        finally:
+            tmp.unlink(missing_ok=True)
+
+# ───────── Frame-Hashes ─────────
+def _frame_hashes(frames: list[np.ndarray]) -> np.ndarray:
+    """64-bit dHash per frame, computed for all frames at once."""
+    small = np.stack([f[::8, ::8] for f in frames]).astype(np.float32).mean(axis=3)
+    n, h, w = small.shape
+    rows = np.linspace(0, h, 9, dtype=int)
+    cols = np.linspace(0, w, 10, dtype=int)
+    grid = np.add.reduceat(np.add.reduceat(small, rows[:-1], axis=1), cols[:-1], axis=2)
+    grid /= np.outer(np.diff(rows), np.diff(cols))
+    bits = grid[:, :, 1:] > grid[:, :, :-1]
+    return np.packbits(bits.reshape(n, 64), axis=1).view(">u8").ravel()
+
+def _hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    x = np.ascontiguousarray(np.bitwise_xor(a, b), dtype=">u8")
+    return np.unpackbits(x.view(np.uint8).reshape(*x.shape, 8), axis=-1).sum(axis=-1)
+
+def _dedup(hashes: np.ndarray) -> tuple[list[int], np.ndarray]:
+    """Collapse near-identical frames.
+
+    Returns the representative frame indices and, for every frame, the
+    position of its group in that list. Static stretches collapse into one
+    representative while scene changes keep every differing frame.
+    """
+    dist = _hamming(hashes[:, None], hashes[None, :])
+    reps: list[int] = []
+    group = np.empty(len(hashes), dtype=np.intp)
+    for i in range(len(hashes)):
+        if reps:
+            d = dist[i, reps]
+            j = int(d.argmin())
+            if d[j] <= DEDUP_DISTANCE:
+                group[i] = j
+                continue
+        group[i] = len(reps)
+        reps.append(i)
+    return reps, group
+
+def _adaptive_sample(hashes: np.ndarray, refine: int = SAMPLE_REFINE) -> list[int]:
+    """Candidate frames to evaluate, denser around scene changes.
+
+    Every ``refine``-th candidate and the last one form the regular sample.
+    Where two neighbouring regular samples differ by more than
+    ``SCENE_DISTANCE`` bits, all candidates between them are added. Static
+    stretches keep only the regular samples, and :func:`_dedup` collapses
+    those further.
+    """
+    n = len(hashes)
+    regular = list(range(0, n, max(1, refine)))
+    if regular[-1] != n - 1:
+        regular.append(n - 1)
+    picked = set(regular)
+    change = _hamming(hashes[regular[1:]], hashes[regular[:-1]])
+    for lo, hi, dist in zip(regular, regular[1:], change):
+        if dist > SCENE_DISTANCE:
+            picked.update(range(lo + 1, hi))
+    return sorted(picked)
+
+def _risk_order(hashes: np.ndarray, reps: list[int]) -> list[int]:
+    """Scan order over ``reps``: first, last, then the biggest scene changes."""
+    n = len(reps)
+    if n <= 2:
+        return list(range(n))
+    idx = np.asarray(reps[1:-1])
+    change = _hamming(hashes[idx], hashes[idx - 1])
+    keyed = np.arange(1, n - 1)[np.argsort(-change, kind="stable")]
+    return [0, n - 1, *keyed.tolist()]
+
+def _risk_from(nsfw: np.ndarray, ddb_hits, ddb_tags) -> np.ndarray:
+    """Per-frame risk from NSFW scores and DeepDanbooru ratings."""
+    risk = nsfw[:, nsfw_scanner.NSFW_INDEX].max(axis=1).astype(np.float64)
+    if ddb_hits is not None:
+        for label, value in (("rating:explicit", 1.0), ("rating:questionable", 0.7)):
+            if label in ddb_tags:
+                hit = ddb_hits[:, ddb_tags.index(label)]
+                risk = np.where(hit, np.maximum(risk, value), risk)
+    return risk.round(3)
 
 # ───────── Haupt-Batch-Scan ─────────
 async def scan_batch(buf: bytes, mime: str = "") -> dict:
-    tmp = Path(tempfile.gettempdir()) / f"batch_{uuid.uuid4()}.bin"
-    tmp.write_bytes(buf)
+    loop = asyncio.get_running_loop()
+    step = VIDEO_STEP if ("video" in mime and "gif" not in mime) else GIF_STEP
 
-    frames, tmp_dir = _extract_frames(tmp)
-    total = len(frames)
-    if total == 0:
-        shutil.rmtree(tmp_dir, ignore_errors=True); tmp.unlink(missing_ok=True)
-        return {"risk": 0.0, "tags": [], "frameCount": 0}
+    # ffmpeg blockiert -> nicht im Event-Loop ausführen
+    with metrics.stage("batch.frames"):
+        frames, source = await loop.run_in_executor(
+            None, _extract_frames, buf, max(1, step // SAMPLE_REFINE)
+        )
+    try:
+        # ohne showinfo-Zeilen (fremdes Log-Format) mindestens die Samples
+        return await _scan_frames(loop, frames, max(source, len(frames)))
+    finally:
+        _POOL.release(frames)
 
-    step   = VIDEO_STEP if ("video" in mime and "gif" not in mime) else GIF_STEP
-    sample = [frames[i] for i in _sample_indices(total, step)]
+def _nsfw_scores(contexts: list[ImageContext]) -> np.ndarray:
+    try:
+        return nsfw_scanner.predict_scores(contexts)
+    except Exception:
+        # Einzelbild-Pfad (inkl. Temp-Datei-Fallback des Moduls)
+        results = [call_process_image(nsfw_scanner.process_image, c) for c in contexts]
+        return np.array([
+            [float(r.get(k) or 0.0) if isinstance(r, dict) else 0.0
+             for k in nsfw_scanner.CATEGORIES]
+            for r in results
+        ], dtype=np.float32)
+
+def _try(fn, contexts, stage: str):
+    try:
+        with metrics.stage(stage):
+            return fn(contexts)
+    except Exception:
+        logger.exception("Batch-Inferenz %s fehlgeschlagen", fn.__module__)
+        return None
+
+async def _scan_frames(loop, frames: list[np.ndarray], source: int) -> dict:
+    """Scan the sampled ``frames`` of an animation with ``source`` frames."""
+    if not frames:
+        return {"risk": 0.0, "tags": [], "frameCount": source, "framesSampled": 0,
+                "uniqueFrames": 0, "framesEvaluated": 0}
 
-    loop      = asyncio.get_running_loop()
     max_risk  = 0.0
     tag_union = set()
+    ddb_seen  = None                    # bool-Maske über alle DeepDanbooru-Tags
+    ddb_tags  = []
 
-    async def _scan(p: Path):
-        data = p.read_bytes()
-        nsfw = await loop.run_in_executor(None, nsfw_scanner.process_image,      data)
-        tag  = await loop.run_in_executor(None, tagging.process_image,           data)
-        ddb  = await loop.run_in_executor(None, deepdanbooru_tags.process_image, data)
-        return nsfw, tag, ddb
+    # adaptiv sampeln und Duplikate vor jedem Modell zusammenfassen
+    with metrics.stage("batch.dedup"):
+        hashes      = _frame_hashes(frames)
+        picked      = _adaptive_sample(hashes)
+        hashes      = hashes[picked]
+        reps, group = _dedup(hashes)
+        order       = _risk_order(hashes, reps)
+    contexts    = [ImageContext.from_array(frames[picked[i]]) for i in reps]
+    done        = np.zeros(len(reps), dtype=bool)
 
-    for nsfw_res, tag_res, ddb_res in await asyncio.gather(*[_scan(f) for f in sample]):
-        max_risk = max(max_risk, _risk_from(nsfw_res, ddb_res))
+    for start in range(0, len(order), MAX_FRAME_BATCH):
+        batch = order[start:start + MAX_FRAME_BATCH]
+        chunk = [contexts[i] for i in batch]
+        with metrics.stage("batch.nsfw"):
+            nsfw = await loop.run_in_executor(None, _nsfw_scores, chunk)
+        done[batch] = True
 
-        for mod_res in (tag_res, ddb_res):
-            if not isinstance(mod_res, dict):  # Fehlerfall
-                continue
-            for t in mod_res.get("tags", []):
-                if isinstance(t, dict) and "label" in t:
-                    tag_union.add(t["label"])
+        # je Modell ein Batch-predict, beide parallel
+        tag_preds, ddb_out = await asyncio.gather(
+            loop.run_in_executor(None, _try, tagging.predict_batch, chunk, "batch.tagging"),
+            loop.run_in_executor(
+                None, _try, deepdanbooru_tags.predict_batch, chunk, "batch.deepdanbooru"
+            ),
+        )
+        ddb_hits = None
+        if ddb_out is not None:
+            ddb_scores, ddb_tags = ddb_out
+            ddb_hits = ddb_scores > deepdanbooru_tags.tag_thresholds()
+            hits = ddb_hits.any(axis=0)
+            ddb_seen = hits if ddb_seen is None else ddb_seen | hits
+        if tag_preds is not None:
+            tag_union.update(t["label"] for row in tagging.decode(tag_preds) for t in row)
 
-        if max_risk >= 1.0:          # Early-Exit wenn sicher NSFW
+        max_risk = max(max_risk, float(_risk_from(nsfw, ddb_hits, ddb_tags).max()))
+        if max_risk >= TERMINAL_RISK:   # Early-Exit wenn sicher NSFW
+            break
+        # NSFW allein eindeutig -> restliche Chunks überspringen; die Tags der
+        # bereits bewerteten Frames sind oben schon erfasst
+        if float(nsfw[:, nsfw_scanner.NSFW_INDEX].max()) >= NSFW_DECISIVE:
             break
 
-    shutil.rmtree(tmp_dir, ignore_errors=True)
-    tmp.unlink(missing_ok=True)
+    if ddb_seen is not None:
+        tag_union.update(ddb_tags[i] for i in np.flatnonzero(ddb_seen))
 
     return {
         "risk": max_risk,
-        "tags": sorted(tag_union)[:200],
-        "frameCount": total
+        "tags": sorted(tag_union)[:MAX_TAGS],
+        # frameCount wie bisher: Frames der Animation (bis MAX_OUT_FRAMES)
+        "frameCount": source,
+        "framesSampled": len(picked),
+        "uniqueFrames": len(reps),
+        # Urteil eines Repräsentanten gilt für seine ganze Gruppe
+        "framesEvaluated": int(done[group].sum()),
     }
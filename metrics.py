@@ -0,0 +1,306 @@
+"""In-process metrics with a Prometheus text exposition for ``/metrics``.
+
+Counters, gauges and histograms are kept per label set in plain dicts
+behind one lock per metric; recording a value costs a dict lookup and, for
+histograms, a ``bisect``. Nothing is computed until :func:`render` is
+called by a scrape. Values that already exist elsewhere (queue depths,
+cache counters, batch histograms) are not recorded twice: gauges take a
+``callback`` and :func:`register_collector` adds families that are read
+from the owning component at scrape time.
+
+The shared families are defined here so that ``scanner_api``, the async
+server and ``gif_batch`` record into the same series::
+
+    with metrics.stage("validate"):
+        ...
+    metrics.UPLOAD_BYTES.observe(len(data), endpoint="check")
+"""
+
+from __future__ import annotations
+
+import abc
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]  # (Suffix, Labels, Wert)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_family(name: str, kind: str, help_text: str, samples: Iterable[Sample]) -> List[str]:
+    """Exposition lines of one metric family."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for suffix, labels, value in samples:
+        if labels:
+            body = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+            lines.append(f"{name}{suffix}{{{body}}} {_number(value)}")
+        else:
+            lines.append(f"{name}{suffix} {_number(value)}")
+    return lines
+
+
+class Metric(abc.ABC):
+    """Base of the metric types; subclasses set ``kind`` and ``samples``."""
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Labels, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Labels:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labels(self, key: Labels) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    @abc.abstractmethod
+    def samples(self) -> List[Sample]:
+        """``(suffix, labels, value)`` tuples in exposition order."""
+
+    def render(self) -> List[str]:
+        return format_family(self.name, self.kind, self.help, self.samples())
+
+
+class Counter(Metric):
+    """Monotonically increasing value per label set; names end in ``_total``."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [("", self._labels(k), v) for k, v in sorted(items)]
+
+
+class Gauge(Metric):
+    """Current value per label set, or read from ``callback`` on scrape.
+
+    ``callback`` returns a number, or for labelled gauges a dict of label
+    tuples to numbers.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), *, callback: Optional[Callable] = None):
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[Sample]:
+        if self.callback is not None:
+            value = self.callback()
+            if not isinstance(value, dict):
+                return [("", {}, float(value))]
+            items = [(tuple(map(str, k if isinstance(k, tuple) else (k,))), v) for k, v in value.items()]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [("", self._labels(k), float(v)) for k, v in sorted(items)]
+
+
+class Histogram(Metric):
+    """Bucketed observations per label set (upper bounds, ``le``)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), *, buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [Zähler je Bucket + Inf, Summe]
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][idx] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = [(k, list(counts), total) for k, (counts, total) in self._values.items()]
+        out: List[Sample] = []
+        for key, counts, total in sorted(items):
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                out.append(("_bucket", {**labels, "le": _number(bound)}, cumulative))
+            out.append(("_sum", labels, total))
+            out.append(("_count", labels, cumulative))
+        return out
+
+
+def histogram_samples(labels: Dict[str, str], snapshot: Dict[str, object]) -> List[Sample]:
+    """Samples of a ``modules.batching.Histogram`` snapshot (counts per bucket)."""
+    out: List[Sample] = []
+    cumulative = 0
+    for bound, count in snapshot["buckets"].items():
+        cumulative += count
+        le = "+Inf" if bound == "+Inf" else _number(float(bound))
+        out.append(("_bucket", {**labels, "le": le}, cumulative))
+    out.append(("_sum", labels, snapshot["sum"]))
+    out.append(("_count", labels, snapshot["count"]))
+    return out
+
+
+class Registry:
+    """Named metrics plus collectors that produce lines at scrape time."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: Dict[str, Callable[[], List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """Add ``metric``; an existing one of the same name is returned instead."""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def register_collector(self, name: str, collector: Callable[[], List[str]]) -> None:
+        """Add or replace a collector returning exposition lines."""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.items())
+        lines: List[str] = []
+        for metric in metrics:
+            lines += metric.render()
+        for name, collector in collectors:
+            try:
+                lines += collector()
+            except Exception as exc:
+                # ein defekter Collector darf den Scrape nicht verhindern
+                lines.append(f"# collector {name} failed: {_escape(str(exc))}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help_text, labelnames))
+
+
+def gauge(name: str, help_text: str, labelnames: Sequence[str] = (), *, callback=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help_text, labelnames, callback=callback))
+
+
+def histogram(name: str, help_text: str, labelnames: Sequence[str] = (), *, buckets=LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help_text, labelnames, buckets=buckets))
+
+
+def register_collector(name: str, collector: Callable[[], List[str]]) -> None:
+    REGISTRY.register_collector(name, collector)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# ---------- gemeinsame Metriken ----------
+REQUEST_SECONDS = histogram(
+    "pixai_request_seconds", "Request latency by endpoint and status", ("endpoint", "status")
+)
+REQUESTS_IN_FLIGHT = gauge("pixai_requests_in_flight", "Requests being processed", ("endpoint",))
+UPLOAD_BYTES = histogram(
+    "pixai_upload_bytes", "Size of uploaded files", ("endpoint",), buckets=SIZE_BUCKETS
+)
+STAGE_SECONDS = histogram(
+    "pixai_stage_seconds", "Time spent per processing stage and module", ("stage",)
+)
+STAGE_ERRORS = counter(
+    "pixai_stage_errors_total", "Failed stages by kind (error, timeout)", ("stage", "kind")
+)
+
+
+@contextmanager
+def request(endpoint: str) -> Iterator[Dict[str, int]]:
+    """Count ``endpoint`` as in flight for the block, then record its latency.
+
+    Set ``["status"]`` on the yielded dict; it stays 500 if the block raises.
+    """
+    state = {"status": 500}
+    start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+    try:
+        yield state
+    finally:
+        REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, status=state["status"])
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block as ``pixai_stage_seconds{stage=name}``; exceptions count as errors."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name, kind="error")
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
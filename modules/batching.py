@@ -0,0 +1,191 @@
+"""Cross-request micro-batching for model inference.
+
+Concurrent requests each submit a single preprocessed sample. A worker
+thread per model collects samples until ``max_batch_size`` is reached or the
+oldest sample has waited ``max_wait_ms``, stacks them into one tensor, runs a
+single ``predict`` and hands every caller its row through a
+:class:`concurrent.futures.Future`.
+
+Batch sizes and queue wait times are recorded in histograms that are
+reported through :func:`get_statistics`.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = int(os.getenv("PIXAI_BATCH_MAX_SIZE", "8"))
+MAX_WAIT_MS = float(os.getenv("PIXAI_BATCH_MAX_WAIT_MS", "5"))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+WAIT_MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class Histogram:
+    """Thread-safe histogram with fixed upper bucket bounds."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        labels = [str(b) for b in self.buckets] + ["+Inf"]
+        return {
+            "buckets": dict(zip(labels, counts)),
+            "count": sum(counts),
+            "sum": round(total, 3),
+        }
+
+
+class _Request:
+    __slots__ = ("sample", "future", "enqueued")
+
+    def __init__(self, sample: np.ndarray):
+        self.sample = sample
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+
+
+class BatchScheduler:
+    """Gather single samples from many threads into batched predictions."""
+
+    def __init__(
+        self,
+        name: str,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        *,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+    ):
+        self.name = name
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size or MAX_BATCH_SIZE)
+        self.max_wait = (MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(WAIT_MS_BUCKETS)
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name=f"batch-{name}", daemon=True
+        )
+        self._thread.start()
+
+    # ---------- public API ----------
+    def submit(self, sample: np.ndarray) -> Future:
+        """Queue one sample (without batch dimension) for prediction."""
+        req = _Request(sample)
+        self._queue.put(req)
+        return req.future
+
+    def predict(self, sample: np.ndarray, timeout: Optional[float] = None) -> np.ndarray:
+        """Blocking helper returning the prediction row for ``sample``."""
+        return self.submit(sample).result(timeout)
+
+    def predict_many(self, samples: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """Submit several samples at once and wait for all rows."""
+        futures = [self.submit(s) for s in samples]
+        return [f.result() for f in futures]
+
+    def close(self) -> None:
+        """Stop the worker thread after the queued requests are served."""
+        self._queue.put(None)
+
+    def get_statistics(self) -> Dict[str, object]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queued": self._queue.qsize(),
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+        }
+
+    # ---------- worker ----------
+    def _collect(self, first: _Request) -> tuple[List[_Request], bool]:
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    req = self._queue.get(timeout=remaining)
+                else:
+                    req = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if req is None:
+                return batch, True
+            batch.append(req)
+        return batch, False
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stop = self._collect(first)
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.monotonic()
+            for req in batch:
+                self.queue_wait_ms.observe((started - req.enqueued) * 1000.0)
+            self.batch_sizes.observe(len(batch))
+            try:
+                outputs = self.predict_fn(np.stack([r.sample for r in batch]))
+            except Exception as exc:
+                logger.exception("Batched prediction failed for %s", self.name)
+                for req in batch:
+                    req.future.set_exception(exc)
+                continue
+            for req, row in zip(batch, outputs):
+                req.future.set_result(row)
+
+
+_SCHEDULERS: Dict[str, BatchScheduler] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_scheduler(
+    name: str,
+    predict_fn: Callable[[np.ndarray], np.ndarray],
+    **kwargs,
+) -> BatchScheduler:
+    """Return the scheduler for ``name``, replacing it if the model changed."""
+    with _REGISTRY_LOCK:
+        sched = _SCHEDULERS.get(name)
+        if sched is not None and sched.predict_fn == predict_fn:
+            return sched
+        if sched is not None:
+            sched.close()
+        sched = BatchScheduler(name, predict_fn, **kwargs)
+        _SCHEDULERS[name] = sched
+        return sched
+
+
+def get_statistics() -> Dict[str, object]:
+    """Return batch size and queue wait histograms for every model."""
+    with _REGISTRY_LOCK:
+        scheds = dict(_SCHEDULERS)
+    return {name: s.get_statistics() for name, s in scheds.items()}
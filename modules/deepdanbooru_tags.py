@@ -3,15 +3,29 @@
 This module applies a DeepDanbooru model to classify anime style or AI
 generated images. The result mirrors the ``modules.tagging`` output and
 returns a list of tags with confidence scores.
+
+Post-processing is vectorized: the tag list is split once into index
+arrays for the ``general``, ``character`` and ``rating`` ranges
+(``categories.json``, else ``tags-general.txt``/``tags-character.txt``),
+and each category is filtered with its own threshold and optional limit
+(``PIXAI_DDB_<CATEGORY>_THRESHOLD`` / ``PIXAI_DDB_<CATEGORY>_LIMIT``).
+Dicts are only built for the tags that are returned.
 """
 
+import heapq
+import json
 import logging
-from io import BytesIO
+import os
 from pathlib import Path
+from typing import Dict, List, Optional
 
 import numpy as np
 from PIL import Image
 
+from . import batching, inference
+from .image_context import ensure_context
+from .model_state import LoadState
+
 logger = logging.getLogger(__name__)
 
 try:
@@ -21,28 +35,168 @@ except Exception:
 
 _MODEL = None
 _TAGS = None
+_TAG_NAMES = None  # np.ndarray der Tag-Namen
+_CATEGORY_INDEX: Dict[str, np.ndarray] = {}
+_TAG_THRESHOLDS = None  # Schwellwert pro Tag (nach Kategorie)
+_SCHEDULER = None
+_LOAD = LoadState()
 PROJECT_PATH = Path(__file__).with_name("deepdanbooru_model")
+IMAGE_DIM = 512
+INPUT_SHAPE = (IMAGE_DIM, IMAGE_DIM, 3)
+INPUT_VARIANTS = (((IMAGE_DIM, IMAGE_DIM), Image.BICUBIC),)  # liest ``preprocess``
+THRESHOLD = 0.2
+MODEL_FILE = PROJECT_PATH / "model-resnet_custom_v3.h5"
+TAGS_FILE = PROJECT_PATH / "tags.txt"
+BACKEND_NAME = "deepdanbooru"
+PRODUCES = {"danbooru_tags": "tags"}
+CATEGORIES = ("general", "character", "rating")
+THRESHOLDS = {
+    c: float(os.getenv(f"PIXAI_DDB_{c.upper()}_THRESHOLD", str(THRESHOLD)))
+    for c in CATEGORIES
+}
+
+
+def _limit(category: str) -> Optional[int]:
+    """``PIXAI_DDB_<CATEGORY>_LIMIT`` or ``None`` (unlimited) if unset."""
+    value = os.getenv(f"PIXAI_DDB_{category.upper()}_LIMIT")
+    return int(value) if value else None
+
+
+LIMITS = {c: _limit(c) for c in CATEGORIES}
 
 
 def _ensure_model():
     """Load DeepDanbooru model and tag list if available."""
-    global _MODEL, _TAGS
     if _MODEL is None:
+        with _LOAD.lock:
+            if _MODEL is None:
+                with _LOAD.loading():
+                    _load_model()
+    return _MODEL, _TAGS
+
+
+def _load_model() -> None:
+    global _MODEL, _TAGS, _SCHEDULER
+    if not PROJECT_PATH.exists():
+        raise FileNotFoundError(f"Model directory missing: {PROJECT_PATH}")
+    with open(TAGS_FILE, "r", encoding="utf-8") as f:
+        tags = [line.strip() for line in f.readlines()]
+    # _MODEL ist der Prädiktor: ONNX/TFLite/Stub oder kompiliertes TF-Modell
+    model = inference.load_converted(BACKEND_NAME, outputs=len(tags))
+    if model is None:
         if tf is None:
             raise RuntimeError("TensorFlow not available")
-        if not PROJECT_PATH.exists():
-            raise FileNotFoundError(f"Model directory missing: {PROJECT_PATH}")
-        model_path = PROJECT_PATH / "model-resnet_custom_v3.h5"
-        tags_path = PROJECT_PATH / "tags.txt"
-        _MODEL = tf.keras.models.load_model(str(model_path), compile=False)
-        with open(tags_path, "r", encoding="utf-8") as f:
-            _TAGS = [line.strip() for line in f.readlines()]
-    return _MODEL, _TAGS
+        model = inference.load_model(
+            MODEL_FILE,
+            INPUT_SHAPE,
+            lambda: tf.keras.models.load_model(str(MODEL_FILE), compile=False),
+        )
+    _TAGS = tags
+    _build_index(_TAGS)
+    _SCHEDULER = batching.get_scheduler("deepdanbooru", model)
+    _MODEL = model
+
+
+def _read_lines(path: Path) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _category_of(tags: List[str]) -> np.ndarray:
+    """Category id (index into ``CATEGORIES``) for every tag."""
+    names = {"general": 0, "character": 1, "system": 2, "rating": 2}
+    cats = np.zeros(len(tags), dtype=np.int8)
+    try:
+        with open(PROJECT_PATH / "categories.json", "r", encoding="utf-8") as f:
+            ranges = sorted(json.load(f), key=lambda c: c["start_index"])
+        for idx, cat in enumerate(ranges):
+            stop = ranges[idx + 1]["start_index"] if idx + 1 < len(ranges) else len(tags)
+            cats[cat["start_index"]:stop] = names.get(cat["name"].lower(), 0)
+    except (OSError, ValueError, KeyError):
+        try:
+            character = set(_read_lines(PROJECT_PATH / "tags-character.txt"))
+        except OSError:
+            character = set()
+        cats[[i for i, t in enumerate(tags) if t in character]] = 1
+    # Ratings unabhängig von der Quelle erkennen
+    cats[[i for i, t in enumerate(tags) if t.startswith("rating:")]] = 2
+    return cats
+
+
+def _build_index(tags: List[str]) -> None:
+    """Precompute name array, category index arrays and per-tag thresholds."""
+    global _TAG_NAMES, _CATEGORY_INDEX, _TAG_THRESHOLDS
+    cats = _category_of(tags)
+    _TAG_NAMES = np.asarray(tags, dtype=object)
+    _CATEGORY_INDEX = {c: np.flatnonzero(cats == i) for i, c in enumerate(CATEGORIES)}
+    _TAG_THRESHOLDS = np.asarray([THRESHOLDS[c] for c in CATEGORIES], dtype=np.float32)[cats]
 
 
-def process_image(data: bytes):
+def tag_thresholds() -> np.ndarray:
+    """Threshold for every tag, in model output order."""
+    _ensure_model()
+    return _TAG_THRESHOLDS
+
+
+def postprocess(scores: np.ndarray) -> Dict[str, List[Dict[str, object]]]:
+    """Select tags per category from one prediction vector.
+
+    Returns ``general``, ``character`` and ``rating`` lists (sorted by
+    score, capped at the category limit if one is set) plus the merged
+    ``tags`` list.
+    """
+    scores = np.asarray(scores, dtype=np.float32).ravel()
+    result = {}
+    for cat in CATEGORIES:
+        idx = _CATEGORY_INDEX[cat]
+        values = scores[idx]
+        hit = np.flatnonzero(values > THRESHOLDS[cat])
+        limit = LIMITS[cat]
+        if limit is not None and len(hit) > limit:
+            hit = hit[np.argpartition(-values[hit], limit - 1)[:limit]] if limit > 0 else hit[:0]
+        hit = hit[np.argsort(-values[hit], kind="stable")]
+        result[cat] = [
+            {"label": label, "score": score}
+            for label, score in zip(_TAG_NAMES[idx[hit]].tolist(), values[hit].tolist())
+        ]
+    result["tags"] = list(
+        heapq.merge(*(result[c] for c in CATEGORIES), key=lambda t: -t["score"])
+    )
+    return result
+
+
+def warmup():
+    """Load the model and run one dummy inference to trigger tracing."""
+    model, _ = _ensure_model()
+    with _LOAD.warming():
+        inference.warmup(model, INPUT_SHAPE)
+
+
+def load_state():
+    return _LOAD.as_dict()
+
+
+def preprocess(context) -> np.ndarray:
+    """Return the ``512x512x3`` model input for an ``ImageContext``."""
+    return context.resized_array((IMAGE_DIM, IMAGE_DIM)).astype(np.float32) / 255.0
+
+
+def predict_batch(contexts):
+    """Raw tag scores for several images in one ``predict`` call.
+
+    Returns ``(scores, tags)`` where ``scores`` has shape
+    ``(len(contexts), len(tags))``. Raises on errors.
+    """
+    if tf is None and not inference.uses_converted(BACKEND_NAME):
+        raise RuntimeError("TensorFlow not installed")
+    model, tags = _ensure_model()
+    batch = np.stack([preprocess(c) for c in contexts])
+    return np.asarray(model(batch), dtype=np.float32), tags
+
+
+def process_image(data: bytes, *, context=None):
     """Return DeepDanbooru tag predictions for the image."""
-    if tf is None:
+    if tf is None and not inference.uses_converted(BACKEND_NAME):
         return {"error": "TensorFlow not installed"}
     try:
         model, tags = _ensure_model()
@@ -51,25 +205,15 @@ def process_image(data: bytes):
         return {"error": str(exc)}
 
     try:
-        with Image.open(BytesIO(data)) as img:
-            img = img.convert("RGB")
-            img = img.resize((512, 512), Image.BICUBIC)
-            arr = np.asarray(img).astype(np.float32) / 255.0
-            arr = arr.reshape((1, 512, 512, 3))
+        arr = preprocess(ensure_context(data, context))
     except Exception as exc:
         logger.exception("Failed to preprocess image")
         return {"error": str(exc)}
 
     try:
-        preds = model.predict(arr)[0]
-        result_tags = [
-            {"label": tag, "score": float(score)}
-            for tag, score in zip(tags, preds)
-            if float(score) > 0.2  # optional Threshold
-        ]
-        result_tags.sort(key=lambda x: x["score"], reverse=True)
-        logger.info("DeepDanbooru tags: %s", result_tags[:5])
-        return {"tags": result_tags}
+        result = postprocess(_SCHEDULER.predict(arr))
+        logger.info("DeepDanbooru tags: %s", result["tags"][:5])
+        return result
     except Exception as exc:
         logger.exception("DeepDanbooru prediction failed")
         return {"error": str(exc)}
@@ -0,0 +1,199 @@
+"""Shared per-request image context.
+
+An upload is decoded exactly once into an RGB image. Resized variants
+(224x224 for MobileNetV2/NSFW, 512x512 for DeepDanbooru, the 1280x720
+thumbnail for storage) are cached on the context so every module of a
+request reuses the same pixels instead of opening the bytes again.
+
+Modules opt in by accepting a ``context`` keyword in ``process_image``.
+Legacy modules with the plain ``process_image(data: bytes)`` signature keep
+working; :func:`call_process_image` dispatches accordingly. Contexts built
+from pixels (worker processes, animation frames) have no upload buffer;
+context-aware modules then get the context itself as ``data`` and only
+``context.data`` encodes a PNG, when a module really needs bytes.
+
+Model modules list the resized arrays their ``preprocess`` reads as
+``INPUT_VARIANTS = ((size, resample), ...)``. The worker processes receive
+only these variants (:meth:`ImageContext.from_variants`), not the original.
+"""
+
+from __future__ import annotations
+
+import inspect
+import threading
+from functools import lru_cache
+from io import BytesIO
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+class ImageContext:
+    """Lazily decoded RGB image shared by all modules of one request."""
+
+    def __init__(self, data: Optional[bytes] = None, *, image: Optional[Image.Image] = None):
+        if data is None and image is None:
+            raise ValueError("ImageContext needs bytes or an image")
+        self._data = data
+        self._image = image.convert("RGB") if image is not None else None
+        self._array: Optional[np.ndarray] = None
+        self._variants: Dict[tuple, Image.Image] = {}
+        self._error: Optional[Exception] = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_array(cls, arr: np.ndarray) -> "ImageContext":
+        """Create a context from an ``HxWx3`` uint8 RGB array."""
+        ctx = cls(image=Image.fromarray(np.ascontiguousarray(arr, dtype=np.uint8), "RGB"))
+        ctx._array = arr
+        return ctx
+
+    @classmethod
+    def from_variants(
+        cls,
+        variants: Dict[tuple, np.ndarray],
+        array: Optional[np.ndarray] = None,
+    ) -> "ImageContext":
+        """Create a context from resized arrays ``{(size, resample): arr}``.
+
+        :meth:`resized_array` serves these variants. Without the full-size
+        ``array`` everything that needs the original image raises
+        ``ValueError``.
+        """
+        if array is not None:
+            ctx = cls.from_array(array)
+        else:
+            ctx = cls.__new__(cls)
+            ctx._data = ctx._image = ctx._array = None
+            ctx._variants = {}
+            ctx._error = ValueError("only resized variants of this image are available")
+            ctx._lock = threading.RLock()
+        for (size, resample), arr in variants.items():
+            ctx._variants[("array", tuple(size), resample)] = arr
+        return ctx
+
+    # ---------- raw data ----------
+    @property
+    def data(self) -> bytes:
+        """Original upload buffer (PNG-encoded for array based contexts)."""
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    buf = BytesIO()
+                    self.image.save(buf, format="PNG")
+                    self._data = buf.getvalue()
+        return self._data
+
+    # ---------- decoded image ----------
+    @property
+    def image(self) -> Image.Image:
+        """Decoded RGB image. Raises the decode error on invalid input."""
+        if self._image is None:
+            with self._lock:
+                if self._image is None:
+                    if self._error is not None:
+                        raise self._error
+                    try:
+                        with Image.open(BytesIO(self._data)) as img:
+                            img.load()
+                            self._image = img.convert("RGB")
+                    except Exception as exc:
+                        self._error = exc
+                        raise
+        return self._image
+
+    def is_valid(self) -> bool:
+        """Return ``True`` if the data could be decoded as an image."""
+        try:
+            self.image
+            return True
+        except Exception:
+            return False
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.image.size
+
+    @property
+    def array(self) -> np.ndarray:
+        """Full-size ``HxWx3`` uint8 RGB array."""
+        if self._array is None:
+            with self._lock:
+                if self._array is None:
+                    self._array = np.asarray(self.image)
+        return self._array
+
+    # ---------- cached variants ----------
+    def resized(
+        self,
+        size: Tuple[int, int],
+        resample: int = Image.BICUBIC,
+    ) -> Image.Image:
+        """Return the image resized to exactly ``size`` (cached)."""
+        key = ("resize", tuple(size), resample)
+        with self._lock:
+            img = self._variants.get(key)
+            if img is None:
+                img = self.image.resize(tuple(size), resample)
+                self._variants[key] = img
+        return img
+
+    def resized_array(
+        self,
+        size: Tuple[int, int],
+        resample: int = Image.BICUBIC,
+    ) -> np.ndarray:
+        """Return the resized variant as ``HxWx3`` uint8 array (cached)."""
+        key = ("array", tuple(size), resample)
+        with self._lock:
+            arr = self._variants.get(key)
+            if arr is None:
+                arr = np.asarray(self.resized(size, resample))
+                self._variants[key] = arr
+        return arr
+
+    def thumbnail(self, max_width: int = 1280, max_height: int = 720) -> Image.Image:
+        """Return the image scaled to fit the box, keeping aspect ratio."""
+        key = ("thumbnail", max_width, max_height)
+        with self._lock:
+            img = self._variants.get(key)
+            if img is None:
+                img = self.image.copy()
+                img.thumbnail((max_width, max_height))
+                self._variants[key] = img
+        return img
+
+
+def ensure_context(data: bytes, context: Optional[ImageContext] = None) -> ImageContext:
+    """Return ``context`` or wrap ``data`` in a fresh one."""
+    if context is not None:
+        return context
+    if isinstance(data, ImageContext):
+        return data
+    return ImageContext(data)
+
+
+@lru_cache(maxsize=256)
+def accepts_context(func: Callable) -> bool:
+    """Return ``True`` if ``func`` takes a ``context`` keyword argument."""
+    try:
+        params = inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+    if "context" in params:
+        return True
+    return any(p.kind is inspect.Parameter.VAR_KEYWORD for p in params.values())
+
+
+def call_process_image(func: Callable, context: ImageContext, **kwargs):
+    """Call a module's ``process_image`` with the context if supported."""
+    if accepts_context(func):
+        # ohne Upload-Puffer nicht auf Verdacht PNG-kodieren
+        data = context._data if context._data is not None else context
+        return func(data, context=context, **kwargs)
+    data = context.data
+    if not isinstance(data, bytes):
+        # Legacy-Module erwarten echte ``bytes`` (Uploads sind memoryviews)
+        data = bytes(data)
+    return func(data, **kwargs)
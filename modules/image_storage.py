@@ -1,74 +1,344 @@
 """Image storage module.
 
-Saves incoming images scaled to fit within a 16:9 box and writes metadata
-including tagging results to disk.
+Saves incoming images scaled to fit within a 16:9 box and records metadata
+including tagging results.
+
+Storage runs behind the request: ``process_image`` assigns a ticket and
+target path and puts ``(thumbnail, metadata)`` on a bounded queue; the
+queue holds at most ``PIXAI_STORAGE_QUEUE`` images of 1280x720, never the
+decoded upload. A pool of writer threads (``PIXAI_STORAGE_WRITERS``)
+encodes the JPEGs; an indexer thread appends their metadata in batches to
+one append-only ``index.jsonl`` per month directory instead of a ``.json``
+sidecar per image, and into the searchable ``metadata_index``. When the
+queue is full ``PIXAI_STORAGE_FULL_POLICY`` either blocks the request
+(``block``, up to ``PIXAI_STORAGE_BLOCK_TIMEOUT`` seconds) or drops the
+image (``drop``). ``PIXAI_STORAGE_FSYNC`` selects
+``always`` (every file), ``batch`` (index batches only) or ``never``.
+``PIXAI_STORAGE_ASYNC=0`` writes on the request thread.
+
+Images are content-addressed: the file name is the SHA-256 of the upload
+(``scanned/objects/ab/<sha256>.jpg``). A byte-identical repeat is not
+written again; it only touches the file's mtime (the last reference, used
+by ``modules.retention``) and adds a record with ``"duplicate": true``.
+Retention deletes objects through :func:`remove_object`, which shares a
+lock with referencing, so a re-referenced object is never deleted.
 """
 
+import atexit
+import hashlib
 import json
 import logging
+import os
+import queue
 import secrets
+import threading
 import time
-from io import BytesIO
 from pathlib import Path
+from typing import Dict, List, Optional
 
-from PIL import Image as PILImage
+from PIL import Image
 
-from . import tagging, nsfw_scanner
+from . import metadata_index
+from .image_context import ensure_context
 
 logger = logging.getLogger(__name__)
 BASE_DIR = Path("scanned")
+MAX_WIDTH = 1280
+MAX_HEIGHT = 720
+OBJECTS_DIR = BASE_DIR / "objects"
+INDEX_NAME = "index.jsonl"
+ASYNC = os.getenv("PIXAI_STORAGE_ASYNC", "1") == "1"
+QUEUE_SIZE = int(os.getenv("PIXAI_STORAGE_QUEUE", "256"))
+WRITERS = int(os.getenv("PIXAI_STORAGE_WRITERS", "2"))
+FULL_POLICY = os.getenv("PIXAI_STORAGE_FULL_POLICY", "block").lower()  # block | drop
+BLOCK_TIMEOUT = float(os.getenv("PIXAI_STORAGE_BLOCK_TIMEOUT", "5"))
+FSYNC = os.getenv("PIXAI_STORAGE_FSYNC", "batch").lower()  # always | batch | never
+INDEX_BATCH = 200  # Datensätze pro Append
+INDEX_INTERVAL = 1.0  # seconds
+# Pipeline: Keyword-Argument -> Produkt eines anderen Moduls
+CONSUMES = {"tags": "tags", "nsfw_meta": "nsfw", "danbooru_tags": "danbooru_tags"}
+PER_REQUEST = True  # jede Anfrage referenziert das Objekt neu, nie aus dem Cache
+
+_queue: "queue.Queue" = queue.Queue(QUEUE_SIZE)
+_records: "queue.Queue" = queue.Queue()  # fertige Index-Datensätze
+_LOCK = threading.Lock()
+# Referenzieren/Ersetzen eines Objekts gegen das Löschen durch die Retention
+_OBJECT_LOCK = threading.Lock()
+_stop = threading.Event()
+_threads: List[threading.Thread] = []
+_dirs = set()  # bereits angelegte Monatsordner
+_counters = {
+    "queued": 0,
+    "written": 0,
+    "duplicates": 0,
+    "dropped": 0,
+    "failed": 0,
+    "indexed": 0,
+}
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _LOCK:
+        _counters[name] += n
+
+
+def object_path(digest: str) -> Path:
+    """Content-addressed location of the image with SHA-256 ``digest``."""
+    return OBJECTS_DIR / digest[:2] / f"{digest}.jpg"
+
+
+def _new_target(data: bytes) -> tuple:
+    """Ticket, image hash and target path for a new upload."""
+    ticket = f"{time.strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(3)}"
+    digest = hashlib.sha256(data).hexdigest()
+    return ticket, digest, object_path(digest)
+
+
+def month_dir(stored: float) -> Path:
+    return BASE_DIR / time.strftime("%Y_%m", time.localtime(stored))
+
 
+def _ensure_dir(path: Path) -> None:
+    if path not in _dirs:
+        path.mkdir(parents=True, exist_ok=True)
+        _dirs.add(path)
 
-def _scale_image(
-    img: PILImage.Image,
-    max_width: int = 1280,
-    max_height: int = 720,
-) -> PILImage.Image:
-    """Scale image to fit within max dimensions while keeping aspect ratio."""
-    img = img.copy()
-    img.thumbnail((max_width, max_height))
-    return img
 
+def _write_image(img: Image.Image, path: Path) -> tuple:
+    _ensure_dir(path.parent)
+    # Temporärdatei + replace: parallele Duplikate sehen nie eine halbe Datei
+    tmp = path.with_name(f"{path.name}.{secrets.token_hex(4)}.tmp")
+    with open(tmp, "wb") as f:
+        img.save(f, format="JPEG")
+        if FSYNC == "always":
+            f.flush()
+            os.fsync(f.fileno())
+    with _OBJECT_LOCK:
+        os.replace(tmp, path)
+    return img.size
 
-def process_image(data: bytes, *, tags=None, nsfw_meta=None, danbooru_tags=None):
-    """Save the image and metadata to disk."""
-    if tags is None:
+
+def _reference(path: Path) -> bool:
+    """Mark an existing object as used again; ``False`` if it is missing."""
+    try:
+        # mtime = letzte Referenz, danach richtet sich die Retention
+        with _OBJECT_LOCK:
+            os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def remove_object(path: Path, mtime: float) -> bool:
+    """Delete ``path`` unless it was referenced after ``mtime``.
+
+    Returns ``False`` if the object was kept; a missing file counts as removed.
+    """
+    with _OBJECT_LOCK:
         try:
-            tags = tagging.process_image(data).get("tags")
-        except Exception:  # pragma: no cover - optional dependency
-            logging.exception("Tagging failed")
-            tags = None
+            if path.stat().st_mtime > mtime:
+                return False
+            path.unlink()
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def _store(
+    ticket: str,
+    digest: str,
+    path: Path,
+    thumbnail: Optional[Image.Image],
+    meta: Dict[str, object],
+) -> Dict[str, object]:
+    """Write one image unless its content is stored already; returns its index record.
+
+    ``thumbnail`` is ``None`` if the object existed when the image was queued.
+    """
+    duplicate = _reference(path)
+    if duplicate:
+        with Image.open(path) as img:  # liest nur den Header
+            width, height = img.size
+        _count("duplicates")
+    elif thumbnail is None:
+        raise FileNotFoundError(f"{path} was removed before it could be referenced")
+    else:
+        width, height = _write_image(thumbnail, path)
+    record = {
+        "ticket": ticket,
+        "sha256": digest,
+        "path": str(path),
+        "stored": round(time.time(), 3),
+        "duplicate": duplicate,
+        "width": width,
+        "height": height,
+    }
+    record.update(meta)
+    logger.info("%s image %s at %s", "Referenced" if duplicate else "Stored", ticket, path)
+    return record
+
+
+def _append_index(records: List[Dict[str, object]]) -> None:
+    """Append ``records`` to the ``index.jsonl`` of their month directory."""
+    by_file: Dict[Path, List[str]] = {}
+    for record in records:
+        target = month_dir(record["stored"]) / INDEX_NAME
+        by_file.setdefault(target, []).append(json.dumps(record))
+    for target, lines in by_file.items():
+        _ensure_dir(target.parent)
+        with open(target, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+            if FSYNC != "never":
+                f.flush()
+                os.fsync(f.fileno())
+    _count("indexed", len(records))
+    try:
+        metadata_index.add_records(records)
+    except Exception:
+        # index.jsonl bleibt maßgeblich, der Import holt fehlende Einträge nach
+        logger.exception("Failed to update metadata index")
 
-    if nsfw_meta is None:
+
+def _run_writer() -> None:
+    while True:
+        job = _queue.get()
+        try:
+            if job is None:
+                return
+            _records.put(_store(*job))
+            _count("written")
+        except Exception:
+            logger.exception("Failed to store image")
+            _count("failed")
+        finally:
+            _queue.task_done()
+
+
+def _run_indexer() -> None:
+    while True:
+        try:
+            batch = [_records.get(timeout=INDEX_INTERVAL)]
+        except queue.Empty:
+            if _stop.is_set():
+                return
+            continue
+        while len(batch) < INDEX_BATCH:
+            try:
+                batch.append(_records.get_nowait())
+            except queue.Empty:
+                break
         try:
-            nsfw_meta = nsfw_scanner.process_image(data)
-        except Exception:  # pragma: no cover - optional dependency
-            logging.exception("NSFW scan failed")
-            nsfw_meta = {}
+            _append_index(batch)
+        except Exception:
+            logger.exception("Failed to append %d index records", len(batch))
+        finally:
+            for _ in batch:
+                _records.task_done()
+
+
+def _ensure_writers() -> None:
+    if _threads:
+        return
+    with _LOCK:
+        if _threads:
+            return
+        for i in range(max(1, WRITERS)):
+            _threads.append(threading.Thread(target=_run_writer, name=f"storage-writer-{i}", daemon=True))
+        _threads.append(threading.Thread(target=_run_indexer, name="storage-indexer", daemon=True))
+        for thread in _threads:
+            thread.start()
+
+
+def _enqueue(job: tuple) -> bool:
+    """Queue ``job`` according to ``FULL_POLICY``; ``False`` if dropped."""
+    _ensure_writers()
+    try:
+        if FULL_POLICY == "drop":
+            _queue.put_nowait(job)
+        else:
+            _queue.put(job, timeout=BLOCK_TIMEOUT)
+    except queue.Full:
+        _count("dropped")
+        logger.warning("Storage queue full, image %s dropped", job[0])
+        return False
+    _count("queued")
+    return True
+
+
+def flush() -> None:
+    """Block until every queued image is written and indexed."""
+    _queue.join()
+    _records.join()
+
+
+def shutdown() -> None:
+    """Write the queue, then stop the writer and indexer threads."""
+    if not _threads or _stop.is_set():
+        return
+    flush()
+    _stop.set()
+    for thread in _threads:
+        if thread.name.startswith("storage-writer"):
+            _queue.put(None)
+    for thread in _threads:
+        thread.join(INDEX_INTERVAL * 2)
+
+
+def get_statistics() -> Dict[str, object]:
+    with _LOCK:
+        stats = dict(_counters)
+    stats.update(
+        {
+            "pending": _queue.qsize(),
+            "capacity": QUEUE_SIZE,
+            "policy": FULL_POLICY,
+            "async": ASYNC,
+        }
+    )
+    return stats
+
+
+def process_image(
+    data: bytes,
+    *,
+    context=None,
+    tags=None,
+    nsfw_meta=None,
+    danbooru_tags=None,
+):
+    """Queue the image and metadata for storage.
+
+    ``tags``, ``nsfw_meta`` and ``danbooru_tags`` are stored as given; a
+    product that is absent (timeout, error, module not loaded) is not
+    recomputed but listed under ``"missing"`` in the metadata.
+
+    Returns the ticket and the content-addressed path of the image; with the
+    ``drop`` policy and a full queue an error entry instead.
+    """
+    ctx = ensure_context(data, context)
+    missing = [name for name, value in (("tags", tags), ("danbooru_tags", danbooru_tags)) if value is None]
+    if not isinstance(nsfw_meta, dict) or "error" in nsfw_meta:
+        missing.append("nsfw")
+        nsfw_meta = {}
+    meta = {"tags": tags, "danbooru_tags": danbooru_tags}
+    meta.update(nsfw_meta)
+    if missing:
+        meta["missing"] = missing
     try:
-        with PILImage.open(BytesIO(data)) as img:
-            img = img.convert("RGB")
-            img = _scale_image(img)
-            month_dir = BASE_DIR / time.strftime("%Y_%m")
-            month_dir.mkdir(parents=True, exist_ok=True)
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            unique = secrets.token_hex(3)
-            path = month_dir / f"{timestamp}_{unique}.jpg"
-            img.save(path, format="JPEG")
-            meta = {
-                "width": img.width,
-                "height": img.height,
-                "tags": tags,
-                "danbooru_tags": danbooru_tags,
-            }
-            meta.update(nsfw_meta)
-            meta_path = path.with_suffix(".json")
-            with meta_path.open("w") as f:
-                json.dump(meta, f)
-            result = {"path": str(path), "metadata": meta}
-            logger.info("Stored image at %s", result["path"])
-            logger.debug("Metadata: %s", meta)
-            return result
+        ticket, digest, path = _new_target(ctx.data)
+        # Duplikate brauchen kein Vorschaubild; die Queue hält nie den Kontext
+        thumbnail = None if path.exists() else ctx.thumbnail(MAX_WIDTH, MAX_HEIGHT)
+        if not ASYNC or _stop.is_set():
+            record = _store(ticket, digest, path, thumbnail, meta)
+            _append_index([record])
+            return {"ticket": ticket, "path": str(path), "status": "stored", "metadata": record}
+        if not _enqueue((ticket, digest, path, thumbnail, meta)):
+            return {"error": "storage queue full", "ticket": ticket, "status": "dropped"}
+        logger.debug("Queued %s: %s", ticket, meta)
+        return {"ticket": ticket, "path": str(path), "status": "queued", "metadata": meta}
     except Exception as exc:
         logging.exception("Failed to store image")
         return {"error": str(exc)}
+
+
+atexit.register(shutdown)
@@ -0,0 +1,336 @@
+"""Compiled inference for Keras models.
+
+``model.predict`` builds a data adapter and callback machinery on every
+call, which dominates the latency for the small batches the API runs.
+:func:`compile_model` wraps a model in a ``tf.function`` with a fixed
+``TensorSpec`` (static image size, dynamic batch) that calls
+``model(x, training=False)`` directly, so the graph is traced once and
+reused for every batch size.
+
+With ``PIXAI_SAVED_MODEL=1`` :func:`load_model` additionally exports the
+traced function as a SavedModel next to the ``.h5`` file and loads that
+directory on later starts instead of rebuilding the Keras model.
+``PIXAI_COMPILED=0`` falls back to plain ``model.predict``.
+
+Instead of TensorFlow a module can run a model converted offline with
+``convert_models.py``: ``PIXAI_BACKEND`` (or ``PIXAI_BACKEND_<NAME>``, e.g.
+``PIXAI_BACKEND_DEEPDANBOORU``) selects ``tensorflow``, ``onnxruntime`` or
+``tflite`` and ``PIXAI_PRECISION[_<NAME>]`` picks the ``float32`` or
+``int8`` variant from :data:`CONVERTED_DIR`. If the converted file or the
+runtime is missing the module stays on TensorFlow.
+
+``PIXAI_BACKEND=stub`` replaces the models with :class:`StubModel`: the
+real input and output shapes, random weights, no model files or runtime.
+It exists for ``benchmarks``; ``PIXAI_STUB_DELAY_MS`` adds a fixed latency
+per call to stand in for the real model's compute time.
+"""
+
+from __future__ import annotations
+
+import abc
+import logging
+import os
+import shutil
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tensorflow as tf
+except Exception:  # pragma: no cover - optional dependency
+    tf = None
+
+USE_COMPILED = os.getenv("PIXAI_COMPILED", "1") == "1"
+USE_SAVED_MODEL = os.getenv("PIXAI_SAVED_MODEL", "0") == "1"
+CONVERTED_DIR = Path(os.getenv("PIXAI_CONVERTED_DIR", Path(__file__).with_name("converted")))
+BACKENDS = ("tensorflow", "onnxruntime", "tflite", "stub")
+PRECISIONS = ("float32", "int8")
+SUFFIX = {"onnxruntime": "onnx", "tflite": "tflite"}
+STUB_DELAY_MS = float(os.getenv("PIXAI_STUB_DELAY_MS", "0"))
+
+Predictor = Callable[[np.ndarray], np.ndarray]
+
+
+class CompiledModel:
+    """``tf.function`` around a model or a restored SavedModel function."""
+
+    def __init__(
+        self,
+        fn,
+        input_shape: Sequence[int],
+        *,
+        source: str = "keras",
+        owner=None,
+    ):
+        self.fn = fn
+        self.input_shape = tuple(input_shape)
+        self.source = source
+        # restored SavedModels free their variables once the root object dies
+        self.owner = owner
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        out = self.fn(tf.convert_to_tensor(batch, dtype=tf.float32))
+        return out.numpy()
+
+    predict = __call__
+
+
+def _spec(input_shape: Sequence[int]):
+    return tf.TensorSpec((None, *input_shape), tf.float32, name="images")
+
+
+def compile_model(model, input_shape: Sequence[int]) -> Predictor:
+    """Return a batch predictor for ``model`` with a fixed input signature."""
+    if tf is None or not USE_COMPILED:
+        return model.predict
+    fn = tf.function(
+        lambda x: model(x, training=False),
+        input_signature=[_spec(input_shape)],
+        autograph=False,
+    )
+    return CompiledModel(fn, input_shape)
+
+
+def saved_model_path(h5_path: Path) -> Path:
+    return Path(h5_path).with_suffix(".savedmodel")
+
+
+def _is_fresh(export: Path, source: Path) -> bool:
+    try:
+        return export.stat().st_mtime >= source.stat().st_mtime
+    except OSError:
+        return False
+
+
+def export_saved_model(model, input_shape: Sequence[int], target: Path) -> None:
+    """Export ``model`` as SavedModel with a single ``infer`` function."""
+    module = tf.Module()
+    module.model = model
+    module.infer = tf.function(
+        lambda x: model(x, training=False),
+        input_signature=[_spec(input_shape)],
+        autograph=False,
+    )
+    tmp = target.with_name(target.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tf.saved_model.save(module, str(tmp))
+    shutil.rmtree(target, ignore_errors=True)
+    tmp.rename(target)
+
+
+def load_model(
+    h5_path: Path,
+    input_shape: Sequence[int],
+    loader: Callable[[], object],
+) -> Predictor:
+    """Return a compiled predictor for the model stored at ``h5_path``.
+
+    ``loader`` builds the Keras model; it is skipped when a SavedModel
+    export newer than the ``.h5`` is available.
+    """
+    export = saved_model_path(h5_path)
+    if tf is not None and USE_COMPILED and USE_SAVED_MODEL and _is_fresh(export, Path(h5_path)):
+        try:
+            loaded = tf.saved_model.load(str(export))
+            logger.info("SavedModel geladen: %s", export)
+            return CompiledModel(
+                loaded.infer, input_shape, source="savedmodel", owner=loaded
+            )
+        except Exception:
+            logger.exception("SavedModel %s unbrauchbar, lade .h5", export)
+
+    model = loader()
+    predictor = compile_model(model, input_shape)
+    if isinstance(predictor, CompiledModel) and USE_SAVED_MODEL:
+        try:
+            export_saved_model(model, input_shape, export)
+            logger.info("SavedModel exportiert: %s", export)
+        except Exception:
+            logger.exception("Export nach %s fehlgeschlagen", export)
+    return predictor
+
+
+def warmup(predictor: Predictor, input_shape: Sequence[int], batch: int = 1) -> Optional[np.ndarray]:
+    """Run one zero-input batch to trigger tracing."""
+    return predictor(np.zeros((batch, *input_shape), dtype=np.float32))
+
+
+# ---------- converted backends ----------
+def _setting(key: str, name: str, default: str) -> str:
+    return os.getenv(f"{key}_{name.upper()}", os.getenv(key, default)).lower()
+
+
+def backend_for(name: str) -> str:
+    """Configured backend for model ``name`` (``nsfw``, ``tagging``, ...)."""
+    backend = _setting("PIXAI_BACKEND", name, "tensorflow")
+    if backend not in BACKENDS:
+        logger.warning("Unbekanntes Backend %r für %s, nutze tensorflow", backend, name)
+        return "tensorflow"
+    return backend
+
+
+def precision_for(name: str) -> str:
+    precision = _setting("PIXAI_PRECISION", name, "float32")
+    return precision if precision in PRECISIONS else "float32"
+
+
+def converted_path(name: str, backend: str, precision: str = "float32") -> Path:
+    return CONVERTED_DIR / f"{name}.{precision}.{SUFFIX[backend]}"
+
+
+class ConvertedModel(abc.ABC):
+    """Base for predictors that do not need TensorFlow at runtime."""
+
+    backend = ""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    @abc.abstractmethod
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        """Scores for a float32 batch of model inputs."""
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self(batch)
+
+
+class OnnxModel(ConvertedModel):
+    backend = "onnxruntime"
+
+    def __init__(self, path: Path, threads: int = 0):
+        super().__init__(path)
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            str(path), opts, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        feed = {self.input_name: np.ascontiguousarray(batch, dtype=np.float32)}
+        return self.session.run(None, feed)[0]
+
+    predict = __call__
+
+
+def _tflite_interpreter(path: Path):
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except Exception:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except Exception:
+            if tf is None:
+                raise RuntimeError("no TFLite runtime installed")
+            Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=str(path))
+
+
+class TFLiteModel(ConvertedModel):
+    """TFLite interpreter; not thread-safe, so calls are serialized."""
+
+    backend = "tflite"
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.interpreter = _tflite_interpreter(path)
+        self._input = self.interpreter.get_input_details()[0]["index"]
+        self._output = self.interpreter.get_output_details()[0]["index"]
+        self._batch = None
+        self._lock = threading.Lock()
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            if self._batch != batch.shape:
+                self.interpreter.resize_tensor_input(self._input, batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch = batch.shape
+            self.interpreter.set_tensor(self._input, batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self._output).copy()
+
+    predict = __call__
+
+
+class StubModel(ConvertedModel):
+    """Random model with the real output size, for benchmarks without weights.
+
+    Every input value is read (per-image channel means), so preprocessing,
+    batching and post-processing see realistic arrays; the scores are
+    sigmoids in ``[0, 1]``.
+    """
+
+    backend = "stub"
+
+    def __init__(self, name: str, outputs: int, delay_ms: float = STUB_DELAY_MS):
+        super().__init__(Path(f"<stub:{name}>"))
+        rng = np.random.default_rng(zlib.crc32(name.encode()))
+        self.weights = rng.normal(0.0, 8.0, (3, outputs)).astype(np.float32)
+        self.bias = rng.normal(-1.0, 1.0, outputs).astype(np.float32)
+        self.delay = delay_ms / 1000.0
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        features = np.asarray(batch, dtype=np.float32).mean(axis=(1, 2))
+        # Mittel pro Bild: das Ergebnis hängt nicht vom Rest des Batches ab
+        logits = (features - features.mean(axis=1, keepdims=True)) @ self.weights + self.bias
+        if self.delay:
+            time.sleep(self.delay)
+        return 1.0 / (1.0 + np.exp(-logits))
+
+    predict = __call__
+
+
+def open_converted(path: Path, backend: str) -> ConvertedModel:
+    """Open a converted model file with ``backend``."""
+    if backend == "onnxruntime":
+        return OnnxModel(path)
+    if backend == "tflite":
+        return TFLiteModel(path)
+    raise ValueError(f"not a converted backend: {backend}")
+
+
+def load_converted(name: str, outputs: Optional[int] = None) -> Optional[ConvertedModel]:
+    """Return the configured converted model for ``name`` or ``None``.
+
+    ``None`` means the module should use TensorFlow, either because that is
+    configured or because the converted variant is unavailable. ``outputs``
+    is the model's output size, needed for the ``stub`` backend.
+    """
+    backend = backend_for(name)
+    if backend == "tensorflow":
+        return None
+    if backend == "stub":
+        if not outputs:
+            logger.warning("Stub für %s ohne Ausgabegröße, nutze tensorflow", name)
+            return None
+        logger.info("Modell %s läuft als Stub (%d Ausgaben)", name, outputs)
+        return StubModel(name, outputs)
+    path = converted_path(name, backend, precision_for(name))
+    if not path.exists():
+        logger.warning("%s fehlt (convert_models.py), nutze tensorflow", path)
+        return None
+    try:
+        model = open_converted(path, backend)
+    except Exception:
+        logger.exception("Backend %s für %s nicht nutzbar, nutze tensorflow", backend, name)
+        return None
+    logger.info("Modell %s läuft auf %s (%s)", name, backend, path.name)
+    return model
+
+
+def uses_converted(name: str) -> bool:
+    """``True`` if ``name`` is configured for a converted model that exists."""
+    backend = backend_for(name)
+    if backend == "stub":
+        return True
+    return backend != "tensorflow" and converted_path(name, backend, precision_for(name)).exists()
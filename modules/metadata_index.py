@@ -0,0 +1,435 @@
+"""Queryable sqlite index over the metadata in ``scanned/``.
+
+``image_storage`` adds every stored image here together with its
+``index.jsonl`` batch. ``images`` holds one row per stored file with the
+NSFW scores as columns; ``image_refs`` has one row per upload (ticket), so a
+duplicate upload of the same content only adds a reference and moves
+``last_seen``. ``image_tags`` is the inverted index tag → image id for
+MobileNetV2 and DeepDanbooru tags. :meth:`MetadataIndex.search` combines
+tag, score-range and date filters with pagination and backs the ``/search``
+endpoint.
+
+Images stored before the index existed are imported once with::
+
+    python -m modules.metadata_index scanned/
+
+which reads the monthly ``index.jsonl`` files and the older per-image
+``.json`` sidecars. Importing is idempotent (keyed by ticket).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import math
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_DB = Path(os.getenv("PIXAI_METADATA_DB", "scanned/metadata.sqlite"))
+# wie nsfw_scanner.CATEGORIES; ``nsfw`` ist das Maximum der expliziten
+SCORES = ("drawings", "hentai", "neutral", "porn", "sexy")
+NSFW_SCORES = ("hentai", "porn", "sexy")
+RANGE_COLUMNS = SCORES + ("nsfw",)
+TAG_SOURCES = {"tags": "tagging", "danbooru_tags": "danbooru"}
+MAX_LIMIT = 500
+MAX_OFFSET = 2**63 - 1  # größter sqlite-INTEGER
+IMPORT_BATCH = 1000
+
+_TABLES = (
+    "CREATE TABLE IF NOT EXISTS images ("
+    " id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, ticket TEXT,"
+    " stored REAL, width INTEGER, height INTEGER, "
+    + ", ".join(f"{c} REAL" for c in RANGE_COLUMNS)
+    + ", meta TEXT, refs INTEGER NOT NULL DEFAULT 1, last_seen REAL)",
+    "CREATE TABLE IF NOT EXISTS image_refs ("
+    " ticket TEXT PRIMARY KEY, image_id INTEGER NOT NULL, stored REAL)",
+    "CREATE TABLE IF NOT EXISTS image_tags ("
+    " tag TEXT NOT NULL, image_id INTEGER NOT NULL, source TEXT NOT NULL,"
+    " score REAL, PRIMARY KEY (tag, image_id, source)) WITHOUT ROWID",
+)
+_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS image_refs_image ON image_refs(image_id)",
+    "CREATE INDEX IF NOT EXISTS image_tags_image ON image_tags(image_id)",
+    "CREATE INDEX IF NOT EXISTS images_last_seen ON images(last_seen)",
+    "CREATE INDEX IF NOT EXISTS images_nsfw ON images(nsfw)",
+)
+
+
+def _score(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _tags(record: Dict[str, object], key: str) -> Iterator[Tuple[str, Optional[float]]]:
+    for tag in record.get(key) or []:
+        if isinstance(tag, dict):
+            if tag.get("label"):
+                yield str(tag["label"]), _score(tag.get("score"))
+        elif tag:
+            yield str(tag), None
+
+
+class MetadataIndex:
+    """sqlite store with an inverted tag index."""
+
+    def __init__(self, path: Path = INDEX_DB):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(str(self.path), check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            for statement in _TABLES:
+                db.execute(statement)
+            self._migrate(db)
+            for statement in _INDEXES:
+                db.execute(statement)
+            self._db = db
+        return self._db
+
+    @staticmethod
+    def _migrate(db: sqlite3.Connection) -> None:
+        """Add the reference columns to indexes created without them."""
+        columns = {row[1] for row in db.execute("PRAGMA table_info(images)")}
+        if "refs" not in columns:
+            db.execute("ALTER TABLE images ADD COLUMN refs INTEGER NOT NULL DEFAULT 1")
+        if "last_seen" not in columns:
+            db.execute("ALTER TABLE images ADD COLUMN last_seen REAL")
+            db.execute("UPDATE images SET last_seen = stored")
+            db.execute(
+                "INSERT OR IGNORE INTO image_refs (ticket, image_id, stored)"
+                " SELECT COALESCE(ticket, path), id, stored FROM images"
+            )
+        db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # ---------- writing ----------
+    def add(self, records: Iterable[Dict[str, object]]) -> int:
+        """Insert storage records in one transaction; returns new references."""
+        added = 0
+        with self._lock:
+            db = self._conn()
+            with db:
+                for record in records:
+                    added += self._insert(db, record)
+        return added
+
+    @staticmethod
+    def _insert(db: sqlite3.Connection, record: Dict[str, object]) -> int:
+        path = str(record["path"])
+        stored = _score(record.get("stored"))
+        ticket = record.get("ticket") or Path(path).stem
+        scores = {c: _score(record.get(c)) for c in SCORES}
+        explicit = [scores[c] for c in NSFW_SCORES if scores[c] is not None]
+        cur = db.execute(
+            "INSERT OR IGNORE INTO images (path, ticket, stored, last_seen, width, height, "
+            + ", ".join(RANGE_COLUMNS)
+            + ", meta) VALUES (?, ?, ?, ?, ?, ?, "
+            + ", ".join("?" * len(RANGE_COLUMNS))
+            + ", ?)",
+            (
+                path,
+                ticket,
+                stored,
+                stored,
+                record.get("width"),
+                record.get("height"),
+                *(scores[c] for c in SCORES),
+                max(explicit) if explicit else None,
+                json.dumps(record),
+            ),
+        )
+        new = cur.rowcount > 0
+        if new:
+            image_id = cur.lastrowid
+            db.executemany(
+                "INSERT OR REPLACE INTO image_tags (tag, image_id, source, score)"
+                " VALUES (?, ?, ?, ?)",
+                [
+                    (tag, image_id, source, score)
+                    for key, source in TAG_SOURCES.items()
+                    for tag, score in _tags(record, key)
+                ],
+            )
+        else:
+            (image_id,) = db.execute("SELECT id FROM images WHERE path = ?", (path,)).fetchone()
+        ref = db.execute(
+            "INSERT OR IGNORE INTO image_refs (ticket, image_id, stored) VALUES (?, ?, ?)",
+            (ticket, image_id, stored),
+        )
+        if ref.rowcount == 0:
+            return 0  # schon indiziert
+        if not new:
+            # Duplikat: nur Referenz zählen
+            db.execute(
+                "UPDATE images SET refs = refs + 1,"
+                " last_seen = MAX(COALESCE(last_seen, 0), COALESCE(?, 0)) WHERE id = ?",
+                (stored, image_id),
+            )
+        return 1
+
+    def remove(self, paths: Iterable[str]) -> int:
+        """Drop images (with tags and references) whose files were deleted."""
+        removed = 0
+        with self._lock:
+            db = self._conn()
+            with db:
+                for path in paths:
+                    row = db.execute("SELECT id FROM images WHERE path = ?", (str(path),)).fetchone()
+                    if row is None:
+                        continue
+                    for table in ("image_tags", "image_refs"):
+                        db.execute(f"DELETE FROM {table} WHERE image_id = ?", row)
+                    db.execute("DELETE FROM images WHERE id = ?", row)
+                    removed += 1
+        return removed
+
+    # ---------- search ----------
+    def search(
+        self,
+        tags: Sequence[str] = (),
+        exclude_tags: Sequence[str] = (),
+        ranges: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> Dict[str, object]:
+        """Images having all ``tags`` and matching the filters, newest first.
+
+        Images with any of ``exclude_tags`` are left out. ``ranges`` maps a score column (``porn``, ``nsfw``, ...) to an
+        inclusive ``(min, max)``; ``since``/``until`` are unix timestamps
+        compared with the latest upload of the image.
+        """
+        where, params = [], []
+        tags = list(dict.fromkeys(t for t in tags if t))
+        if tags:
+            where.append(
+                "id IN (SELECT image_id FROM image_tags WHERE tag IN ("
+                + ", ".join("?" * len(tags))
+                + ") GROUP BY image_id HAVING COUNT(DISTINCT tag) = ?)"
+            )
+            params += tags + [len(tags)]
+        exclude = list(dict.fromkeys(t for t in exclude_tags if t))
+        if exclude:
+            where.append(
+                "id NOT IN (SELECT image_id FROM image_tags WHERE tag IN ("
+                + ", ".join("?" * len(exclude))
+                + "))"
+            )
+            params += exclude
+        for column, (low, high) in (ranges or {}).items():
+            if column not in RANGE_COLUMNS:
+                raise ValueError(f"unknown score: {column}")
+            if low is not None:
+                where.append(f"{column} >= ?")
+                params.append(low)
+            if high is not None:
+                where.append(f"{column} <= ?")
+                params.append(high)
+        if since is not None:
+            where.append("last_seen >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("last_seen < ?")
+            params.append(until)
+        clause = (" WHERE " + " AND ".join(where)) if where else ""
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        offset = max(0, int(offset))
+        with self._lock:
+            db = self._conn()
+            (total,) = db.execute(f"SELECT COUNT(*) FROM images{clause}", params).fetchone()
+            rows = db.execute(
+                f"SELECT id, refs, last_seen, meta FROM images{clause}"
+                " ORDER BY last_seen DESC, id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        items = [
+            {"id": image_id, "refs": refs, "last_seen": last_seen, **json.loads(meta)}
+            for image_id, refs, last_seen, meta in rows
+        ]
+        return {
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "next_offset": offset + len(items) if offset + len(items) < total else None,
+            "items": items,
+        }
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn().execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+
+_index: Optional[MetadataIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> MetadataIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = MetadataIndex()
+        return _index
+
+
+def add_records(records: Iterable[Dict[str, object]]) -> int:
+    return get_index().add(records)
+
+
+def remove_paths(paths: Iterable[str]) -> int:
+    return get_index().remove(paths)
+
+
+def search(**filters) -> Dict[str, object]:
+    return get_index().search(**filters)
+
+
+# ---------- query parsing ----------
+def parse_time(value: str) -> float:
+    """Unix timestamp from ``2026-09-01``, an ISO datetime or a number."""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _param(params: Dict[str, List[str]], key: str, parse):
+    """Parse the first value of ``key``; ``ValueError`` names the parameter."""
+    value = params[key][0]
+    try:
+        result = parse(value)
+        if math.isfinite(result):
+            return result
+    except (ValueError, OverflowError):
+        pass
+    raise ValueError(f"invalid {key}: {value!r}")
+
+
+def parse_query(params: Dict[str, List[str]]) -> Dict[str, object]:
+    """``/search`` query parameters → :meth:`MetadataIndex.search` kwargs.
+
+    ``tag`` (repeatable or comma separated, ``-tag`` excludes),
+    ``<score>_min``/``<score>_max`` for the NSFW scores and ``nsfw``,
+    ``since``/``until``, ``limit`` and ``offset``. Raises ``ValueError``
+    on invalid values.
+    """
+    tags, exclude = [], []
+    for value in params.get("tag", []):
+        for tag in value.split(","):
+            tag = tag.strip()
+            if tag.startswith("-"):
+                exclude.append(tag[1:].strip())
+            elif tag:
+                tags.append(tag)
+    ranges = {}
+    for column in RANGE_COLUMNS:
+        low, high = (
+            _param(params, key, float) if key in params else None
+            for key in (f"{column}_min", f"{column}_max")
+        )
+        if low is not None or high is not None:
+            ranges[column] = (low, high)
+    filters: Dict[str, object] = {"tags": tags, "exclude_tags": exclude, "ranges": ranges}
+    for key in ("since", "until"):
+        if key in params:
+            filters[key] = _param(params, key, parse_time)
+    for key in ("limit", "offset"):
+        if key in params:
+            filters[key] = _param(params, key, int)
+            if not 0 <= filters[key] <= MAX_OFFSET:
+                raise ValueError(f"invalid {key}: {params[key][0]!r}")
+    return filters
+
+
+# ---------- import ----------
+def _index_records(path: Path) -> Iterator[Dict[str, object]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # abgeschnittene letzte Zeile
+
+
+def _sidecar_record(path: Path) -> Optional[Dict[str, object]]:
+    image = path.with_suffix(".jpg")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        stored = image.stat().st_mtime if image.exists() else path.stat().st_mtime
+    except (OSError, ValueError):
+        logger.warning("Sidecar %s unlesbar", path)
+        return None
+    if not isinstance(meta, dict):
+        return None
+    return {"ticket": path.stem, "path": str(image), "stored": stored, **meta}
+
+
+def iter_records(base: Path) -> Iterator[Dict[str, object]]:
+    """All metadata records below ``base`` (index files and sidecars)."""
+    for month in sorted(p for p in Path(base).iterdir() if p.is_dir()):
+        index = month / "index.jsonl"
+        if index.exists():
+            yield from _index_records(index)
+        for sidecar in sorted(month.glob("*.json")):
+            record = _sidecar_record(sidecar)
+            if record is not None:
+                yield record
+
+
+def import_dir(base: Path, index: Optional[MetadataIndex] = None) -> Tuple[int, int]:
+    """Backfill ``index`` from ``base``; returns ``(records read, added)``."""
+    index = index or get_index()
+    seen = added = 0
+    batch: List[Dict[str, object]] = []
+    for record in iter_records(base):
+        if not record.get("path"):
+            continue
+        batch.append(record)
+        seen += 1
+        if len(batch) >= IMPORT_BATCH:
+            added += index.add(batch)
+            batch = []
+    if batch:
+        added += index.add(batch)
+    return seen, added
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Import scanned/ metadata into the search index")
+    parser.add_argument("base", type=Path, nargs="?", default=Path("scanned"))
+    parser.add_argument("--db", type=Path, default=INDEX_DB)
+    args = parser.parse_args(argv)
+    if not args.base.is_dir():
+        print(f"{args.base} is not a directory", file=sys.stderr)
+        return 1
+    index = MetadataIndex(args.db)
+    seen, added = import_dir(args.base, index)
+    print(f"{seen} records read, {added} added, {index.count()} images indexed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Load state bookkeeping for lazily loaded models.
+
+Each model module keeps one :class:`LoadState`. Its lock guards
+``_ensure_model`` so concurrent first requests load a model only once, and
+its fields feed the ``/health`` and ``/ready`` endpoints.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+UNLOADED = "unloaded"
+LOADING = "loading"
+READY = "ready"
+ERROR = "error"
+
+
+class LoadState:
+    """Load/warm-up status of one model."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = UNLOADED
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+
+    @contextmanager
+    def loading(self):
+        """Wrap the actual model load; records duration and outcome."""
+        self.state = LOADING
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as exc:
+            self.state = ERROR
+            self.error = str(exc)
+            raise
+        else:
+            self.state = READY
+            self.error = None
+        finally:
+            self.load_seconds = round(time.perf_counter() - start, 3)
+
+    @contextmanager
+    def warming(self):
+        """Wrap a dummy inference; only successful runs mark the model warm."""
+        start = time.perf_counter()
+        yield
+        self.warmup_seconds = round(time.perf_counter() - start, 3)
+
+    @property
+    def warm(self) -> bool:
+        return self.warmup_seconds is not None
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "warm": self.warm,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "error": self.error,
+        }
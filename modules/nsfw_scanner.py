@@ -7,12 +7,24 @@ If the ``nsfw_detector`` library is not installed or no model is available,
 The implementation is defensive: missing dependencies or model loading errors
 are logged and communicated via the returned dictionary instead of raising
 exceptions.
+
+Images are preprocessed in memory (224x224, nearest neighbour, scaled to
+``[0, 1]`` exactly like ``nsfw_detector``) and fed to the loaded Keras model
+directly. The temp-file route through ``predict.classify`` is only used as a
+fallback if the in-memory path fails.
 """
 
 import logging
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import Dict
+from typing import Dict, List, Sequence
+
+import numpy as np
+from PIL import Image
+
+from . import batching, inference
+from .image_context import ImageContext, ensure_context
+from .model_state import LoadState
 
 logger = logging.getLogger(__name__)
 
@@ -26,43 +38,121 @@ except Exception:  # pragma: no cover - library may be missing
 
 
 MODEL_PATH = Path(__file__).with_name("nsfw_model.h5")
+CATEGORIES = ("drawings", "hentai", "neutral", "porn", "sexy")
+NSFW_CATEGORIES = ("hentai", "porn", "sexy")
+NSFW_THRESHOLD = 0.5
+NSFW_INDEX = [CATEGORIES.index(k) for k in NSFW_CATEGORIES]
+IMAGE_DIM = 224
+INPUT_SHAPE = (IMAGE_DIM, IMAGE_DIM, 3)
+INPUT_VARIANTS = (((IMAGE_DIM, IMAGE_DIM), Image.NEAREST),)  # liest ``preprocess``
+BACKEND_NAME = "nsfw"
+# Pipeline: das ganze Ergebnis ist das Produkt ``nsfw``
+PRODUCES = {"nsfw": None}
 _model = None
+_predict = None
+_scheduler = None
+_load = LoadState()
 
 
 def _ensure_model():
     """Load the NSFW model if it hasn't been loaded yet."""
-    global _model
     if _model is None:
-        if predict is None:
-            raise RuntimeError("nsfw_detector not importiert")
-        if not MODEL_PATH.exists():
-            raise FileNotFoundError(f"NSFW model fehlt: {MODEL_PATH}")
-        logger.info("Lade Modell von: %s", MODEL_PATH)
-        try:
-            _model = predict.load_model(str(MODEL_PATH))
-        except Exception:
-            logger.exception(
-                "Fehler beim Aufruf von predict.load_model, versuche tf.keras:"
-            )
-            if tf is None:
-                raise
-            _model = tf.keras.models.load_model(str(MODEL_PATH), compile=False)
+        with _load.lock:
+            if _model is None:
+                with _load.loading():
+                    _load_model()
     return _model
 
 
-def process_image(data: bytes) -> Dict[str, float]:
-    """Classify the given image bytes for NSFW content."""
+def _load_model() -> None:
+    global _model, _predict, _scheduler
+    converted = inference.load_converted(BACKEND_NAME, outputs=len(CATEGORIES))
+    if converted is not None:
+        # ONNX/TFLite: weder nsfw_detector noch TensorFlow nötig
+        _predict = converted
+        _scheduler = batching.get_scheduler("nsfw", _predict)
+        _model = converted
+        return
     if predict is None:
-        logger.error(
-            "predict ist None – nsfw_detector konnte nicht geladen werden."
-        )
-        return {"error": "nsfw_detector not installed"}
+        raise RuntimeError("nsfw_detector not importiert")
+    if not MODEL_PATH.exists():
+        raise FileNotFoundError(f"NSFW model fehlt: {MODEL_PATH}")
+    logger.info("Lade Modell von: %s", MODEL_PATH)
     try:
-        model = _ensure_model()
-    except Exception as exc:  # pragma: no cover - dependent on environment
-        logger.exception("Fehler beim Laden des Modells:")
-        return {"error": str(exc)}
+        model = predict.load_model(str(MODEL_PATH))
+    except Exception:
+        logger.exception(
+            "Fehler beim Aufruf von predict.load_model, versuche tf.keras:"
+        )
+        if tf is None:
+            raise
+        model = tf.keras.models.load_model(str(MODEL_PATH), compile=False)
+    # Keras-Modell bleibt für den Temp-Datei-Fallback (predict.classify) erhalten
+    _predict = inference.compile_model(model, INPUT_SHAPE)
+    _scheduler = batching.get_scheduler("nsfw", _predict)
+    _model = model
+
+
+def warmup() -> None:
+    """Load the model and run one dummy inference to trigger tracing."""
+    _ensure_model()
+    with _load.warming():
+        inference.warmup(_predict, INPUT_SHAPE)
+
+
+def load_state() -> Dict[str, object]:
+    return _load.as_dict()
+
+
+def preprocess(context: ImageContext) -> np.ndarray:
+    """Return the ``224x224x3`` float32 model input for ``context``."""
+    arr = context.resized_array((IMAGE_DIM, IMAGE_DIM), Image.NEAREST)
+    return arr.astype(np.float32) / 255.0
+
+
+def _to_scores(row) -> Dict[str, float]:
+    return {name: float(score) for name, score in zip(CATEGORIES, row)}
+
+
+def nsfw_score(scores) -> float:
+    """Highest score among the explicit categories, ``0.0`` on errors."""
+    if not isinstance(scores, dict):
+        return 0.0
+    return max(float(scores.get(k) or 0.0) for k in NSFW_CATEGORIES)
+
+
+def is_nsfw(scores) -> bool:
+    return nsfw_score(scores) >= NSFW_THRESHOLD
+
+
+def _as_context(item) -> ImageContext:
+    if isinstance(item, ImageContext):
+        return item
+    if isinstance(item, np.ndarray):
+        return ImageContext.from_array(item)
+    return ImageContext(item)
+
+
+def predict_scores(images: Sequence) -> np.ndarray:
+    """Raw ``(n, len(CATEGORIES))`` scores from a single ``predict`` call.
 
+    ``images`` may contain :class:`ImageContext` objects, encoded bytes or
+    ``HxWx3`` uint8 RGB arrays (e.g. animation frames). Raises on errors.
+    """
+    _ensure_model()
+    batch = np.stack([preprocess(_as_context(item)) for item in images])
+    return np.asarray(_predict(batch), dtype=np.float32)
+
+
+def classify_batch(images: Sequence) -> List[Dict[str, float]]:
+    """Classify several images with a single ``predict`` call."""
+    if not images:
+        return []
+    return [_to_scores(row) for row in predict_scores(images)]
+
+
+def _classify_file(model, data: bytes) -> Dict[str, float]:
+    """Fallback: classify through ``nsfw_detector`` using a temp file."""
     tmp_path = None
     try:
         with NamedTemporaryFile(suffix=".jpg", delete=False) as tmp:
@@ -71,15 +161,41 @@ def process_image(data: bytes) -> Dict[str, float]:
             tmp_path = tmp.name
 
         preds = predict.classify(model, tmp_path)
-        result = preds.get(tmp_path, {})
-        logger.info("NSFW scores: %s", result)
-        return result
-    except Exception as e:
-        logger.exception("Fehler bei der Bildklassifikation:")
-        return {"error": str(e)}
+        return preds.get(tmp_path, {})
     finally:
         if tmp_path:
             try:
                 Path(tmp_path).unlink()
             except Exception:
                 pass
+
+
+def process_image(data: bytes, *, context=None) -> Dict[str, float]:
+    """Classify the given image bytes for NSFW content."""
+    if predict is None and not inference.uses_converted(BACKEND_NAME):
+        logger.error(
+            "predict ist None – nsfw_detector konnte nicht geladen werden."
+        )
+        return {"error": "nsfw_detector not installed"}
+    try:
+        model = _ensure_model()
+    except Exception as exc:  # pragma: no cover - dependent on environment
+        logger.exception("Fehler beim Laden des Modells:")
+        return {"error": str(exc)}
+
+    try:
+        try:
+            arr = preprocess(ensure_context(data, context))
+            result = _to_scores(_scheduler.predict(arr))
+        except Exception:
+            if isinstance(model, inference.ConvertedModel):
+                raise
+            logger.exception(
+                "In-Memory-Klassifikation fehlgeschlagen, nutze Temp-Datei:"
+            )
+            result = _classify_file(model, ensure_context(data, context).data)
+        logger.info("NSFW scores: %s", result)
+        return result
+    except Exception as e:
+        logger.exception("Fehler bei der Bildklassifikation:")
+        return {"error": str(e)}
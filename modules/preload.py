@@ -0,0 +1,102 @@
+"""Optional model preloading and warm-up.
+
+Without preloading every model is loaded on the first request that needs
+it. With ``PIXAI_PRELOAD=1`` (or ``--preload`` for ``async_server.py``) the
+API loads all models in parallel at startup and runs one dummy inference on
+each, so graph tracing happens before traffic arrives. ``/health`` and
+``/ready`` report the per-model state from :func:`get_health`.
+"""
+
+from __future__ import annotations
+
+import importlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Sequence
+
+from .model_state import ERROR, READY
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("PIXAI_PRELOAD", "0") == "1"
+MODEL_MODULES = (
+    "modules.nsfw_scanner",
+    "modules.tagging",
+    "modules.deepdanbooru_tags",
+)
+
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+_started: Optional[float] = None
+_finished: Optional[float] = None
+
+
+def _warm(name: str) -> None:
+    try:
+        importlib.import_module(name).warmup()
+        logger.info("Modell %s vorgeladen", name)
+    except Exception:
+        logger.exception("Vorladen von %s fehlgeschlagen", name)
+
+
+def preload(names: Sequence[str] = MODEL_MODULES) -> Dict[str, object]:
+    """Load and warm up ``names`` in parallel; blocks until all are done."""
+    global _started, _finished
+    _started, _finished = time.time(), None
+    with ThreadPoolExecutor(len(names), thread_name_prefix="preload") as pool:
+        list(pool.map(_warm, names))
+    _finished = time.time()
+    logger.info("Vorladen abgeschlossen in %.1fs", _finished - _started)
+    return get_health(names)
+
+
+def start(names: Sequence[str] = MODEL_MODULES) -> threading.Thread:
+    """Run :func:`preload` in a background thread (once)."""
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(
+                target=preload, args=(names,), name="preload", daemon=True
+            )
+            _thread.start()
+        return _thread
+
+
+def _model_states(names: Sequence[str]) -> Dict[str, Dict[str, object]]:
+    states = {}
+    for name in names:
+        try:
+            states[name] = importlib.import_module(name).load_state()
+        except Exception as exc:
+            states[name] = {"state": ERROR, "error": str(exc)}
+    return states
+
+
+def get_health(names: Sequence[str] = MODEL_MODULES) -> Dict[str, object]:
+    """Per-model load state plus overall readiness.
+
+    Without preloading the scanner is ready right away: models load on the
+    first request, which a load balancer gated on ``/ready`` would otherwise
+    never send. With preloading it is ready once every model is loaded or
+    has failed for good (e.g. missing dependency); failed models are
+    reported but do not block traffic since their modules answer with an
+    error entry.
+    """
+    models = _model_states(names)
+    if _started is None:
+        phase = "off"
+    elif _finished is None:
+        phase = "running"
+    else:
+        phase = "done"
+    ready = phase == "off" or (
+        phase == "done" and all(m.get("state") in (READY, ERROR) for m in models.values())
+    )
+    return {"ready": ready, "preload": phase, "models": models}
+
+
+def is_ready() -> bool:
+    return bool(get_health()["ready"])
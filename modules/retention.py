@@ -0,0 +1,248 @@
+"""Retention and compaction for ``scanned/``.
+
+Stored images are content-addressed (see ``image_storage``); the mtime of a
+file is the time of its last upload. A retention run deletes images that
+were not uploaded again for ``PIXAI_RETENTION_DAYS`` days and then, oldest
+first, as many as needed to bring the total below ``PIXAI_RETENTION_MAX_MB``.
+Files are deleted with ``image_storage.remove_object``, so an image that is
+uploaded again during the run is kept.
+Deleted images are removed from the metadata index and the ``index.jsonl``
+files of past months are compacted; the current month's file is left to
+the storage writer. Both record the path as ``image_storage`` wrote it
+(``scanned/objects/ab/<sha256>.jpg``), so files are matched by their path
+below ``base``. The index is the API's ``PIXAI_METADATA_DB`` for the default
+``scanned/`` and ``<base>/metadata.sqlite`` for any other directory.
+
+Runs are dry by default and only report what would be deleted::
+
+    python -m modules.retention --days 90 --max-mb 20000
+    python -m modules.retention --days 90 --max-mb 20000 --apply
+
+With ``PIXAI_RETENTION_INTERVAL`` (seconds) the API applies the configured
+budgets periodically in a background thread.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from . import image_storage, metadata_index
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path("scanned")  # wie image_storage.BASE_DIR
+INDEX_NAME = "index.jsonl"
+MAX_AGE_DAYS = float(os.getenv("PIXAI_RETENTION_DAYS", "0"))  # 0 = kein Alterslimit
+MAX_MB = float(os.getenv("PIXAI_RETENTION_MAX_MB", "0"))  # 0 = kein Größenlimit
+INTERVAL = float(os.getenv("PIXAI_RETENTION_INTERVAL", "0"))  # 0 = kein Hintergrundjob
+REPORT_ITEMS = 20
+
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+
+
+@dataclass
+class StoredFile:
+    path: Path
+    size: int
+    mtime: float
+
+
+def _key(path) -> str:
+    return os.path.normpath(str(path))
+
+
+def _stored_forms(base: Path, path: Path) -> List[str]:
+    """Paths under which the index files and the database may list ``path``."""
+    # image_storage schreibt BASE_DIR/..., ein Import mit ``base`` dessen Pfade
+    forms = [str(BASE_DIR / path.relative_to(base)), str(path)]
+    return list(dict.fromkeys(forms))
+
+
+def _unindex(base: Path, paths: List[str]) -> int:
+    """Remove ``paths`` from the metadata index belonging to ``base``."""
+    if os.path.abspath(base) == os.path.abspath(BASE_DIR):
+        return metadata_index.remove_paths(paths)  # Index der API
+    db = Path(base) / metadata_index.INDEX_DB.name
+    if not db.exists():
+        return 0
+    index = metadata_index.MetadataIndex(db)
+    try:
+        return index.remove(paths)
+    finally:
+        index.close()
+
+
+def scan(base: Path = BASE_DIR) -> List[StoredFile]:
+    """All stored images below ``base``, least recently uploaded first."""
+    files = []
+    for path in Path(base).rglob("*.jpg"):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue  # parallel gelöscht
+        files.append(StoredFile(path, st.st_size, st.st_mtime))
+    files.sort(key=lambda f: f.mtime)
+    return files
+
+
+def plan(
+    files: List[StoredFile],
+    *,
+    max_age_days: float = MAX_AGE_DAYS,
+    max_bytes: int = int(MAX_MB * 1e6),
+    now: Optional[float] = None,
+) -> Dict[str, List[StoredFile]]:
+    """Split ``files`` (sorted by mtime) into ``expired``, ``over_budget`` and ``keep``."""
+    now = time.time() if now is None else now
+    cutoff = now - max_age_days * 86400 if max_age_days > 0 else None
+    expired = [f for f in files if cutoff is not None and f.mtime < cutoff]
+    keep = [f for f in files if cutoff is None or f.mtime >= cutoff]
+    over_budget = []
+    if max_bytes > 0:
+        total = sum(f.size for f in keep)
+        while keep and total > max_bytes:
+            oldest = keep.pop(0)
+            total -= oldest.size
+            over_budget.append(oldest)
+    return {"expired": expired, "over_budget": over_budget, "keep": keep}
+
+
+def _summary(files: List[StoredFile]) -> Dict[str, object]:
+    return {"files": len(files), "bytes": sum(f.size for f in files)}
+
+
+def report(planned: Dict[str, List[StoredFile]]) -> Dict[str, object]:
+    """Dry-run summary of a :func:`plan`."""
+    delete = planned["expired"] + planned["over_budget"]
+    keep = planned["keep"]
+    return {
+        "expired": _summary(planned["expired"]),
+        "over_budget": _summary(planned["over_budget"]),
+        "delete": _summary(delete),
+        "keep": _summary(keep),
+        "oldest_kept": keep[0].mtime if keep else None,
+        "sample": [str(f.path) for f in delete[:REPORT_ITEMS]],
+    }
+
+
+def _delete(files: Iterable[StoredFile]) -> List[StoredFile]:
+    deleted = []
+    for f in files:
+        # seit der Planung erneut hochgeladen -> behalten
+        if not image_storage.remove_object(f.path, f.mtime):
+            continue
+        f.path.with_suffix(".json").unlink(missing_ok=True)  # alte Sidecars
+        deleted.append(f)
+    return deleted
+
+
+def compact_indexes(base: Path, deleted: Set[str]) -> int:
+    """Drop records of ``deleted`` images from past months' ``index.jsonl``."""
+    deleted = {_key(p) for p in deleted}
+    current = Path(base) / time.strftime("%Y_%m")
+    dropped = 0
+    for index in Path(base).glob(f"*/{INDEX_NAME}"):
+        if index.parent == current:
+            continue
+        kept = []
+        with open(index, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    path = json.loads(line).get("path")
+                except ValueError:
+                    continue
+                if path is not None and _key(path) in deleted:
+                    dropped += 1
+                else:
+                    kept.append(line if line.endswith("\n") else line + "\n")
+        if not kept:
+            index.unlink()
+            continue
+        tmp = index.with_suffix(".jsonl.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(tmp, index)
+    return dropped
+
+
+def run(
+    base: Path = BASE_DIR,
+    *,
+    max_age_days: float = MAX_AGE_DAYS,
+    max_bytes: int = int(MAX_MB * 1e6),
+    dry_run: bool = True,
+) -> Dict[str, object]:
+    """Plan a retention run and, unless ``dry_run``, apply it."""
+    with _lock:
+        planned = plan(scan(base), max_age_days=max_age_days, max_bytes=max_bytes)
+        result = report(planned)
+        result["dry_run"] = dry_run
+        if dry_run:
+            return result
+        deleted = _delete(planned["expired"] + planned["over_budget"])
+        result["deleted"] = len(deleted)
+        if deleted:
+            paths = [p for f in deleted for p in _stored_forms(base, f.path)]
+            try:
+                result["unindexed"] = _unindex(base, paths)
+            except Exception:
+                logger.exception("Metadaten-Index konnte nicht bereinigt werden")
+            # leere Ordner bleiben: image_storage merkt sich angelegte Ordner
+            result["index_records_dropped"] = compact_indexes(base, set(paths))
+        logger.info("Retention: %d Bilder gelöscht", len(deleted))
+        return result
+
+
+def _loop(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            run(dry_run=False)
+        except Exception:
+            logger.exception("Retention-Lauf fehlgeschlagen")
+
+
+def start(interval: float = INTERVAL) -> Optional[threading.Thread]:
+    """Apply the configured budgets every ``interval`` seconds (once)."""
+    global _thread
+    if interval <= 0 or (MAX_AGE_DAYS <= 0 and MAX_MB <= 0):
+        return None
+    if _thread is None:
+        _thread = threading.Thread(target=_loop, args=(interval,), name="retention", daemon=True)
+        _thread.start()
+    return _thread
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Retention and compaction for scanned/")
+    parser.add_argument("base", type=Path, nargs="?", default=BASE_DIR)
+    parser.add_argument("--days", type=float, default=MAX_AGE_DAYS, help="max age since last upload")
+    parser.add_argument("--max-mb", type=float, default=MAX_MB, help="total size budget")
+    parser.add_argument("--apply", action="store_true", help="delete instead of reporting")
+    args = parser.parse_args(argv)
+    if not args.base.is_dir():
+        print(f"{args.base} is not a directory", file=sys.stderr)
+        return 1
+    result = run(
+        args.base,
+        max_age_days=args.days,
+        max_bytes=int(args.max_mb * 1e6),
+        dry_run=not args.apply,
+    )
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,244 @@
-"""Statistics module for tracking processed images and tag frequencies."""
+"""Statistics module for tracking processed images and tag frequencies.
+
+The request path only updates in-memory counters. Changes are collected as
+deltas and appended to ``DELTA_LOG`` by a background flusher thread every
+``FLUSH_INTERVAL`` seconds or ``FLUSH_EVERY`` records, and on shutdown. Once
+the log grows beyond ``COMPACT_BYTES`` it is folded into the ``STATS_FILE``
+snapshot. Every delta carries a sequence number and the snapshot stores the
+last one it contains, so a crash between both steps never counts twice.
+
+Tag counts are additionally kept in :class:`TopTags` indexes (overall and
+per DeepDanbooru category), which stay sorted on every increment so
+``/stats`` can return the top N without sorting all tags.
+
+Recent activity is tracked in a ring buffer of per-minute buckets (image
+count, NSFW verdicts, latency sum, bounded top tags); :func:`get_window`
+aggregates the last N minutes of it.
+"""
 
 from __future__ import annotations
 
+import atexit
 import json
 import logging
+import os
 import threading
+import time
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 
 STATS_FILE = Path("scanned/statistics.json")
+DDB_PATH = Path(__file__).with_name("deepdanbooru_model")
+DELTA_LOG = Path("scanned/statistics.log")
+FLUSH_INTERVAL = 5.0  # seconds
+FLUSH_EVERY = 100  # records
+COMPACT_BYTES = 1024 * 1024
+WINDOW_MINUTES = 60  # Länge des Ringpuffers
+BUCKET_TAGS = 50  # Tags pro Minuten-Bucket
+# Pipeline: Keyword-Argument -> Produkt; ``started`` setzt die API
+CONSUMES = {
+    "tags": "tags",
+    "danbooru_tags": "danbooru_tags",
+    "nsfw": "nsfw",
+    "started": "started",
+}
+PER_REQUEST = True  # zählt auch Anfragen, die aus dem Result-Cache kommen
+
+# Beim Reload (Watcher) zuerst die ausstehenden Deltas der alten Instanz sichern
+if "shutdown" in globals():  # pragma: no cover - only on importlib.reload
+    shutdown()
+
+
+class TopTags:
+    """Tags kept sorted by count with O(1) increments.
+
+    ``_order`` is sorted by descending count and ``_first`` maps each count
+    to the index of the first tag having it. Incrementing a tag swaps it with
+    the first tag of its count group and shifts the group boundaries, so the
+    order stays valid without resorting.
+    """
+
+    def __init__(self, counts: Optional[Dict[str, int]] = None):
+        self.counts: Dict[str, int] = counts if counts is not None else {}
+        self._order: List[str] = sorted(
+            self.counts, key=self.counts.__getitem__, reverse=True
+        )
+        self._pos: Dict[str, int] = {t: i for i, t in enumerate(self._order)}
+        self._first: Dict[int, int] = {}
+        for i, tag in enumerate(self._order):
+            self._first.setdefault(self.counts[tag], i)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def increment(self, tag: str) -> None:
+        order, pos, first, counts = self._order, self._pos, self._first, self.counts
+        c = counts.get(tag)
+        if c is None:
+            c = counts[tag] = 0
+            pos[tag] = len(order)
+            order.append(tag)
+            first.setdefault(0, pos[tag])
+        i, j = pos[tag], first[c]
+        if i != j:
+            other = order[j]
+            order[i], order[j] = other, tag
+            pos[other], pos[tag] = i, j
+        if j + 1 < len(order) and counts[order[j + 1]] == c:
+            first[c] = j + 1
+        else:
+            del first[c]
+        counts[tag] = c + 1
+        first.setdefault(c + 1, j)
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        return [(t, self.counts[t]) for t in self._order[:n]]
+
+
+def _load_categories() -> Dict[str, str]:
+    """Map DeepDanbooru tags to ``general``/``character``/``rating``."""
+    try:
+        with (DDB_PATH / "categories.json").open() as f:
+            cats = sorted(json.load(f), key=lambda c: c["start_index"])
+        with (DDB_PATH / "tags.txt").open(encoding="utf-8") as f:
+            tags = [line.strip() for line in f]
+    except Exception:
+        logger.warning("DeepDanbooru categories unavailable")
+        return {}
+    names = {"general": "general", "character": "character", "system": "rating"}
+    mapping = {}
+    for idx, cat in enumerate(cats):
+        stop = cats[idx + 1]["start_index"] if idx + 1 < len(cats) else len(tags)
+        name = names.get(cat["name"].lower(), cat["name"].lower())
+        for tag in tags[cat["start_index"]:stop]:
+            mapping[tag] = name
+    return mapping
+
+
+TAG_CATEGORIES = _load_categories()
+
+
+class _Bucket:
+    __slots__ = ("minute", "count", "nsfw", "latency_sum", "latency_count", "tags")
+
+    def __init__(self, minute: int = -1):
+        self.minute = minute
+        self.count = 0
+        self.nsfw = 0
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.tags: Dict[str, int] = {}
+
+    def add_tags(self, tags: List[str]) -> None:
+        for tag in tags:
+            self.tags[tag] = self.tags.get(tag, 0) + 1
+        if len(self.tags) > 2 * BUCKET_TAGS:
+            keep = sorted(self.tags.items(), key=lambda x: x[1], reverse=True)
+            self.tags = dict(keep[:BUCKET_TAGS])
+
+
+class RollingWindow:
+    """Ring buffer of per-minute buckets covering ``minutes`` minutes."""
+
+    def __init__(self, minutes: int = WINDOW_MINUTES):
+        self.minutes = minutes
+        self._buckets = [_Bucket() for _ in range(minutes)]
+
+    def _bucket(self, minute: int) -> _Bucket:
+        bucket = self._buckets[minute % self.minutes]
+        if bucket.minute != minute:
+            bucket = self._buckets[minute % self.minutes] = _Bucket(minute)
+        return bucket
+
+    def record(
+        self,
+        tags: List[str],
+        *,
+        images: int = 1,
+        nsfw: bool = False,
+        latency: Optional[float] = None,
+        now: Optional[float] = None,
+    ) -> None:
+        bucket = self._bucket(int((now or time.time()) // 60))
+        bucket.count += images
+        bucket.nsfw += int(nsfw)
+        if latency is not None:
+            bucket.latency_sum += latency
+            bucket.latency_count += 1
+        bucket.add_tags(tags)
+
+    def aggregate(
+        self,
+        minutes: int,
+        top: int = 5,
+        now: Optional[float] = None,
+    ) -> Dict[str, object]:
+        minutes = max(1, min(minutes, self.minutes))
+        current = int((now or time.time()) // 60)
+        count = nsfw = latency_count = 0
+        latency_sum = 0.0
+        tags: Dict[str, int] = {}
+        for bucket in self._buckets:
+            if 0 <= current - bucket.minute < minutes:
+                count += bucket.count
+                nsfw += bucket.nsfw
+                latency_sum += bucket.latency_sum
+                latency_count += bucket.latency_count
+                for tag, n in bucket.tags.items():
+                    tags[tag] = tags.get(tag, 0) + n
+        top_tags = sorted(tags.items(), key=lambda x: x[1], reverse=True)[:top]
+        return {
+            "minutes": minutes,
+            "count": count,
+            "per_minute": round(count / minutes, 3),
+            "nsfw": nsfw,
+            "nsfw_rate": round(nsfw / count, 3) if count else 0.0,
+            "avg_latency_ms": (
+                round(latency_sum / latency_count * 1000.0, 1) if latency_count else None
+            ),
+            "top_tags": [{"tag": t, "count": c} for t, c in top_tags],
+        }
+
+
+CATEGORIES = ("general", "character", "rating", "other")
 
 _count = 0
 
 # Global dictionary of tag -> count
 tag_counts: Dict[str, int] = {}
 
+# Sorted indexes over ``tag_counts`` (overall and per category)
+_top = TopTags(tag_counts)
+_top_by_category: Dict[str, TopTags] = {c: TopTags() for c in CATEGORIES}
+
+# Per-minute activity, not persisted
+_window = RollingWindow()
+
 # Lock to guard updates to statistics
 _LOCK = threading.Lock()
 
+# Pending deltas since the last flush (guarded by ``_LOCK``)
+_pending_count = 0
+_pending_tags: Dict[str, int] = {}
+_pending_records = 0
+
+# Serialises writers of DELTA_LOG / STATS_FILE
+_FLUSH_LOCK = threading.Lock()
+_seq = 0
+_wakeup = threading.Event()
+_stop = threading.Event()
+_flusher: Optional[threading.Thread] = None
+
 
 def _load() -> None:
-    """Load statistics from ``STATS_FILE`` if available."""
-    global _count, tag_counts
+    """Load the snapshot from ``STATS_FILE`` and replay ``DELTA_LOG``."""
+    global _count, tag_counts, _seq
+    _count = 0
+    tag_counts = {}
+    _seq = 0
     if STATS_FILE.exists():
         try:
             with STATS_FILE.open() as f:
@@ -33,80 +247,229 @@ def _load() -> None:
             tag_counts = {
                 str(k): int(v) for k, v in data.get("tag_counts", {}).items()
             }
+            _seq = int(data.get("seq", 0))
         except Exception:
             _count = 0
             tag_counts = {}
+    if DELTA_LOG.exists():
+        try:
+            with DELTA_LOG.open() as f:
+                for line in f:
+                    try:
+                        delta = json.loads(line)
+                    except ValueError:
+                        continue  # abgeschnittene letzte Zeile
+                    if int(delta.get("seq", 0)) <= _seq:
+                        continue
+                    _count += int(delta.get("count", 0))
+                    for tag, n in delta.get("tags", {}).items():
+                        tag_counts[tag] = tag_counts.get(tag, 0) + int(n)
+                    _seq = int(delta["seq"])
+        except Exception:
+            logger.exception("Failed to replay %s", DELTA_LOG)
+    _rebuild_indexes()
+
+
+def _rebuild_indexes() -> None:
+    global _top, _top_by_category
+    per_category: Dict[str, Dict[str, int]] = {c: {} for c in CATEGORIES}
+    for tag, n in tag_counts.items():
+        per_category[TAG_CATEGORIES.get(tag, "other")][tag] = n
+    _top = TopTags(tag_counts)
+    _top_by_category = {c: TopTags(per_category[c]) for c in CATEGORIES}
+
+
+def _write_snapshot(count: int, counts: Dict[str, int], seq: int) -> None:
+    """Atomically replace ``STATS_FILE``."""
+    STATS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = STATS_FILE.with_suffix(".json.tmp")
+    with tmp.open("w") as f:
+        json.dump({"count": count, "tag_counts": counts, "seq": seq}, f)
+    os.replace(tmp, STATS_FILE)
+
+
+def _flush(compact: bool = False) -> None:
+    """Append pending deltas to ``DELTA_LOG`` and compact if it is large."""
+    global _pending_count, _pending_tags, _pending_records, _seq
+    with _FLUSH_LOCK:
+        with _LOCK:
+            count, tags = _pending_count, _pending_tags
+            _pending_count, _pending_tags, _pending_records = 0, {}, 0
+        try:
+            if count or tags:
+                _seq += 1
+                DELTA_LOG.parent.mkdir(parents=True, exist_ok=True)
+                line = json.dumps({"seq": _seq, "count": count, "tags": tags})
+                with DELTA_LOG.open("a") as f:
+                    f.write(line + "\n")
+            if compact or (
+                DELTA_LOG.exists() and DELTA_LOG.stat().st_size > COMPACT_BYTES
+            ):
+                with _LOCK:
+                    total = _count - _pending_count
+                    counts = dict(tag_counts)
+                    pending = dict(_pending_tags)
+                # Noch nicht geloggte Deltas gehören nicht in den Snapshot
+                for tag, n in pending.items():
+                    counts[tag] -= n
+                    if counts[tag] <= 0:
+                        del counts[tag]
+                _write_snapshot(total, counts, _seq)
+                DELTA_LOG.unlink(missing_ok=True)
+        except Exception:
+            logger.exception("Failed to persist statistics")
 
 
 def _save() -> None:
-    """Persist current statistics to ``STATS_FILE``."""
-    with _LOCK:
-        _save_locked()
+    """Persist current statistics to ``STATS_FILE`` immediately."""
+    _flush(compact=True)
 
 
-def _save_locked() -> None:
-    """Persist statistics without acquiring the lock (internal)."""
-    try:
-        STATS_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with STATS_FILE.open("w") as f:
-            json.dump({"count": _count, "tag_counts": tag_counts}, f)
-    except Exception:
-        pass
+def _run_flusher(stop: threading.Event, wakeup: threading.Event) -> None:
+    while not stop.is_set():
+        wakeup.wait(FLUSH_INTERVAL)
+        wakeup.clear()
+        _flush()
+
+
+def _ensure_flusher() -> None:
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(
+            target=_run_flusher,
+            args=(_stop, _wakeup),
+            name="statistics-flusher",
+            daemon=True,
+        )
+        _flusher.start()
+
+
+def shutdown() -> None:
+    """Stop the flusher thread and write all pending deltas."""
+    _stop.set()
+    _wakeup.set()
+    _flush(compact=True)
+
+
+def _add_pending_locked(count: int, tags: List[str]) -> None:
+    global _pending_count, _pending_records
+    _pending_count += count
+    for tag in tags:
+        _pending_tags[tag] = _pending_tags.get(tag, 0) + 1
+    _pending_records += 1
+    if _pending_records >= FLUSH_EVERY:
+        _wakeup.set()
 
 
 def record_tags(tags: List[str]) -> None:
     """Record tag occurrences in ``tag_counts``."""
     with _LOCK:
         _record_tags_locked(tags)
+        _add_pending_locked(0, tags)
+        _window.record(tags, images=0)
+    _ensure_flusher()
 
 
 def _record_tags_locked(tags: List[str]) -> None:
     """Record tags without acquiring the lock (internal)."""
     for tag in tags:
-        tag_counts[tag] = tag_counts.get(tag, 0) + 1
+        _top.increment(tag)  # aktualisiert auch ``tag_counts``
+        _top_by_category[TAG_CATEGORIES.get(tag, "other")].increment(tag)
     logger.debug("Recorded tags: %s", tags)
 
 
+def record_scan(
+    tags: List[str],
+    *,
+    nsfw: bool = False,
+    latency: Optional[float] = None,
+) -> None:
+    """Count one scanned image with its tags, NSFW verdict and latency."""
+    global _count
+    with _LOCK:
+        _count += 1
+        _record_tags_locked(tags)
+        _add_pending_locked(1, tags)
+        _window.record(tags, nsfw=nsfw, latency=latency)
+    _ensure_flusher()
+
+
+def get_window(minutes: int, top: int = 5) -> Dict[str, object]:
+    """Aggregate the per-minute buckets of the last ``minutes`` minutes."""
+    with _LOCK:
+        return _window.aggregate(minutes, top)
+
+
 def get_top_tags(n: int = 5) -> List[str]:
     """Return the ``n`` most common tags sorted by frequency."""
-    return [
-        tag
-        for tag, _ in sorted(
-            tag_counts.items(), key=lambda x: x[1], reverse=True
-        )[:n]
-    ]
+    with _LOCK:
+        return [tag for tag, _ in _top.top(n)]
 
 
-def process_image(data: bytes, *, tags: Optional[List[str]] = None):
-    """Increase the image count and optionally record associated tags."""
-    global _count
+def get_top_by_category(n: int = 5) -> Dict[str, List[Dict[str, object]]]:
+    """Return the ``n`` most common tags with counts for each category."""
     with _LOCK:
-        _count += 1
-        logger.info("Image count increased to %d", _count)
+        return {
+            cat: [{"tag": t, "count": c} for t, c in index.top(n)]
+            for cat, index in _top_by_category.items()
+        }
+
 
-        if tags is None:
-            try:  # pragma: no cover - optional dependency
-                from . import tagging
+def _labels(tags) -> List[str]:
+    """Tag names from a list of names or of ``{"label": ...}`` dicts."""
+    labels = []
+    for tag in tags or []:
+        if isinstance(tag, dict):
+            tag = tag.get("label")
+        if tag:
+            labels.append(tag)
+    return labels
 
-                result = tagging.process_image(data)
-                tags = [
-                    t.get("label")
-                    for t in result.get("tags", [])
-                    if isinstance(t, dict)
-                ]
-            except Exception:
-                tags = None
 
-        if tags:
-            _record_tags_locked(tags)
+def process_image(
+    data: bytes,
+    *,
+    context=None,
+    tags: Optional[List] = None,
+    danbooru_tags: Optional[List] = None,
+    nsfw: Optional[Dict[str, object]] = None,
+    started: Optional[float] = None,
+):
+    """Increase the image count and record associated tags.
+
+    In the pipeline ``tags``/``danbooru_tags`` are the tag lists of the
+    tagging modules, ``nsfw`` the NSFW result and ``started`` the request
+    start (``time.monotonic()``) for the latency window. Called on its own
+    the image is tagged with MobileNetV2 first.
+    """
+    if tags is None and started is None:
+        try:  # pragma: no cover - optional dependency
+            from . import tagging
+
+            tags = tagging.process_image(data, context=context).get("tags")
+        except Exception:
+            tags = None
+
+    labels = _labels(tags) + _labels(danbooru_tags)
+    verdict = False
+    if nsfw:
+        from .nsfw_scanner import is_nsfw
 
-        _save_locked()
-        return {"count": _count}
+        verdict = is_nsfw(nsfw)
+    latency = time.monotonic() - started if started is not None else None
+    record_scan(labels, nsfw=verdict, latency=latency)
+    logger.info("Image count increased to %d", _count)
+    return {"count": _count, "recorded": len(labels)}
 
 
-def get_statistics() -> Dict[str, object]:
-    """Return total count and the most common tags."""
-    return {"count": _count, "top_tags": get_top_tags()}
+def get_statistics(top: int = 5) -> Dict[str, object]:
+    """Return total count and the ``top`` most common tags."""
+    return {
+        "count": _count,
+        "top_tags": get_top_tags(top),
+        "top_by_category": get_top_by_category(top),
+    }
 
 
 _load()
+atexit.register(shutdown)
@@ -1,66 +1,124 @@
 """Image tagging module using MobileNetV2.
 
 This module detects objects in images and returns the top predictions.
+Preprocessing and label decoding are plain numpy with the ImageNet class
+index shipped next to this file, so a converted model (``PIXAI_BACKEND``)
+runs without TensorFlow and nothing is downloaded at runtime.
 """
 
+import json
 import logging
-from io import BytesIO
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
 
 logger = logging.getLogger(__name__)
 
-from PIL import Image
+from . import batching, inference
+from .image_context import ensure_context
+from .model_state import LoadState
 
 try:
-    from tensorflow.keras.applications.mobilenet_v2 import (
-        MobileNetV2,
-        decode_predictions,
-        preprocess_input,
-    )
-    from tensorflow.keras.preprocessing.image import img_to_array
+    from tensorflow.keras.applications.mobilenet_v2 import MobileNetV2
 except Exception:  # pragma: no cover - optional dependency
     logger.exception("Failed to import TensorFlow MobileNetV2")
     MobileNetV2 = None
-    decode_predictions = None
-    preprocess_input = None
 
+INPUT_SHAPE = (224, 224, 3)
+INPUT_VARIANTS = ((INPUT_SHAPE[:2], Image.BICUBIC),)  # liest ``preprocess``
+CLASSES = 1000  # ImageNet
+# gleiches Format wie Keras' imagenet_class_index.json: {"0": [wnid, label]}
+CLASS_INDEX = Path(__file__).with_name("imagenet_class_index.json")
+BACKEND_NAME = "tagging"
+PRODUCES = {"tags": "tags"}
 _model = None
+_predict = None
+_scheduler = None
+_load = LoadState()
 
 
 def _ensure_model():
     """Load the MobileNetV2 model if available."""
-    global _model
+    global _model, _predict, _scheduler
     if _model is None:
-        if MobileNetV2 is None:
-            raise RuntimeError("TensorFlow not available")
-        _model = MobileNetV2(weights="imagenet")
+        with _load.lock:
+            if _model is None:
+                with _load.loading():
+                    model = inference.load_converted(BACKEND_NAME, outputs=CLASSES)
+                    if model is not None:
+                        _predict = model
+                    else:
+                        if MobileNetV2 is None:
+                            raise RuntimeError("TensorFlow not available")
+                        model = MobileNetV2(weights="imagenet")
+                        _predict = inference.compile_model(model, INPUT_SHAPE)
+                    _scheduler = batching.get_scheduler("tagging", _predict)
+                    _model = model
     return _model
 
 
-def process_image(data: bytes):
+def warmup() -> None:
+    """Load the model and run one dummy inference to trigger tracing."""
+    _ensure_model()
+    with _load.warming():
+        decode(inference.warmup(_predict, INPUT_SHAPE))
+
+
+def load_state():
+    return _load.as_dict()
+
+
+def preprocess(context) -> np.ndarray:
+    """Return the ``224x224x3`` MobileNetV2 input for an ``ImageContext``.
+
+    Scales to ``[-1, 1]`` like ``mobilenet_v2.preprocess_input``.
+    """
+    arr = context.resized_array(INPUT_SHAPE[:2]).astype(np.float32)
+    return arr / 127.5 - 1.0
+
+
+def predict_batch(contexts) -> np.ndarray:
+    """Raw class probabilities for several images in one ``predict`` call.
+
+    Raises on errors; used for animation frames which arrive as a batch.
+    """
+    _ensure_model()
+    return np.asarray(_predict(np.stack([preprocess(c) for c in contexts])))
+
+
+@lru_cache(maxsize=1)
+def class_labels() -> tuple:
+    """ImageNet labels by class index."""
+    with open(CLASS_INDEX, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    return tuple(index[str(i)][1] for i in range(len(index)))
+
+
+def decode(preds: np.ndarray, top: int = 3):
+    """Turn a ``(n, 1000)`` prediction array into per-image tag lists."""
+    preds = np.asarray(preds)
+    labels = class_labels()
+    best = np.argsort(-preds, axis=1, kind="stable")[:, :top]
+    return [
+        [{"label": labels[i], "score": float(row[i])} for i in idx]
+        for row, idx in zip(preds, best)
+    ]
+
+
+def process_image(data: bytes, *, context=None):
     """Return top image classification tags."""
-    if MobileNetV2 is None:
-        return {"error": "tensorflow not installed"}
     try:
-        model = _ensure_model()
+        _ensure_model()
     except Exception as exc:  # pragma: no cover - environment dependent
         return {"error": str(exc)}
     try:
-        with Image.open(BytesIO(data)) as img:
-            img = img.convert("RGB")
-            img = img.resize((224, 224))
-            arr = img_to_array(img)
+        arr = preprocess(ensure_context(data, context))
     except Exception as exc:
         logger.exception("Failed to preprocess image")
         return {"error": str(exc)}
-    arr = preprocess_input(arr)
-    import numpy as np
-
-    batch = np.expand_dims(arr, axis=0)
-    preds = model.predict(batch)
-    decoded = decode_predictions(preds, top=3)[0]
-    tags = [
-        {"label": label, "score": float(score)}
-        for (_, label, score) in decoded
-    ]
+    preds = np.expand_dims(_scheduler.predict(arr), axis=0)
+    tags = decode(preds)[0]
     logger.info("Tags detected: %s", tags)
     return {"tags": tags}
@@ -0,0 +1,266 @@
+"""Streaming, size-bounded request body parser.
+
+Replaces ``cgi.FieldStorage`` for uploads. The body is read in chunks
+straight into one preallocated ``bytearray`` sized from ``Content-Length``;
+parts are returned as ``memoryview`` slices of that buffer, so the upload is
+never copied again after it left the socket. Oversized requests are
+rejected from the headers alone, and a part that grows past the limit while
+streaming aborts the read immediately.
+
+Besides ``multipart/form-data`` raw bodies (``application/octet-stream``,
+``image/*``, ``video/*``) are accepted for clients that skip multipart.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+CHUNK_SIZE = 64 * 1024
+HEADER_SLACK = 16 * 1024  # Boundaries und Part-Header neben den Nutzdaten
+MAX_HEADER_SIZE = 8 * 1024
+RAW_TYPES = ("application/octet-stream", "image/", "video/")
+CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+
+_OPTION_RE = re.compile(r';\s*([\w\-]+)\*?\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)')
+
+
+class PayloadTooLarge(Exception):
+    """The request body or one of its parts exceeds the size limit."""
+
+
+class MultipartError(ValueError):
+    """The request body is malformed or incomplete."""
+
+
+@dataclass
+class Part:
+    name: str
+    filename: Optional[str]
+    content_type: str
+    data: memoryview
+
+    @property
+    def type(self) -> str:
+        """Alias matching ``cgi.FieldStorage.type``."""
+        return self.content_type
+
+
+def parse_options(value: str) -> Tuple[str, Dict[str, str]]:
+    """Split a header like ``form-data; name="x"`` into value and options."""
+    main, _, rest = value.partition(";")
+    opts = {}
+    for key, val in _OPTION_RE.findall(";" + rest):
+        val = val.strip()
+        if len(val) >= 2 and val[0] == val[-1] == '"':
+            val = val[1:-1].replace('\\"', '"')
+        opts[key.lower()] = val
+    return main.strip().lower(), opts
+
+
+def is_supported(content_type: str) -> bool:
+    """Return ``True`` for multipart or raw upload content types."""
+    ctype = (content_type or "").split(";", 1)[0].strip().lower()
+    return ctype == "multipart/form-data" or ctype.startswith(RAW_TYPES)
+
+
+class BodyParser:
+    """Incremental parser fed by writing into :meth:`free` and :meth:`feed`."""
+
+    def __init__(
+        self,
+        content_type: str,
+        content_length: Optional[int],
+        max_part_size: int,
+        *,
+        default_name: str = "file",
+    ):
+        ctype, opts = parse_options(content_type or "")
+        if content_length is None:
+            raise MultipartError("content-length required")
+        self.max_part_size = max_part_size
+        self.default_name = default_name
+        self.content_type = ctype
+        self.raw = ctype != "multipart/form-data"
+        if self.raw:
+            if not ctype.startswith(RAW_TYPES):
+                raise MultipartError(f"unsupported content-type: {ctype}")
+            limit = max_part_size
+        else:
+            boundary = opts.get("boundary")
+            if not boundary:
+                raise MultipartError("multipart boundary missing")
+            self._first_delim = b"--" + boundary.encode("latin-1")
+            self._delim = b"\r\n" + self._first_delim
+            limit = max_part_size + HEADER_SLACK
+        if content_length > limit:
+            raise PayloadTooLarge(f"{content_length} bytes exceed {limit}")
+
+        self.length = content_length
+        self._buf = bytearray(content_length)
+        self._view = memoryview(self._buf)
+        self._pos = 0
+        # Multipart-Zustand: Suche nach dem ersten Delimiter
+        self._scan = 0
+        self._hdr_start: Optional[int] = None
+        self._data_start: Optional[int] = None
+        self._headers = b""
+        self._in_preamble = True
+        self._finished = False
+        self._parts: Dict[str, Part] = {}
+
+    # ---------- feeding ----------
+    @property
+    def complete(self) -> bool:
+        return self._pos >= self.length
+
+    def free(self, size: int = CHUNK_SIZE) -> memoryview:
+        """Writable slice of the buffer for the next chunk."""
+        return self._view[self._pos:min(self.length, self._pos + size)]
+
+    def feed(self, n: int) -> None:
+        """Account for ``n`` bytes written into :meth:`free`."""
+        self._pos += n
+        if not self.raw:
+            self._advance()
+
+    def result(self) -> Dict[str, Part]:
+        """Return the parsed parts once the whole body has been fed."""
+        if not self.complete:
+            raise MultipartError("incomplete body")
+        if self.raw:
+            return {
+                self.default_name: Part(
+                    self.default_name, None, self.content_type, self._view
+                )
+            }
+        if not self._finished:
+            raise MultipartError("closing boundary missing")
+        return self._parts
+
+    # ---------- multipart state machine ----------
+    def _advance(self) -> None:
+        buf, end = self._buf, self._pos
+        while not self._finished:
+            if self._in_preamble:
+                idx = buf.find(self._first_delim, self._scan, end)
+                if idx < 0:
+                    self._scan = max(0, end - len(self._first_delim) + 1)
+                    return
+                self._in_preamble = False
+                self._hdr_start = idx + len(self._first_delim)
+                continue
+
+            if self._hdr_start is not None:
+                # Nach einem Delimiter folgen "\r\n" (neuer Part) oder "--"
+                if end - self._hdr_start < 2:
+                    return
+                if buf[self._hdr_start:self._hdr_start + 2] == b"--":
+                    self._finished = True
+                    return
+                idx = buf.find(b"\r\n\r\n", self._hdr_start, end)
+                if idx < 0:
+                    if end - self._hdr_start > MAX_HEADER_SIZE:
+                        raise MultipartError("part headers too long")
+                    return
+                self._headers = bytes(buf[self._hdr_start + 2:idx])
+                self._hdr_start = None
+                self._data_start = self._scan = idx + 4
+                continue
+
+            idx = buf.find(self._delim, self._scan, end)
+            if idx < 0:
+                if end - self._data_start > self.max_part_size + len(self._delim):
+                    raise PayloadTooLarge("part exceeds size limit")
+                self._scan = max(self._data_start, end - len(self._delim) + 1)
+                return
+            if idx - self._data_start > self.max_part_size:
+                raise PayloadTooLarge("part exceeds size limit")
+            self._add_part(self._headers, self._data_start, idx)
+            self._data_start = None
+            self._hdr_start = idx + len(self._delim)
+
+    def _add_part(self, raw_headers: bytes, start: int, stop: int) -> None:
+        headers = {}
+        for line in raw_headers.decode("utf-8", "replace").split("\r\n"):
+            key, sep, value = line.partition(":")
+            if sep:
+                headers[key.strip().lower()] = value.strip()
+        disposition, opts = parse_options(headers.get("content-disposition", ""))
+        name = opts.get("name")
+        if disposition != "form-data" or name is None:
+            return
+        ctype = headers.get("content-type", "text/plain").split(";", 1)[0].strip()
+        self._parts.setdefault(
+            name, Part(name, opts.get("filename"), ctype, self._view[start:stop])
+        )
+
+
+def content_length(headers) -> Optional[int]:
+    """Return the ``Content-Length`` header as int or ``None``."""
+    value = headers.get("Content-Length")
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        raise MultipartError("invalid content-length")
+
+
+def read_body(
+    rfile,
+    headers,
+    max_part_size: int,
+    *,
+    default_name: str = "file",
+) -> Dict[str, Part]:
+    """Read and parse a request body from a blocking binary file object."""
+    parser = BodyParser(
+        headers.get("Content-Type", ""),
+        content_length(headers),
+        max_part_size,
+        default_name=default_name,
+    )
+    while not parser.complete:
+        n = rfile.readinto(parser.free())
+        if not n:
+            raise MultipartError("unexpected end of body")
+        parser.feed(n)
+    return parser.result()
+
+
+def expects_continue(headers) -> bool:
+    """``True`` if the client waits for ``100 Continue`` before the body."""
+    return (headers.get("Expect") or "").strip().lower() == "100-continue"
+
+
+async def read_body_async(
+    reader,
+    headers,
+    max_part_size: int,
+    *,
+    default_name: str = "file",
+    writer=None,
+) -> Dict[str, Part]:
+    """Read and parse a request body from an ``asyncio.StreamReader``.
+
+    With ``writer`` a client sending ``Expect: 100-continue`` gets the
+    interim response once the headers passed the size check; an oversized
+    request is rejected without the client ever sending its body.
+    """
+    parser = BodyParser(
+        headers.get("Content-Type", ""),
+        content_length(headers),
+        max_part_size,
+        default_name=default_name,
+    )
+    if writer is not None and expects_continue(headers):
+        writer.write(CONTINUE)
+        await writer.drain()
+    while not parser.complete:
+        free = parser.free()
+        chunk = await reader.read(len(free))
+        if not chunk:
+            raise MultipartError("unexpected end of body")
+        free[:len(chunk)] = chunk
+        parser.feed(len(chunk))
+    return parser.result()
@@ -0,0 +1,218 @@
+"""Dependency-aware module pipeline for ``scanner_api.process_image``.
+
+Modules declare what they exchange with other modules:
+
+``PRODUCES``
+    ``{product: key}`` – the module's result provides ``product``; ``key``
+    selects the entry of the result dict, ``None`` passes the whole result.
+``CONSUMES``
+    ``{argument: product}`` – ``process_image`` receives ``product`` as
+    keyword ``argument``.
+``STAGE_TIMEOUT``
+    Optional per-module timeout in seconds (default ``PIXAI_STAGE_TIMEOUT``).
+``PER_REQUEST``
+    ``True`` for modules with side effects (storage, statistics): their
+    results are not cached and they run again when the other results are
+    served from the cache (``Pipeline.run(..., known=cached)``).
+
+A module only waits for the modules producing what it consumes, so the
+independent model modules run concurrently on a shared thread pool. A stage
+that exceeds its timeout is reported as ``{"error": "timeout ..."}`` and its
+consumers continue without its product instead of stalling the request.
+Modules without declarations (e.g. ``module_a``) start right away.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+from modules.image_context import ImageContext, call_process_image
+
+logger = logging.getLogger(__name__)
+
+STAGE_TIMEOUT = float(os.getenv("PIXAI_STAGE_TIMEOUT", "60"))
+THREADS = int(os.getenv("PIXAI_PIPELINE_THREADS", str(4 * (os.cpu_count() or 2))))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+@dataclass
+class Stage:
+    name: str
+    module: object
+    consumes: Dict[str, str]
+    produces: Dict[str, Optional[str]]
+    timeout: float
+    after: Tuple[str, ...] = ()  # Stufen, deren Produkte gebraucht werden
+    per_request: bool = False
+
+
+@dataclass
+class PipelineResult:
+    results: Dict[str, object] = field(default_factory=dict)
+    timed_out: List[str] = field(default_factory=list)
+    errors: Dict[str, Exception] = field(default_factory=dict)
+
+    @property
+    def complete(self) -> bool:
+        """``False`` if a stage timed out or could not be scheduled."""
+        return not self.timed_out and not any(
+            isinstance(e, UnresolvedDependency) for e in self.errors.values()
+        )
+
+
+class UnresolvedDependency(RuntimeError):
+    """The stage is part of a dependency cycle."""
+
+
+Runner = Callable[[Stage, ImageContext, Dict[str, object]], object]
+
+
+def call_stage(stage: Stage, context: ImageContext, kwargs: Dict[str, object]):
+    """Default runner: call the module's ``process_image`` in this process."""
+    return call_process_image(stage.module.process_image, context, **kwargs)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(THREADS, thread_name_prefix="pipeline")
+        return _executor
+
+
+def build_stages(modules: Mapping[str, object]) -> List[Stage]:
+    """One stage per module with ``process_image``, in ``modules`` order."""
+    stages = [
+        Stage(
+            name,
+            mod,
+            dict(getattr(mod, "CONSUMES", {}) or {}),
+            dict(getattr(mod, "PRODUCES", {}) or {}),
+            float(getattr(mod, "STAGE_TIMEOUT", STAGE_TIMEOUT)),
+            per_request=bool(getattr(mod, "PER_REQUEST", False)),
+        )
+        for name, mod in modules.items()
+        if hasattr(mod, "process_image")
+    ]
+    producers: Dict[str, List[str]] = {}
+    for stage in stages:
+        for product in stage.produces:
+            producers.setdefault(product, []).append(stage.name)
+    for stage in stages:
+        after = {
+            producer
+            for product in stage.consumes.values()
+            for producer in producers.get(product, ())
+            if producer != stage.name
+        }
+        stage.after = tuple(sorted(after))
+    return stages
+
+
+class Pipeline:
+    """Runs the stages of one module set for a request."""
+
+    def __init__(
+        self,
+        modules: Mapping[str, object],
+        *,
+        runner: Runner = call_stage,
+        version: Optional[int] = None,
+    ):
+        self.stages = build_stages(modules)
+        self.runner = runner
+        self.version = version
+
+    def cacheable(self, results: Dict[str, object]) -> Dict[str, object]:
+        """``results`` without the ``PER_REQUEST`` stages."""
+        skip = {s.name for s in self.stages if s.per_request}
+        return {name: r for name, r in results.items() if name not in skip}
+
+    def run(
+        self,
+        context: ImageContext,
+        inputs: Optional[Dict[str, object]] = None,
+        *,
+        known: Optional[Dict[str, object]] = None,
+    ) -> PipelineResult:
+        """Run all stages on ``context``; ``inputs`` seeds extra products.
+
+        Stages with a result in ``known`` (a cached run) are not run again,
+        their results only provide the products for the remaining stages.
+        """
+        products: Dict[str, object] = dict(inputs or {})
+        outcome = PipelineResult()
+        finished = set()
+        waiting = list(self.stages)
+        running: Dict[Future, Tuple[Stage, float]] = {}
+        executor = _get_executor()
+
+        def publish(stage: Stage, result) -> None:
+            outcome.results[stage.name] = result
+            for product, key in stage.produces.items():
+                if key is None:
+                    products[product] = result
+                elif isinstance(result, dict):
+                    products[product] = result.get(key)
+            finished.add(stage.name)
+
+        for stage in list(waiting):
+            if known and stage.name in known and not stage.per_request:
+                waiting.remove(stage)
+                publish(stage, known[stage.name])
+
+        def start_ready():
+            for stage in list(waiting):
+                if all(dep in finished for dep in stage.after):
+                    waiting.remove(stage)
+                    kwargs = {arg: products.get(p) for arg, p in stage.consumes.items()}
+                    future = executor.submit(self.runner, stage, context, kwargs)
+                    running[future] = (stage, time.monotonic() + stage.timeout)
+
+        start_ready()
+        while running:
+            deadline = min(d for _, d in running.values())
+            done, _ = wait(
+                running,
+                timeout=max(0.0, deadline - time.monotonic()),
+                return_when=FIRST_COMPLETED,
+            )
+            now = time.monotonic()
+            for future, (stage, deadline) in list(running.items()):
+                if future in done:
+                    try:
+                        result = future.result()
+                    except Exception as exc:
+                        logger.exception("Module %s failed", stage.name)
+                        outcome.errors[stage.name] = exc
+                        result = {"error": str(exc)}
+                elif now >= deadline:
+                    # Thread läuft weiter, sein Ergebnis wird verworfen
+                    future.cancel()
+                    logger.warning("Module %s timed out after %.1fs", stage.name, stage.timeout)
+                    outcome.timed_out.append(stage.name)
+                    result = {"error": f"timeout after {stage.timeout:g}s"}
+                else:
+                    continue
+                del running[future]
+                publish(stage, result)
+            start_ready()
+
+        for stage in waiting:
+            exc = UnresolvedDependency(f"waits for {', '.join(stage.after)}")
+            logger.error("Module %s not run: %s", stage.name, exc)
+            outcome.errors[stage.name] = exc
+            outcome.results[stage.name] = {"error": str(exc)}
+        # Reihenfolge wie in modules.cfg, nicht nach Fertigstellung
+        outcome.results = {
+            s.name: outcome.results[s.name] for s in self.stages if s.name in outcome.results
+        }
+        return outcome
@@ -0,0 +1,277 @@
+"""Content-addressed cache for scan results.
+
+Results are keyed by the SHA-256 of the upload bytes together with a
+signature of the currently loaded modules (``ModuleManager.version`` and the
+module files), so a reload with changed modules never serves stale results.
+Optionally a perceptual hash (dHash) is stored as secondary key to catch
+re-encoded reposts of the same picture.
+
+Two tiers are used: a bounded in-memory LRU and a sqlite database under
+``scanned/``. The memory tier has its own lock, so a lookup never waits for
+sqlite; disk access times are collected and written in batches. Callers get
+their own copy of a cached result. Hit, miss and eviction counters are
+available through :meth:`ResultCache.get_statistics`.
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+CACHE_DB = Path("scanned/result_cache.sqlite")
+MAX_ENTRIES = int(os.getenv("PIXAI_CACHE_SIZE", "1024"))
+MAX_DISK_ENTRIES = int(os.getenv("PIXAI_CACHE_DISK_SIZE", "100000"))
+USE_PHASH = os.getenv("PIXAI_CACHE_PHASH", "0") == "1"
+TRIM_EVERY = 1000
+TOUCH_BATCH = 100  # Zugriffszeiten pro UPDATE-Batch
+
+
+def image_hash(data: bytes) -> str:
+    """Return the hex SHA-256 of ``data``."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(context) -> Optional[str]:
+    """Return a 64-bit difference hash (dHash) of an ``ImageContext``.
+
+    Flat images produce a degenerate hash shared by unrelated pictures, so
+    ``None`` is returned for them.
+    """
+    gray = context.resized((9, 8), Image.BILINEAR).convert("L")
+    px = np.asarray(gray, dtype=np.int16)
+    bits = (px[:, 1:] > px[:, :-1]).flatten()
+    if not bits.any() or bits.all():
+        return None
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+
+
+def module_signature(manager) -> str:
+    """Fingerprint of the loaded module set and their source files."""
+    parts = [f"v{manager.version}"]
+    for name, mod in sorted(manager.get_modules().items()):
+        path = getattr(mod, "__file__", None)
+        try:
+            mtime = os.stat(path).st_mtime_ns if path else 0
+        except OSError:
+            mtime = 0
+        parts.append(f"{name}:{mtime}")
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+
+def is_cacheable(result) -> bool:
+    """Only cache complete results without module errors."""
+    if not isinstance(result, dict) or "error" in result:
+        return False
+    return not any(isinstance(v, dict) and "error" in v for v in result.values())
+
+
+class ResultCache:
+    """Two-tier (memory LRU + sqlite) result cache."""
+
+    def __init__(
+        self,
+        path: Path = CACHE_DB,
+        *,
+        max_entries: int = MAX_ENTRIES,
+        max_disk_entries: int = MAX_DISK_ENTRIES,
+        use_phash: bool = USE_PHASH,
+    ):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.use_phash = use_phash
+        self._mem: "OrderedDict[str, dict]" = OrderedDict()
+        self._phash: Dict[str, str] = {}
+        self._lock = threading.Lock()  # Speicher-Tier und Zähler
+        self._db_lock = threading.Lock()  # sqlite-Verbindung
+        self._db: Optional[sqlite3.Connection] = None
+        self._touched: Dict[str, float] = {}  # noch nicht geschriebene Zugriffszeiten
+        self._puts = 0
+        self._counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "phash_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "disk_evictions": 0,
+        }
+
+    # ---------- sqlite ----------
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        """Open the disk tier lazily; returns ``None`` if unavailable.
+
+        Callers hold ``_db_lock``.
+        """
+        if self._db is None and self.max_disk_entries > 0:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                db = sqlite3.connect(str(self.path), check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS results ("
+                    " key TEXT PRIMARY KEY, phash TEXT, result TEXT,"
+                    " accessed REAL)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS results_phash ON results(phash)")
+                db.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results(accessed)")
+                self._db = db
+            except Exception:
+                logger.exception("Result cache database unavailable")
+                self.max_disk_entries = 0
+        return self._db
+
+    # ---------- keys ----------
+    @staticmethod
+    def make_key(digest: str, signature: str, kind: str = "check") -> str:
+        return f"{kind}:{signature}:{digest}"
+
+    # ---------- lookup ----------
+    def get(self, key: str, phash: Optional[str] = None) -> Optional[dict]:
+        """Return a copy of the cached result for ``key`` or ``None``."""
+        with self._lock:
+            result = self._mem.get(key)
+            if result is not None:
+                self._mem.move_to_end(key)
+                self._counters["hits"] += 1
+                return copy.deepcopy(result)
+            if phash and self.use_phash:
+                alias = self._phash.get(self._phash_key(key, phash))
+                if alias is not None and alias in self._mem:
+                    self._mem.move_to_end(alias)
+                    self._counters["hits"] += 1
+                    self._counters["phash_hits"] += 1
+                    return copy.deepcopy(self._mem[alias])
+
+        row, by_phash = self._lookup_disk(key, phash)
+        with self._lock:
+            if row is None:
+                self._counters["misses"] += 1
+                return None
+            result = json.loads(row[1])
+            self._counters["hits"] += 1
+            self._counters["disk_hits"] += 1
+            if by_phash:
+                self._counters["phash_hits"] += 1
+            self._remember(key, result, phash)
+            return copy.deepcopy(result)
+
+    def put(self, key: str, result: dict, phash: Optional[str] = None) -> None:
+        """Store a copy of ``result`` in both tiers."""
+        if not is_cacheable(result):
+            return
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._remember(key, result, phash)
+        with self._db_lock:
+            db = self._conn()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO results (key, phash, result, accessed)"
+                    " VALUES (?, ?, ?, ?)",
+                    (
+                        key,
+                        self._phash_key(key, phash) if phash and self.use_phash else None,
+                        json.dumps(result),
+                        time.time(),
+                    ),
+                )
+                self._write_touched(db)
+                db.commit()
+                self._puts += 1
+                if self._puts % TRIM_EVERY == 0:
+                    self._trim_disk(db)
+            except Exception:
+                logger.exception("Result cache write failed")
+
+    # ---------- internals ----------
+    @staticmethod
+    def _phash_key(key: str, phash: str) -> str:
+        # phash matches are only valid for the same kind and module signature
+        kind, signature, _ = key.split(":", 2)
+        return f"{kind}:{signature}:{phash}"
+
+    def _remember(self, key: str, result: dict, phash: Optional[str]) -> None:
+        self._mem[key] = result
+        self._mem.move_to_end(key)
+        if phash and self.use_phash:
+            self._phash[self._phash_key(key, phash)] = key
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self._counters["evictions"] += 1
+        if len(self._phash) > 2 * self.max_entries:
+            self._phash = {p: k for p, k in self._phash.items() if k in self._mem}
+
+    def _lookup_disk(self, key: str, phash: Optional[str]) -> tuple:
+        """``((key, result json), found by phash)`` from sqlite, ``(None, False)`` if absent."""
+        with self._db_lock:
+            db = self._conn()
+            if db is None:
+                return None, False
+            try:
+                row = db.execute(
+                    "SELECT key, result FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                by_phash = False
+                if row is None and phash and self.use_phash:
+                    row = db.execute(
+                        "SELECT key, result FROM results WHERE phash = ? LIMIT 1",
+                        (self._phash_key(key, phash),),
+                    ).fetchone()
+                    by_phash = row is not None
+                if row is not None:
+                    # Zugriffszeit nur vormerken, geschrieben wird gebündelt
+                    self._touched[row[0]] = time.time()
+                    if len(self._touched) >= TOUCH_BATCH:
+                        self._write_touched(db)
+                        db.commit()
+                return row, by_phash
+            except Exception:
+                logger.exception("Result cache lookup failed")
+                return None, False
+
+    def _write_touched(self, db: sqlite3.Connection) -> None:
+        """Write the collected access times (``_db_lock`` held, no commit)."""
+        if self._touched:
+            db.executemany(
+                "UPDATE results SET accessed = ? WHERE key = ?",
+                [(t, k) for k, t in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _trim_disk(self, db: sqlite3.Connection) -> None:
+        (count,) = db.execute("SELECT COUNT(*) FROM results").fetchone()
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            db.execute(
+                "DELETE FROM results WHERE key IN ("
+                " SELECT key FROM results ORDER BY accessed LIMIT ?)",
+                (excess,),
+            )
+            db.commit()
+            with self._lock:
+                self._counters["disk_evictions"] += excess
+
+    def get_statistics(self) -> Dict[str, object]:
+        with self._lock:
+            stats: Dict[str, object] = dict(self._counters)
+            stats["entries"] = len(self._mem)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
@@ -1,18 +1,18 @@
 # scanner_api.py
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-import cgi, json, logging, asyncio, mimetypes, socket
+import json, logging, asyncio, mimetypes, socket, time
 from urllib.parse import parse_qs, urlparse
-from io import BytesIO
 
 from main import ModuleManager
-from modules import (
-    image_storage,
-    nsfw_scanner,
-    statistics,
-    tagging,
-    deepdanbooru_tags,
-)
+from modules import image_storage, metadata_index, retention, statistics
+from modules import batching, preload
+from modules.image_context import ImageContext
 import token_manager
+import metrics
+import result_cache
+import worker_pool
+import pipeline
+import multipart
 from gif_batch import scan_batch
 
 logging.basicConfig(
@@ -22,82 +22,257 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 manager = ModuleManager()
+cache = result_cache.ResultCache()
+_pipeline = None
 
 MAX_IMAGE_SIZE = 10 * 1024 * 1024
 MAX_BATCH_SIZE = 25 * 1024 * 1024
+MAX_TOP_TAGS = 1000
+WINDOW_UNITS = {"m": 1, "h": 60}
+
+
+def _is_valid_image(data) -> bool:
+    ctx = data if isinstance(data, ImageContext) else ImageContext(data)
+    return ctx.is_valid()
+
+
+def _cache_key(data: bytes, kind: str = "check") -> str:
+    signature = result_cache.module_signature(manager)
+    return cache.make_key(result_cache.image_hash(data), signature, kind)
+
+
+def _labels(result) -> list:
+    if not isinstance(result, dict):
+        return []
+    return [t.get("label") for t in result.get("tags") or [] if isinstance(t, dict)]
+
+
+def _run_stage(stage: pipeline.Stage, ctx: ImageContext, kwargs: dict):
+    """Pipeline runner: model stages go to the worker processes if enabled."""
+    pool = worker_pool.get_pool()
+    with metrics.stage(stage.name):
+        if pool is not None and stage.name in pool.names:
+            out = pool.run(ctx, (stage.name,))
+            result = out.get(stage.name, out)
+        else:
+            result = pipeline.call_stage(stage, ctx, kwargs)
+    if isinstance(result, dict) and "error" in result:
+        metrics.STAGE_ERRORS.inc(stage=stage.name, kind="error")
+    return result
+
+
+def get_pipeline() -> pipeline.Pipeline:
+    """Stage graph of the loaded modules, rebuilt after a module reload."""
+    global _pipeline
+    version = manager.version
+    current = _pipeline
+    if current is None or current.version != version:
+        current = pipeline.Pipeline(manager.get_modules(), runner=_run_stage, version=version)
+        _pipeline = current
+    return current
+
+
+def process_image(image_bytes: bytes, *, context: ImageContext = None) -> dict:
+    """Run all modules on one image, decoding it only once.
+
+    Modules run as a dependency graph (see ``pipeline``): independent ones
+    concurrently, stages that time out are reported as errors. Results are
+    served from the content-addressed cache when the same image was already
+    scanned with the current module set; incomplete results are not cached.
+    ``PER_REQUEST`` stages (storage, statistics) are never cached and run
+    on every request, on a cache hit with the cached products as input.
+    """
+    start = time.monotonic()
+    try:
+        ctx = context if context is not None else ImageContext(image_bytes)
+        with metrics.stage("cache"):
+            key = _cache_key(image_bytes)
+            phash = result_cache.perceptual_hash(ctx) if cache.use_phash else None
+            cached = cache.get(key, phash)
+        graph = get_pipeline()
+        run = graph.run(ctx, {"started": start}, known=cached)
+        for name in run.timed_out:
+            metrics.STAGE_ERRORS.inc(stage=name, kind="timeout")
+        if cached is not None:
+            return run.results
+
+        crashed = any(
+            isinstance(e, worker_pool.WorkerCrashed) for e in run.errors.values()
+        )
+        if run.complete and not crashed:
+            cache.put(key, graph.cacheable(run.results), phash)
+        return run.results
+    except Exception as e:
+        logger.exception("process_image failed")
+        return {"error": str(e)}
+
+
+def health_response(path: str) -> tuple:
+    """Handle ``/health`` and ``/ready``; returns ``(status, payload)``.
+
+    ``/health`` always answers 200 with the per-model load state, ``/ready``
+    answers 503 until the models are loaded.
+    """
+    pool = worker_pool.get_pool()
+    health = pool.get_health() if pool is not None else preload.get_health()
+    if path == "/ready" and not health["ready"]:
+        return 503, health
+    return 200, health
 
 
-def _is_valid_image(data: bytes) -> bool:
+def token_response(query: str) -> tuple:
+    """Handle ``/token``; returns ``(status, token or error payload)``."""
+    email = parse_qs(query).get("email", [None])[0]
+    if not email:
+        return 400, {"error": "missing email"}
+    renew = "renew" in query
+    return 200, token_manager.get_token(email, renew=renew)
+
+
+def _window_minutes(value: str):
+    """Parse ``15m``/``2h``/``30`` into minutes; ``None`` if invalid."""
+    value = (value or "").strip().lower()
+    factor = WINDOW_UNITS.get(value[-1:])
+    if factor is not None:
+        value = value[:-1]
     try:
-        from PIL import Image
-        with Image.open(BytesIO(data)) as img:
-            img.verify()
-        return True
-    except Exception:
-        return False
+        minutes = int(value) * (factor or 1)
+    except ValueError:
+        return None
+    return minutes if minutes > 0 else None
+
 
+def get_stats(query: str = "") -> dict:
+    """Payload of the ``/stats`` endpoint.
 
-def process_image(image_bytes: bytes) -> dict:
+    ``?top=N`` selects the list size, ``?window=15m`` adds an aggregate of
+    the last minutes from the rolling per-minute buckets.
+    """
+    params = parse_qs(query)
     try:
-        results = {}
-        try:
-            nsfw_result = nsfw_scanner.process_image(image_bytes)
-        except Exception as e:
-            nsfw_result = {"error": str(e)}
-        results["modules.nsfw_scanner"] = nsfw_result
+        top = int(params.get("top", ["5"])[0])
+    except ValueError:
+        top = 5
+    top = max(1, min(top, MAX_TOP_TAGS))
+    stats = statistics.get_statistics(top)
+    if "window" in params:
+        minutes = _window_minutes(params["window"][0])
+        if minutes is None:
+            stats["window"] = {"error": "invalid window"}
+        else:
+            stats["window"] = statistics.get_window(minutes, top)
+    stats["batching"] = batching.get_statistics()
+    stats["cache"] = cache.get_statistics()
+    stats["storage"] = image_storage.get_statistics()
+    pool = worker_pool.get_pool()
+    if pool is not None:
+        stats["workers"] = pool.get_statistics()
+    return stats
+
+
+def _component_metrics() -> list:
+    """``/metrics`` families read from batching, cache and storage on scrape."""
+    sizes, waits = [], []
+    for model, sched in sorted(batching.get_statistics().items()):
+        sizes += metrics.histogram_samples({"model": model}, sched["batch_size"])
+        waits += metrics.histogram_samples({"model": model}, sched["queue_wait_ms"])
+    cached = cache.get_statistics()
+    stored = image_storage.get_statistics()
+    return (
+        metrics.format_family("pixai_batch_size", "histogram", "Samples per model call", sizes)
+        + metrics.format_family(
+            "pixai_batch_queue_wait_ms", "histogram", "Wait for the batch window in ms", waits
+        )
+        + metrics.format_family(
+            "pixai_cache_events_total",
+            "counter",
+            "Result cache lookups and evictions",
+            [
+                ("", {"event": k}, cached[k])
+                for k in ("hits", "disk_hits", "phash_hits", "misses", "evictions", "disk_evictions")
+            ],
+        )
+        + metrics.format_family(
+            "pixai_storage_images_total",
+            "counter",
+            "Images by storage outcome",
+            [
+                ("", {"outcome": k}, stored[k])
+                for k in ("queued", "written", "duplicates", "dropped", "failed", "indexed")
+            ],
+        )
+    )
+
+
+def _worker_jobs() -> int:
+    pool = worker_pool.get_pool()
+    return pool.get_statistics()["pending"] if pool is not None else 0
+
+
+metrics.register_collector("components", _component_metrics)
+metrics.gauge(
+    "pixai_batch_queue_depth",
+    "Samples waiting for a batch",
+    ("model",),
+    callback=lambda: {m: s["queued"] for m, s in batching.get_statistics().items()},
+)
+metrics.gauge(
+    "pixai_storage_queue_depth",
+    "Images waiting for the storage writers",
+    callback=lambda: image_storage.get_statistics()["pending"],
+)
+metrics.gauge("pixai_cache_entries", "Results in the memory cache", callback=lambda: cache.get_statistics()["entries"])
+metrics.gauge("pixai_worker_jobs_pending", "Jobs sent to worker processes", callback=_worker_jobs)
 
-        try:
-            tag_result = tagging.process_image(image_bytes)
-        except Exception as e:
-            tag_result = {"error": str(e)}
-        results["modules.tagging"] = tag_result
-        tags = [t.get("label") for t in tag_result.get("tags", []) if isinstance(t, dict)]
 
-        try:
-            ddb_result = deepdanbooru_tags.process_image(image_bytes)
-        except Exception as e:
-            ddb_result = {"error": str(e)}
-        results["modules.deepdanbooru_tags"] = ddb_result
-        ddb_tags = [t.get("label") for t in ddb_result.get("tags", []) if isinstance(t, dict)]
+def search_response(query: str) -> tuple:
+    """Handle ``/search``; returns ``(status, payload)``.
 
-        all_labels = tags + ddb_tags
-        try:
-            statistics.record_tags(all_labels)
-            results["modules.statistics"] = {"recorded": len(all_labels)}
-        except Exception as e:
-            results["modules.statistics"] = {"error": str(e)}
+    Filters: ``tag`` (repeatable, ``-tag`` excludes),
+    ``<score>_min``/``<score>_max`` (e.g. ``porn_min=0.8``),
+    ``since``/``until`` (ISO date or unix time), ``limit`` and ``offset``.
+    """
+    try:
+        filters = metadata_index.parse_query(parse_qs(query))
+        return 200, metadata_index.search(**filters)
+    except ValueError as e:
+        return 400, {"error": str(e)}
 
-        try:
-            storage_result = image_storage.process_image(
-                image_bytes,
-                tags=tag_result.get("tags"),
-                nsfw_meta=nsfw_result,
-                danbooru_tags=ddb_result.get("tags"),
-            )
-        except Exception as e:
-            storage_result = {"error": str(e)}
-        results["modules.image_storage"] = storage_result
-
-        skip = {
-            "modules.nsfw_scanner",
-            "modules.tagging",
-            "modules.deepdanbooru_tags",
-            "modules.image_storage",
-            "modules.statistics",
-        }
-        for name, mod in manager.get_modules().items():
-            if name in skip or not hasattr(mod, "process_image"):
-                continue
-            try:
-                results[name] = mod.process_image(image_bytes)
-            except Exception as e:
-                results[name] = {"error": str(e)}
-                logger.exception("Module %s failed", name)
-
-        return results
-    except Exception as e:
-        logger.exception("process_image failed")
-        return {"error": str(e)}
+
+def check_upload(buf) -> tuple:
+    """Validate and scan one uploaded image; returns ``(status, payload)``."""
+    ctx = ImageContext(buf)
+    with metrics.stage("validate"):
+        valid = _is_valid_image(ctx)
+    if not valid:
+        return 400, {"error": "invalid image"}
+    return 200, process_image(buf, context=ctx)
+
+
+def upload_mime(part: multipart.Part) -> str:
+    """MIME type of a batch upload, guessed from the filename if needed."""
+    mime = part.type if part.type != "application/octet-stream" else ""
+    return mime or mimetypes.guess_type(part.filename or "")[0] or ""
+
+
+def _cached_batch(raw, mime: str) -> tuple:
+    """Cache key and cached result (or ``None``) of an animated upload."""
+    key = _cache_key(raw, f"batch-{mime or 'unknown'}")
+    return key, cache.get(key)
+
+
+async def scan_upload(raw, mime: str, executor=None) -> dict:
+    """Scan an animated upload, served from the result cache if possible.
+
+    Hashing and the sqlite cache tier block, so they run on ``executor``
+    (default: the loop's default executor) instead of the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    key, result = await loop.run_in_executor(executor, _cached_batch, raw, mime)
+    if result is None:
+        result = await scan_batch(raw, mime)
+        await loop.run_in_executor(executor, cache.put, key, result)
+    return result
 
 
 class ScannerHandler(BaseHTTPRequestHandler):
@@ -105,6 +280,7 @@ class ScannerHandler(BaseHTTPRequestHandler):
 
     # ---------- helpers ----------
     def _send_bytes(self, code: int, body: bytes, ctype: str):
+        self._status = code
         try:
             self.send_response(code)
             self.send_header("Content-Type", ctype)
@@ -151,22 +327,33 @@ class ScannerHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         try:
             if self.path.startswith("/token"):
-                parsed = urlparse(self.path)
-                email = parse_qs(parsed.query).get("email", [None])[0]
-                renew = "renew" in parsed.query
-                if not email:
-                    self._send_json(400, {"error": "missing email"})
+                code, payload = token_response(urlparse(self.path).query)
+                if isinstance(payload, dict):
+                    self._send_json(code, payload)
+                else:
+                    # wichtig: Länge setzen + flush
+                    self._send_text(code, payload)
+                return
+
+            parsed = urlparse(self.path)
+            if parsed.path in ("/health", "/ready"):
+                self._send_json(*health_response(parsed.path))
+                return
+
+            if parsed.path == "/metrics":
+                self._send_bytes(200, metrics.render().encode(), metrics.CONTENT_TYPE)
+                return
+
+            if parsed.path == "/stats":
+                if not self._validate_token():
                     return
-                token = token_manager.get_token(email, renew=renew)
-                # wichtig: Länge setzen + flush
-                self._send_text(200, token)
+                self._send_json(200, get_stats(parsed.query))
                 return
 
-            if self.path == "/stats":
+            if parsed.path == "/search":
                 if not self._validate_token():
                     return
-                stats = statistics.get_statistics()
-                self._send_json(200, stats)
+                self._send_json(*search_response(parsed.query))
                 return
 
             self._send_json(404, {"error": "not found"})
@@ -177,16 +364,19 @@ class ScannerHandler(BaseHTTPRequestHandler):
     def do_POST(self):
         try:
             content_type = self.headers.get("Content-Type", "")
-            if "multipart/form-data" not in content_type:
+            if not multipart.is_supported(content_type):
                 self._log_raw_request("Ungültiger Content-Type")
                 self._send_json(403, {"error": "invalid content-type"})
                 return
 
-            if self.path == "/check":
-                self._handle_check()
-                return
-            if self.path == "/batch":
-                asyncio.run(self._handle_batch())
+            if self.path in ("/check", "/batch"):
+                endpoint = self.path[1:]
+                with metrics.request(endpoint) as req:
+                    if endpoint == "check":
+                        self._handle_check()
+                    else:
+                        asyncio.run(self._handle_batch())
+                    req["status"] = self._status
                 return
 
             self._log_raw_request(f"Ungültiger POST-Pfad: {self.path}")
@@ -199,72 +389,75 @@ class ScannerHandler(BaseHTTPRequestHandler):
     def _handle_check(self):
         if not self._validate_token():
             return
-        form = self._parse_multipart()
-        file_item = form["image"] if form and "image" in form else None
-        if file_item is None or getattr(file_item, "file", None) is None:
-            self._log_raw_request("Image fehlt oder multipart defekt")
-            self._send_json(400, {"error": "image missing"})
+        part = self._read_upload(
+            "image", MAX_IMAGE_SIZE, "Image fehlt oder multipart defekt"
+        )
+        if part is None:
             return
 
-        buf = file_item.file.read()
-        if len(buf) > MAX_IMAGE_SIZE:
-            self._send_json(413, {"error": "payload too large"})
-            return
-        if not _is_valid_image(buf):
-            self._send_json(400, {"error": "invalid image"})
-            return
-
-        result = process_image(buf)
-        self._send_json(200, result)
+        self._send_json(*check_upload(part.data))
 
     async def _handle_batch(self):
         if not self._validate_token():
             return
-        if "multipart/form-data" not in self.headers.get("Content-Type", ""):
-            self._send_json(400, {"error": "invalid content-type"})
-            return
-
-        form = self._parse_multipart()
-        item = form["file"] if form and "file" in form else None
-        if item is None or getattr(item, "file", None) is None:
-            self._log_raw_request("Batch-Datei fehlt oder multipart kaputt")
-            self._send_json(400, {"error": "file missing"})
-            return
-
-        raw = item.file.read()
-        if len(raw) > MAX_BATCH_SIZE:
-            self._send_json(413, {"error": "payload too large"})
+        item = self._read_upload(
+            "file", MAX_BATCH_SIZE, "Batch-Datei fehlt oder multipart kaputt"
+        )
+        if item is None:
             return
 
-        mime = item.type or mimetypes.guess_type(item.filename or "")[0] or ""
         try:
-            result = await scan_batch(raw, mime)
+            result = await scan_upload(item.data, upload_mime(item))
             self._send_json(200, result)
         except Exception as e:
             logger.exception("batch failed")
             self._send_json(500, {"error": str(e)})
 
     # ---------- utils ----------
-    def _parse_multipart(self):
+    def _read_upload(self, field: str, limit: int, missing_note: str):
+        """Stream the upload part ``field``; sends the error response on failure."""
         try:
-            return cgi.FieldStorage(
-                fp=self.rfile,
-                headers=self.headers,
-                environ={
-                    "REQUEST_METHOD": "POST",
-                    "CONTENT_TYPE": self.headers.get("Content-Type"),
-                },
-            )
+            with metrics.stage("multipart"):
+                form = multipart.read_body(
+                    self.rfile, self.headers, limit, default_name=field
+                )
+        except multipart.PayloadTooLarge:
+            # Rest des Bodys bleibt ungelesen, Verbindung wird geschlossen
+            self._send_json(413, {"error": "payload too large"})
+            return None
         except Exception:
             logger.exception("multipart parse failed")
             self._log_raw_request("Multipart parse exception")
+            form = {}
+        part = form.get(field)
+        if part is None:
+            self._log_raw_request(missing_note)
+            self._send_json(400, {"error": f"{field} missing"})
             return None
+        metrics.UPLOAD_BYTES.observe(len(part.data), endpoint=self.path.strip("/"))
+        return part
 
     def log_message(self, *a):
         return
 
 
-def run(port: int = 8000):
+def start_models(preload_models: bool, processes: int) -> None:
+    """Start the worker processes or, without them, the optional preload."""
+    if processes > 0:
+        # Modelle laufen in den Workern, der API-Prozess lädt keine
+        worker_pool.start(processes)
+    elif preload_models:
+        preload.start()
+
+
+def run(
+    port: int = 8000,
+    preload_models: bool = preload.ENABLED,
+    processes: int = worker_pool.PROCESSES,
+):
+    start_models(preload_models, processes)
+    retention.start()
+
     class SafeServer(ThreadingHTTPServer):
         def handle_error(self, request, client_address):
             with open("raw_connections.log", "a", encoding="utf-8") as f:
@@ -0,0 +1,28 @@
+"""Test setup: the repository root is importable as in production.
+
+The modules write relative to the working directory (``scanned/``,
+``tokens.json``), so the tests run in a temporary directory. It is
+registered before any module is imported and therefore removed after the
+modules' own exit handlers ran.
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+WORKDIR = Path(tempfile.mkdtemp(prefix="pixai-tests-"))
+os.chdir(WORKDIR)
+atexit.register(shutil.rmtree, WORKDIR, True)
+
+
+def pytest_unconfigure(config):
+    # pytest stellt das Aufrufverzeichnis wieder her; die atexit-Handler der
+    # Module (z. B. Statistik-Snapshot) sollen aber im Temp-Verzeichnis schreiben
+    os.chdir(WORKDIR)
@@ -0,0 +1,111 @@
+import threading
+
+import numpy as np
+import pytest
+
+from modules import batching
+
+
+class Model:
+    """``predict`` stand-in recording the batch sizes it was called with."""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, batch):
+        self.calls.append(len(batch))
+        if self.fail:
+            raise RuntimeError("model failed")
+        return batch * 2
+
+
+@pytest.fixture
+def scheduler():
+    made = []
+
+    def make(model, **kwargs):
+        sched = batching.BatchScheduler("test", model, **kwargs)
+        made.append(sched)
+        return sched
+
+    yield make
+    for sched in made:
+        sched.close()
+
+
+def test_rows_go_back_to_their_callers(scheduler):
+    sched = scheduler(Model(), max_batch_size=8, max_wait_ms=20)
+    results = {}
+
+    def call(i):
+        results[i] = sched.predict(np.full(3, i, dtype=np.float32), timeout=5)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for i in range(16):
+        np.testing.assert_array_equal(results[i], np.full(3, 2 * i))
+
+
+def test_samples_are_batched_up_to_max_size(scheduler):
+    model = Model()
+    sched = scheduler(model, max_batch_size=4, max_wait_ms=200)
+    rows = sched.predict_many([np.array([i]) for i in range(10)])
+    assert [int(r[0]) for r in rows] == [2 * i for i in range(10)]
+    assert model.calls == [4, 4, 2]
+    stats = sched.get_statistics()
+    assert stats["batch_size"]["count"] == 3
+    assert stats["queue_wait_ms"]["count"] == 10
+
+
+def test_single_sample_waits_at_most_max_wait(scheduler):
+    model = Model()
+    sched = scheduler(model, max_batch_size=8, max_wait_ms=0)
+    np.testing.assert_array_equal(sched.predict(np.array([1]), timeout=5), [2])
+    assert model.calls == [1]
+
+
+def test_model_error_reaches_every_caller(scheduler):
+    sched = scheduler(Model(fail=True), max_batch_size=4, max_wait_ms=50)
+    futures = [sched.submit(np.array([i])) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model failed"):
+            future.result(5)
+    # der Worker läuft nach dem Fehler weiter
+    sched.predict_fn = Model()
+    np.testing.assert_array_equal(sched.predict(np.array([3]), timeout=5), [6])
+
+
+def test_close_serves_queued_samples_first():
+    sched = batching.BatchScheduler("test", Model(), max_batch_size=2, max_wait_ms=0)
+    futures = [sched.submit(np.array([i])) for i in range(5)]
+    sched.close()
+    assert [int(f.result(5)[0]) for f in futures] == [0, 2, 4, 6, 8]
+    sched._thread.join(5)
+    assert not sched._thread.is_alive()
+
+
+def test_histogram_buckets_are_upper_bounds():
+    hist = batching.Histogram((1, 2, 4))
+    for value in (1, 2, 3, 4, 5, 100):
+        hist.observe(value)
+    snap = hist.snapshot()
+    assert snap["buckets"] == {"1": 1, "2": 1, "4": 2, "+Inf": 2}
+    assert snap["count"] == 6
+    assert snap["sum"] == 115
+
+
+def test_get_scheduler_replaces_on_new_model():
+    first, second = Model(), Model()
+    try:
+        sched = batching.get_scheduler("test-registry", first, max_wait_ms=0)
+        assert batching.get_scheduler("test-registry", first) is sched
+        replaced = batching.get_scheduler("test-registry", second, max_wait_ms=0)
+        assert replaced is not sched
+        assert "test-registry" in batching.get_statistics()
+    finally:
+        with batching._REGISTRY_LOCK:
+            batching._SCHEDULERS.pop("test-registry").close()
@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import pytest
+
+from modules import deepdanbooru_tags as ddb
+
+TAGS = ["1girl", "solo", "smile", "hatsune_miku", "rem_(re:zero)", "rating:safe", "rating:explicit"]
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    """Tag index of a fake model: 3 general, 2 character, 2 rating tags."""
+    (tmp_path / "categories.json").write_text(json.dumps([
+        {"name": "General", "start_index": 0},
+        {"name": "Character", "start_index": 3},
+        {"name": "System", "start_index": 5},
+    ]))
+    monkeypatch.setattr(ddb, "PROJECT_PATH", tmp_path)
+    for name in ("_TAG_NAMES", "_CATEGORY_INDEX", "_TAG_THRESHOLDS"):
+        monkeypatch.setattr(ddb, name, getattr(ddb, name, None))
+    monkeypatch.setattr(ddb, "THRESHOLDS", {"general": 0.5, "character": 0.3, "rating": 0.1})
+    monkeypatch.setattr(ddb, "LIMITS", dict.fromkeys(ddb.CATEGORIES))
+    ddb._build_index(TAGS)
+
+
+SCORES = np.array([0.9, 0.6, 0.4, 0.35, 0.8, 0.7, 0.2], dtype=np.float32)
+
+
+def labels(tags):
+    return [t["label"] for t in tags]
+
+
+def test_limits_default_to_unlimited(monkeypatch):
+    monkeypatch.delenv("PIXAI_DDB_GENERAL_LIMIT", raising=False)
+    monkeypatch.setenv("PIXAI_DDB_CHARACTER_LIMIT", "5")
+    assert ddb._limit("general") is None
+    assert ddb._limit("character") == 5
+
+
+def test_postprocess_applies_threshold_per_category(index):
+    out = ddb.postprocess(SCORES)
+    assert labels(out["general"]) == ["1girl", "solo"]  # smile < 0.5
+    assert labels(out["character"]) == ["rem_(re:zero)", "hatsune_miku"]
+    assert labels(out["rating"]) == ["rating:safe", "rating:explicit"]
+    assert labels(out["tags"]) == [
+        "1girl", "rem_(re:zero)", "rating:safe", "solo", "hatsune_miku", "rating:explicit",
+    ]
+    assert ddb._TAG_THRESHOLDS.tolist() == pytest.approx([0.5] * 3 + [0.3] * 2 + [0.1] * 2)
+
+
+def test_postprocess_caps_each_category_at_its_limit(index, monkeypatch):
+    monkeypatch.setattr(ddb, "LIMITS", {"general": 1, "character": None, "rating": 0})
+    out = ddb.postprocess(SCORES)
+    assert labels(out["general"]) == ["1girl"]
+    assert labels(out["character"]) == ["rem_(re:zero)", "hatsune_miku"]
+    assert out["rating"] == []
+    assert labels(out["tags"]) == ["1girl", "rem_(re:zero)", "hatsune_miku"]
+
+
+def test_postprocess_keeps_the_best_scores_within_a_limit(index, monkeypatch):
+    monkeypatch.setattr(ddb, "LIMITS", {"general": 2, "character": 1, "rating": 1})
+    scores = np.array([0.6, 0.95, 0.7, 0.9, 0.85, 0.3, 0.99], dtype=np.float32)
+    out = ddb.postprocess(scores[None, :])  # auch als (1, N)-Batchzeile
+    assert labels(out["general"]) == ["solo", "smile"]
+    assert labels(out["character"]) == ["hatsune_miku"]
+    assert labels(out["rating"]) == ["rating:explicit"]
+    assert [t["score"] for t in out["tags"]] == sorted((t["score"] for t in out["tags"]), reverse=True)
@@ -0,0 +1,159 @@
+import asyncio
+
+import numpy as np
+
+import gif_batch
+
+
+def frame(seed: int, size: int = 128) -> np.ndarray:
+    """Smooth random frame; different seeds give clearly different dHashes."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+    return np.kron(coarse, np.ones((size // 8, size // 8, 1), dtype=np.uint8))
+
+
+def noisy(base: np.ndarray, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return np.clip(base.astype(np.int16) + rng.integers(-3, 4, base.shape), 0, 255).astype(np.uint8)
+
+
+def test_frame_hashes_are_stable_and_distinct():
+    frames = [frame(1), noisy(frame(1), 7), frame(2)]
+    hashes = gif_batch._frame_hashes(frames)
+    assert hashes.shape == (3,)
+    assert gif_batch._hamming(hashes[0], hashes[1]) <= gif_batch.DEDUP_DISTANCE
+    assert gif_batch._hamming(hashes[0], hashes[2]) > gif_batch.DEDUP_DISTANCE
+
+
+def test_dedup_collapses_identical_and_keeps_distinct_frames():
+    a, b = frame(1), frame(2)
+    frames = [a, a.copy(), noisy(a, 3), b, b.copy(), a.copy()]
+    reps, group = gif_batch._dedup(gif_batch._frame_hashes(frames))
+    assert reps == [0, 3]
+    assert group.tolist() == [0, 0, 0, 1, 1, 0]
+
+
+def test_dedup_keeps_every_distinct_frame():
+    frames = [frame(seed) for seed in range(6)]
+    reps, group = gif_batch._dedup(gif_batch._frame_hashes(frames))
+    assert reps == list(range(6))
+    assert group.tolist() == list(range(6))
+
+
+def hashes(*runs) -> np.ndarray:
+    """dHash sequence of ``(count, value)`` runs of identical frames."""
+    return np.concatenate([np.full(count, value, dtype=">u8") for count, value in runs])
+
+
+def test_adaptive_sample_short_animation_keeps_all_candidates():
+    assert gif_batch._adaptive_sample(hashes((1, 0)), refine=2) == [0]
+    assert gif_batch._adaptive_sample(hashes((2, 0)), refine=2) == [0, 1]
+    assert gif_batch._adaptive_sample(hashes((3, 0)), refine=2) == [0, 2]
+
+
+def test_adaptive_sample_long_static_animation_stays_regular():
+    picked = gif_batch._adaptive_sample(hashes((30, 0)), refine=2)
+    assert picked == list(range(0, 30, 2)) + [29]
+    assert len(gif_batch._adaptive_sample(hashes((30, 0)), refine=3)) == 11
+
+
+def test_adaptive_sample_is_dense_around_scene_changes():
+    seq = hashes((13, 0), (17, 2**64 - 1))  # Szenenwechsel zwischen 12 und 13
+    picked = gif_batch._adaptive_sample(seq, refine=4)
+    regular = [0, 4, 8, 12, 16, 20, 24, 28, 29]
+    assert picked == sorted(regular + [13, 14, 15])
+
+
+def test_risk_order_scans_ends_then_biggest_changes():
+    seq = hashes((1, 0), (1, 0b1), (1, 0b111111), (1, 0b111), (1, 0))
+    # Abstand zum vorigen Frame: 1, 5, 3 Bit
+    assert gif_batch._risk_order(seq, [0, 1, 2, 3, 4]) == [0, 4, 2, 3, 1]
+    assert gif_batch._risk_order(seq, [0, 3]) == [0, 1]
+    assert gif_batch._risk_order(seq, [2]) == [0]
+
+
+class FakeModels:
+    """Stand-ins for the three batch predictors, recording every chunk."""
+
+    def __init__(self, monkeypatch, nsfw_per_chunk):
+        self.chunks = []
+        self.nsfw = list(nsfw_per_chunk)
+        tags = ["rating:safe", "rating:questionable", "rating:explicit"]
+        monkeypatch.setattr(gif_batch, "_nsfw_scores", self.nsfw_scores)
+        monkeypatch.setattr(gif_batch.tagging, "predict_batch", self.tagging)
+        monkeypatch.setattr(gif_batch.tagging, "decode", lambda preds: [[{"label": "cat"}] for _ in preds])
+        monkeypatch.setattr(
+            gif_batch.deepdanbooru_tags, "predict_batch",
+            lambda chunk: (np.zeros((len(chunk), len(tags)), dtype=np.float32), tags),
+        )
+        monkeypatch.setattr(gif_batch.deepdanbooru_tags, "tag_thresholds", lambda: np.full(len(tags), 0.5))
+
+    def nsfw_scores(self, chunk):
+        self.chunks.append(len(chunk))
+        score = self.nsfw.pop(0) if self.nsfw else 0.0
+        scores = np.zeros((len(chunk), len(gif_batch.nsfw_scanner.CATEGORIES)), dtype=np.float32)
+        scores[:, gif_batch.nsfw_scanner.CATEGORIES.index("porn")] = score
+        return scores
+
+    def tagging(self, chunk):
+        return np.zeros((len(chunk), 1000), dtype=np.float32)
+
+
+def scan(frames):
+    async def run():
+        return await gif_batch._scan_frames(asyncio.get_running_loop(), frames, len(frames))
+
+    return asyncio.run(run())
+
+
+def test_decisive_nsfw_stops_after_its_chunk(monkeypatch):
+    monkeypatch.setattr(gif_batch, "MAX_FRAME_BATCH", 2)
+    monkeypatch.setattr(gif_batch, "NSFW_DECISIVE", 0.9)
+    models = FakeModels(monkeypatch, [0.1, 0.95, 0.1])
+    out = scan([frame(seed) for seed in range(6)])
+
+    assert models.chunks == [2, 2]
+    assert out["framesEvaluated"] == 4
+    assert out["risk"] == 0.95
+    assert out["tags"] == ["cat"]
+
+
+def test_early_exit_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(gif_batch, "MAX_FRAME_BATCH", 2)
+    models = FakeModels(monkeypatch, [0.1, 0.95, 0.1])
+    out = scan([frame(seed) for seed in range(6)])
+
+    assert gif_batch.NSFW_DECISIVE > 1.0
+    assert models.chunks == [2, 2, 2]
+    assert out["framesEvaluated"] == 6
+
+
+def test_chunks_cover_every_frame_once_and_aggregate(monkeypatch):
+    monkeypatch.setattr(gif_batch, "MAX_FRAME_BATCH", 4)
+    models = FakeModels(monkeypatch, [0.2, 0.4, 0.1])
+    seen = []
+
+    def tagging(chunk):
+        seen.append([id(c) for c in chunk])
+        return np.full((len(chunk), 1000), len(seen), dtype=np.float32)
+
+    def danbooru(chunk):
+        tags = ["rating:safe", "rating:questionable", "rating:explicit"]
+        scores = np.zeros((len(chunk), len(tags)), dtype=np.float32)
+        if len(seen) == 3:
+            scores[0, 1] = 1.0  # questionable im letzten Chunk -> Risiko 0.7
+        return scores, tags
+
+    monkeypatch.setattr(gif_batch.tagging, "predict_batch", tagging)
+    monkeypatch.setattr(
+        gif_batch.tagging, "decode", lambda preds: [[{"label": f"chunk{int(p[0])}"}] for p in preds]
+    )
+    monkeypatch.setattr(gif_batch.deepdanbooru_tags, "predict_batch", danbooru)
+    out = scan([frame(seed) for seed in range(10)])
+
+    assert models.chunks == [4, 4, 2]
+    assert [len(chunk) for chunk in seen] == [4, 4, 2]
+    assert len({i for chunk in seen for i in chunk}) == 10
+    assert out["framesEvaluated"] == out["uniqueFrames"] == 10
+    assert out["tags"] == ["chunk1", "chunk2", "chunk3", "rating:questionable"]
+    assert out["risk"] == 0.7
@@ -0,0 +1,24 @@
+import numpy as np
+
+from modules.image_context import ImageContext, call_process_image
+
+
+def test_array_context_is_not_encoded():
+    ctx = ImageContext.from_array(np.zeros((8, 8, 3), dtype=np.uint8))
+    seen = {}
+
+    def module(data, *, context=None):
+        seen["data"] = data
+        return {}
+
+    call_process_image(module, ctx)
+    assert seen["data"] is ctx
+    assert ctx._data is None
+
+
+def test_upload_bytes_are_passed_through():
+    ctx = ImageContext(b"raw upload")
+    seen = []
+    call_process_image(lambda data, *, context=None: seen.append(data), ctx)
+    call_process_image(lambda data: seen.append(data), ctx)
+    assert seen == [b"raw upload", b"raw upload"]
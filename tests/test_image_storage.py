@@ -0,0 +1,35 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from modules import image_storage
+from modules.image_context import ImageContext
+
+
+def upload(seed: int) -> bytes:
+    rng = np.random.default_rng(seed)
+    buf = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def test_queue_holds_thumbnail_not_context(monkeypatch):
+    jobs = []
+    monkeypatch.setattr(image_storage, "_enqueue", lambda job: jobs.append(job) or True)
+    data = upload(1)
+    out = image_storage.process_image(data, context=ImageContext(data), tags=[])
+
+    assert out["status"] == "queued"
+    ticket, digest, path, thumbnail, meta = jobs[0]
+    assert not any(isinstance(item, ImageContext) for item in jobs[0])
+    assert thumbnail.size == (1280, 720)
+
+    record = image_storage._store(*jobs[0])
+    assert record["duplicate"] is False
+    assert (record["width"], record["height"]) == (1280, 720)
+
+    # Duplikat: nur Referenz, kein neues Vorschaubild
+    image_storage.process_image(data, tags=[])
+    assert jobs[1][3] is None
+    assert image_storage._store(*jobs[1])["duplicate"] is True
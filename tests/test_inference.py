@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from modules import inference
+
+
+def test_stub_output_does_not_depend_on_the_batch():
+    model = inference.StubModel("tests", outputs=7, delay_ms=0)
+    rng = np.random.default_rng(0)
+    batch = rng.random((5, 16, 16, 3), dtype=np.float32)
+
+    together = model(batch)
+    assert together.shape == (5, 7)
+    for i in range(len(batch)):
+        np.testing.assert_allclose(model(batch[i : i + 1])[0], together[i], rtol=1e-6)
+    # gleiche Eingabe, gleicher Stub -> gleiche Ausgabe
+    np.testing.assert_array_equal(inference.StubModel("tests", 7, 0)(batch), together)
+
+
+def test_converted_model_is_abstract():
+    with pytest.raises(TypeError):
+        inference.ConvertedModel("model.tflite")
+
+
+@pytest.mark.skipif(inference.tf is None, reason="TensorFlow not installed")
+def test_tflite_conversion_matches_keras_on_a_batch(tmp_path):
+    from convert_models import to_tflite
+
+    tf = inference.tf
+    tf.keras.utils.set_random_seed(0)
+    model = tf.keras.Sequential([
+        tf.keras.Input((16, 16, 3)),
+        tf.keras.layers.Conv2D(4, 3, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(5, activation="sigmoid"),
+    ])
+    to_tflite(model, tmp_path / "tests.float32.tflite")
+    converted = inference.open_converted(tmp_path / "tests.float32.tflite", "tflite")
+
+    batch = np.random.default_rng(0).random((4, 16, 16, 3), dtype=np.float32)
+    expected = model(batch, training=False).numpy()
+    np.testing.assert_allclose(converted(batch), expected, atol=1e-5)
+    # Batchgröße wechseln: der Interpreter wird neu dimensioniert
+    np.testing.assert_allclose(converted.predict(batch[:1]), expected[:1], atol=1e-5)
+    np.testing.assert_allclose(converted(batch), expected, atol=1e-5)
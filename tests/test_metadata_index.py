@@ -0,0 +1,98 @@
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import pytest
+
+import scanner_api
+from modules import metadata_index
+from modules.metadata_index import MetadataIndex, parse_query
+
+
+def day(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+def record(name, tags, stored, porn=0.0, danbooru=()):
+    return {
+        "path": f"scanned/2026_09/{name}.jpg",
+        "ticket": name,
+        "stored": stored,
+        "porn": porn,
+        "sexy": 0.0,
+        "tags": [{"label": t, "score": 0.9} for t in tags],
+        "danbooru_tags": [{"label": t, "score": 0.8} for t in danbooru],
+    }
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = MetadataIndex(tmp_path / "metadata.sqlite")
+    index.add([
+        record("a", ["cat"], day("2026-09-01"), porn=0.1, danbooru=["1girl"]),
+        record("b", ["cat", "dog"], day("2026-09-10"), porn=0.9),
+        record("c", ["dog"], day("2026-09-20"), porn=0.85, danbooru=["1girl"]),
+        record("d", ["cat"], day("2026-10-02"), porn=0.5),
+    ])
+    monkeypatch.setattr(metadata_index, "_index", index)
+    yield index
+    index.close()
+
+
+def search(query: str):
+    return metadata_index.search(**parse_query(parse_qs(query)))
+
+
+def tickets(result):
+    return [item["ticket"] for item in result["items"]]
+
+
+def test_tags_are_combined_with_and(index):
+    assert tickets(search("tag=cat")) == ["d", "b", "a"]
+    assert tickets(search("tag=cat&tag=dog")) == ["b"]
+    assert tickets(search("tag=cat,1girl")) == ["a"]  # MobileNetV2 und DeepDanbooru
+    assert tickets(search("tag=cat&tag=cat")) == ["d", "b", "a"]
+
+
+def test_minus_prefix_excludes_tags(index):
+    assert tickets(search("tag=cat&tag=-dog")) == ["d", "a"]
+    assert tickets(search("tag=-1girl,-dog")) == ["d"]
+    assert tickets(search("tag=-")) == ["d", "c", "b", "a"]
+
+
+def test_date_and_score_ranges(index):
+    assert tickets(search("since=2026-09-05&until=2026-09-20")) == ["b"]
+    assert tickets(search(f"since={day('2026-09-20')}")) == ["d", "c"]
+    assert tickets(search("porn_min=0.8&since=2026-09-01&until=2026-10-01")) == ["c", "b"]
+    assert tickets(search("nsfw_max=0.5")) == ["d", "a"]
+
+
+def test_pagination(index):
+    first = search("limit=3")
+    assert tickets(first) == ["d", "c", "b"]
+    assert (first["total"], first["next_offset"]) == (4, 3)
+    last = search("limit=3&offset=3")
+    assert tickets(last) == ["a"] and last["next_offset"] is None
+
+
+@pytest.mark.parametrize("query", [
+    "porn_min=high",
+    "porn_max=nan",
+    "since=2026-13-01",
+    "until=yesterday",
+    "since=1e999",
+    "limit=ten",
+    "limit=-1",
+    "offset=1.5",
+    "offset=99999999999999999999999",
+])
+def test_malformed_queries_are_rejected_cleanly(index, query):
+    status, payload = scanner_api.search_response(query)
+    assert status == 400
+    assert payload == {"error": payload["error"]}
+    assert query.split("=")[0] in payload["error"]
+
+
+def test_search_endpoint_returns_results(index):
+    status, payload = scanner_api.search_response("tag=dog&tag=-1girl")
+    assert status == 200
+    assert tickets(payload) == ["b"]
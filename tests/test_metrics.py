@@ -0,0 +1,69 @@
+import pytest
+
+import metrics
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        metrics.Metric("pixai_test", "help")
+
+
+def test_counter_and_gauge_exposition():
+    registry = metrics.Registry()
+    hits = registry.register(metrics.Counter("pixai_hits_total", "Cache hits", ("tier",)))
+    hits.inc(tier="memory")
+    hits.inc(2, tier="disk")
+    registry.register(metrics.Gauge("pixai_depth", "Queue depth", callback=lambda: 3))
+    registry.register(metrics.Gauge("pixai_ready", "Ready", ("module",), callback=lambda: {"nsfw": 1}))
+
+    assert registry.render() == (
+        "# HELP pixai_hits_total Cache hits\n"
+        "# TYPE pixai_hits_total counter\n"
+        'pixai_hits_total{tier="disk"} 2\n'
+        'pixai_hits_total{tier="memory"} 1\n'
+        "# HELP pixai_depth Queue depth\n"
+        "# TYPE pixai_depth gauge\n"
+        "pixai_depth 3\n"
+        "# HELP pixai_ready Ready\n"
+        "# TYPE pixai_ready gauge\n"
+        'pixai_ready{module="nsfw"} 1\n'
+    )
+    # gleicher Name liefert die vorhandene Metrik
+    assert registry.register(metrics.Counter("pixai_hits_total", "other")) is hits
+
+
+def test_histogram_buckets_are_cumulative():
+    latency = metrics.Histogram("pixai_latency_seconds", "Latency", ("endpoint",), buckets=(0.1, 0.5))
+    for value in (0.05, 0.1, 0.3, 2.0):
+        latency.observe(value, endpoint="check")
+
+    assert latency.render()[2:] == [
+        'pixai_latency_seconds_bucket{endpoint="check",le="0.1"} 2',
+        'pixai_latency_seconds_bucket{endpoint="check",le="0.5"} 3',
+        'pixai_latency_seconds_bucket{endpoint="check",le="+Inf"} 4',
+        'pixai_latency_seconds_sum{endpoint="check"} 2.45',
+        'pixai_latency_seconds_count{endpoint="check"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    errors = metrics.Counter("pixai_errors_total", "Errors", ("message",))
+    errors.inc(message='bad "file"\\path\nline 2')
+    assert errors.render()[-1] == r'pixai_errors_total{message="bad \"file\"\\path\nline 2"} 1'
+
+
+def test_wrong_labels_and_failing_collectors():
+    registry = metrics.Registry()
+    hits = registry.register(metrics.Counter("pixai_hits_total", "Cache hits", ("tier",)))
+    with pytest.raises(ValueError):
+        hits.inc()
+
+    def broken():
+        raise RuntimeError("no\nbackend")
+
+    registry.register_collector("broken", broken)
+    registry.register_collector("batch", lambda: ["pixai_batch_size 4"])
+    assert registry.render().splitlines()[-2:] == [
+        "# collector broken failed: no\\nbackend",
+        "pixai_batch_size 4",
+    ]
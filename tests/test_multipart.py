@@ -0,0 +1,163 @@
+import asyncio
+import io
+
+import pytest
+
+import multipart
+
+BOUNDARY = "pixai-test-boundary"
+
+
+def encode(fields, boundary=BOUNDARY):
+    """``multipart/form-data`` body of ``(name, filename, type, data)`` tuples."""
+    body = b""
+    for name, filename, ctype, data in fields:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += (
+            f"--{boundary}\r\nContent-Disposition: {disposition}\r\n"
+            f"Content-Type: {ctype}\r\n\r\n"
+        ).encode() + data + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+
+def headers_for(body, ctype=f"multipart/form-data; boundary={BOUNDARY}"):
+    return {"Content-Type": ctype, "Content-Length": str(len(body))}
+
+
+class TrickleFile:
+    """Binary file returning at most ``step`` bytes per ``readinto``."""
+
+    def __init__(self, data, step):
+        self._data = io.BytesIO(data)
+        self.step = step
+        self.reads = 0
+
+    def readinto(self, buf):
+        self.reads += 1
+        chunk = self._data.read(min(len(buf), self.step))
+        buf[:len(chunk)] = chunk
+        return len(chunk)
+
+
+# Enthält Fragmente des Delimiters, die nicht als Grenze gelten dürfen
+PAYLOAD = b"\x89PNG\r\n\x1a\n" + b"\r\n--pixai-test" + bytes(range(256)) * 40
+
+
+@pytest.mark.parametrize("step", [1, 7, 4096, multipart.CHUNK_SIZE])
+def test_round_trip(step):
+    body = encode(
+        [
+            ("image", "a.png", "image/png", PAYLOAD),
+            ("note", None, "text/plain", b"hello"),
+        ]
+    )
+    parts = multipart.read_body(TrickleFile(body, step), headers_for(body), len(PAYLOAD))
+    image = parts["image"]
+    assert bytes(image.data) == PAYLOAD
+    assert image.filename == "a.png"
+    assert image.type == "image/png"
+    assert bytes(parts["note"].data) == b"hello"
+    assert parts["note"].filename is None
+
+
+def test_first_part_of_a_name_wins():
+    body = encode([("image", "a", "image/png", b"first"), ("image", "b", "image/png", b"second")])
+    parts = multipart.read_body(io.BytesIO(body), headers_for(body), 100)
+    assert bytes(parts["image"].data) == b"first"
+
+
+def test_oversized_request_is_rejected_from_headers():
+    rfile = TrickleFile(b"", 1)
+    headers = headers_for(b"x" * (100 + multipart.HEADER_SLACK + 1))
+    with pytest.raises(multipart.PayloadTooLarge):
+        multipart.read_body(rfile, headers, 100)
+    assert rfile.reads == 0
+
+
+def test_oversized_part_aborts_while_streaming():
+    body = encode([("image", "a", "image/png", b"x" * 5000)])
+    rfile = TrickleFile(body, 512)
+    with pytest.raises(multipart.PayloadTooLarge):
+        multipart.read_body(rfile, headers_for(body), 1000)
+    assert rfile.reads < len(body) // 512
+
+
+def test_quoted_boundary():
+    boundary = "abc;def=1 x"
+    body = encode([("file", "a.gif", "image/gif", b"GIF89a...")], boundary)
+    headers = headers_for(body, f'multipart/form-data; charset=utf-8; boundary="{boundary}"')
+    parts = multipart.read_body(io.BytesIO(body), headers, 100)
+    assert bytes(parts["file"].data) == b"GIF89a..."
+
+
+def test_quoted_filename_with_semicolon():
+    ctype, opts = multipart.parse_options('form-data; name="image"; filename="a;\\"b\\".png"')
+    assert ctype == "form-data"
+    assert opts == {"name": "image", "filename": 'a;"b".png'}
+
+
+def test_raw_body():
+    parts = multipart.read_body(
+        io.BytesIO(PAYLOAD), headers_for(PAYLOAD, "image/png"), len(PAYLOAD), default_name="image"
+    )
+    assert list(parts) == ["image"]
+    assert bytes(parts["image"].data) == PAYLOAD
+    assert parts["image"].type == "image/png"
+
+
+def test_raw_body_limit_has_no_slack():
+    with pytest.raises(multipart.PayloadTooLarge):
+        multipart.read_body(io.BytesIO(PAYLOAD), headers_for(PAYLOAD, "image/png"), len(PAYLOAD) - 1)
+
+
+@pytest.mark.parametrize(
+    "ctype, expected",
+    [
+        ("multipart/form-data; boundary=x", True),
+        ("image/jpeg", True),
+        ("application/octet-stream", True),
+        ("application/json", False),
+        ("", False),
+    ],
+)
+def test_is_supported(ctype, expected):
+    assert multipart.is_supported(ctype) is expected
+
+
+def test_missing_boundary():
+    with pytest.raises(multipart.MultipartError):
+        multipart.read_body(io.BytesIO(b""), headers_for(b"", "multipart/form-data"), 100)
+
+
+def test_missing_content_length():
+    with pytest.raises(multipart.MultipartError):
+        multipart.read_body(io.BytesIO(b""), {"Content-Type": "image/png"}, 100)
+
+
+def test_missing_closing_boundary():
+    body = encode([("image", "a", "image/png", b"data")])[: -len(f"--{BOUNDARY}--\r\n")]
+    with pytest.raises(multipart.MultipartError):
+        multipart.read_body(io.BytesIO(body), headers_for(body), 100)
+
+
+def test_truncated_body():
+    body = encode([("image", "a", "image/png", b"data")])
+    headers = headers_for(body + b"padding")
+    with pytest.raises(multipart.MultipartError):
+        multipart.read_body(io.BytesIO(body), headers, 100)
+
+
+def test_async_round_trip():
+    body = encode([("file", "a.gif", "image/gif", PAYLOAD)])
+
+    async def read():
+        reader = asyncio.StreamReader()
+        for i in range(0, len(body), 1000):
+            reader.feed_data(body[i:i + 1000])
+        reader.feed_eof()
+        return await multipart.read_body_async(reader, headers_for(body), len(PAYLOAD))
+
+    parts = asyncio.run(read())
+    assert bytes(parts["file"].data) == PAYLOAD
@@ -0,0 +1,95 @@
+import io
+import threading
+import types
+
+import pytest
+from PIL import Image
+
+import pipeline
+from modules import image_storage
+from modules.image_context import ImageContext
+
+
+def module(name, process_image, **attrs):
+    mod = types.ModuleType(name)
+    mod.process_image = process_image
+    for key, value in attrs.items():
+        setattr(mod, key.upper(), value)
+    return mod
+
+
+def jpeg() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (32, 24), (200, 40, 40)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def release():
+    event = threading.Event()
+    yield event
+    event.set()  # hängende Stufe nach dem Test beenden
+
+
+def test_timeout_does_not_stall_consumers(release):
+    seen = {}
+
+    def slow_tagger(data, *, context=None):
+        release.wait(5)
+        return {"tags": [{"label": "late", "score": 1.0}]}
+
+    def consumer(data, *, context=None, tags=None, nsfw=None):
+        seen.update(tags=tags, nsfw=nsfw)
+        return {"ok": True}
+
+    graph = pipeline.Pipeline({
+        "tagger": module("tagger", slow_tagger, produces={"tags": "tags"}, stage_timeout=0.2),
+        "nsfw": module("nsfw", lambda data, *, context=None: {"sfw": 0.9}, produces={"nsfw": None}),
+        "consumer": module("consumer", consumer, consumes={"tags": "tags", "nsfw": "nsfw"}),
+    })
+    run = graph.run(ImageContext(b"x"))
+
+    assert run.timed_out == ["tagger"]
+    assert not run.complete
+    assert run.results["tagger"] == {"error": "timeout after 0.2s"}
+    assert run.results["consumer"] == {"ok": True}
+    assert seen == {"tags": None, "nsfw": {"sfw": 0.9}}
+    assert list(run.results) == ["tagger", "nsfw", "consumer"]
+
+
+def test_known_results_skip_all_but_per_request_stages():
+    calls = []
+
+    def tagger(data, *, context=None):
+        calls.append("tagger")
+        return {"tags": ["fresh"]}
+
+    def storage(data, *, context=None, tags=None):
+        calls.append("storage")
+        return {"tags": tags}
+
+    graph = pipeline.Pipeline({
+        "tagger": module("tagger", tagger, produces={"tags": "tags"}),
+        "storage": module("storage", storage, consumes={"tags": "tags"}, per_request=True),
+    })
+    run = graph.run(ImageContext(b"x"), known={"tagger": {"tags": ["cached"]}})
+
+    assert calls == ["storage"]
+    assert run.results["storage"] == {"tags": ["cached"]}
+    assert graph.cacheable(run.results) == {"tagger": {"tags": ["cached"]}}
+
+
+def test_storage_marks_missing_products(monkeypatch):
+    monkeypatch.setattr(image_storage, "ASYNC", False)
+    monkeypatch.setattr(image_storage, "_append_index", lambda records: None)
+    out = image_storage.process_image(
+        jpeg(),
+        tags=[{"label": "cat", "score": 0.9}],
+        nsfw_meta={"error": "timeout after 60s"},
+    )
+
+    meta = out["metadata"]
+    assert out["status"] == "stored"
+    assert meta["tags"] == [{"label": "cat", "score": 0.9}]
+    assert meta["missing"] == ["danbooru_tags", "nsfw"]
+    assert "error" not in meta
@@ -0,0 +1,73 @@
+import sys
+import threading
+import types
+
+import pytest
+
+from modules import preload
+from modules.model_state import LoadState
+
+NAMES = ("tests_fake_model_a", "tests_fake_model_b")
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """Two fake model modules whose warm-up waits for ``release``."""
+    release = threading.Event()
+    fakes = {}
+    for name in NAMES:
+        mod = types.ModuleType(name)
+        mod.state = LoadState()
+
+        def warmup(state=mod.state):
+            release.wait(5)
+            with state.loading():
+                pass
+
+        mod.warmup = warmup
+        mod.load_state = lambda state=mod.state: state.as_dict()
+        monkeypatch.setitem(sys.modules, name, mod)
+        fakes[name] = mod
+    monkeypatch.setattr(preload, "_thread", None)
+    monkeypatch.setattr(preload, "_started", None)
+    monkeypatch.setattr(preload, "_finished", None)
+    yield fakes, release
+    release.set()
+
+
+def test_ready_without_preload(models):
+    health = preload.get_health(NAMES)
+    assert health["preload"] == "off"
+    assert health["ready"] is True
+    assert {m["state"] for m in health["models"].values()} == {"unloaded"}
+
+
+def test_not_ready_until_preload_finished(models):
+    fakes, release = models
+    thread = preload.start(NAMES)
+    health = preload.get_health(NAMES)
+    assert health["preload"] == "running"
+    assert health["ready"] is False
+
+    release.set()
+    thread.join(5)
+    health = preload.get_health(NAMES)
+    assert health["preload"] == "done"
+    assert health["ready"] is True
+    assert {m["state"] for m in health["models"].values()} == {"ready"}
+
+
+def test_failed_model_does_not_block_readiness(models):
+    fakes, release = models
+
+    def broken():
+        with fakes[NAMES[0]].state.loading():
+            raise RuntimeError("no weights")
+
+    fakes[NAMES[0]].warmup = broken
+    release.set()
+    health = preload.preload(NAMES)
+    assert health["ready"] is True
+    assert health["models"][NAMES[0]]["state"] == "error"
+    assert health["models"][NAMES[0]]["error"] == "no weights"
+
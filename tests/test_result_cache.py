@@ -0,0 +1,105 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import result_cache
+from modules.image_context import ImageContext
+from result_cache import ResultCache, is_cacheable
+
+
+def key(n: int, kind: str = "check") -> str:
+    return ResultCache.make_key(f"{n:064x}", "sig", kind)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(tmp_path / "cache.sqlite", max_entries=2, use_phash=True)
+
+
+def test_is_cacheable():
+    assert is_cacheable({"a": {"tags": []}, "b": 1})
+    assert not is_cacheable({"error": "boom"})
+    assert not is_cacheable({"a": {"error": "timeout after 60s"}})
+    assert not is_cacheable(None)
+
+
+def test_errors_are_not_cached(cache):
+    cache.put(key(1), {"a": {"error": "boom"}})
+    assert cache.get(key(1)) is None
+
+
+def test_memory_lru_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path / "cache.sqlite", max_entries=2, max_disk_entries=0)
+    for n in range(3):
+        cache.put(key(n), {"n": n})
+    assert cache.get(key(0)) is None
+    assert cache.get(key(1)) == {"n": 1}  # 1 ist jetzt am neuesten
+    cache.put(key(3), {"n": 3})
+    assert cache.get(key(2)) is None
+    assert cache.get(key(1)) == {"n": 1}
+    stats = cache.get_statistics()
+    assert stats["evictions"] == 2 and stats["entries"] == 2
+
+
+def test_disk_tier_serves_evicted_and_restarted_entries(cache, tmp_path):
+    for n in range(3):
+        cache.put(key(n), {"n": n})
+    assert cache.get(key(0)) == {"n": 0}
+    assert cache.get_statistics()["disk_hits"] == 1
+
+    fresh = ResultCache(tmp_path / "cache.sqlite", max_entries=2)
+    assert fresh.get(key(2)) == {"n": 2}
+    assert fresh.get(key(2)) == {"n": 2}
+    assert fresh.get_statistics()["disk_hits"] == 1  # zweiter Treffer aus dem Speicher
+
+
+def test_disk_access_times_are_written_in_batches(cache, monkeypatch):
+    monkeypatch.setattr(result_cache, "TOUCH_BATCH", 2)
+    clock = itertools.count(1000.0)
+    monkeypatch.setattr(result_cache.time, "time", lambda: next(clock))
+    for n in range(4):
+        cache.put(key(n), {"n": n})
+    accessed = lambda n: cache._db.execute(
+        "SELECT accessed FROM results WHERE key = ?", (key(n),)
+    ).fetchone()[0]
+    before = accessed(0)
+    cache.get(key(0))
+    assert accessed(0) == before and key(0) in cache._touched
+    cache.get(key(1))
+    assert accessed(0) > before and not cache._touched
+
+
+def test_phash_alias_matches_same_kind_and_signature(cache):
+    cache.put(key(1), {"n": 1}, phash="00ff00ff00ff00ff")
+    assert cache.get(key(2), phash="00ff00ff00ff00ff") == {"n": 1}
+    assert cache.get(key(2, "batch"), phash="00ff00ff00ff00ff") is None
+    assert cache.get_statistics()["phash_hits"] == 1
+
+
+def test_phash_alias_from_disk(cache, tmp_path):
+    cache.put(key(1), {"n": 1}, phash="00ff00ff00ff00ff")
+    fresh = ResultCache(tmp_path / "cache.sqlite", max_entries=2, use_phash=True)
+    assert fresh.get(key(9), phash="00ff00ff00ff00ff") == {"n": 1}
+    assert fresh.get_statistics()["phash_hits"] == 1
+
+
+def test_callers_cannot_corrupt_the_cache(cache):
+    result = {"tagging": {"tags": [{"label": "cat"}]}}
+    cache.put(key(1), result)
+    result["tagging"]["tags"].append({"label": "put"})
+    got = cache.get(key(1))
+    got["tagging"]["tags"].append({"label": "get"})
+    assert cache.get(key(1)) == {"tagging": {"tags": [{"label": "cat"}]}}
+
+
+def test_perceptual_hash_skips_flat_images_and_tolerates_noise():
+    flat = ImageContext.from_array(np.full((32, 32, 3), 128, dtype=np.uint8))
+    assert result_cache.perceptual_hash(flat) is None
+    rng = np.random.default_rng(0)
+    picture = np.kron(rng.integers(0, 256, (8, 9, 3), dtype=np.uint8), np.ones((8, 8, 1), dtype=np.uint8))
+    reencoded = picture.copy()
+    reencoded[::7, ::5] ^= 1
+    phash = result_cache.perceptual_hash(ImageContext.from_array(picture))
+    assert phash is not None
+    assert result_cache.perceptual_hash(ImageContext.from_array(reencoded)) == phash
@@ -0,0 +1,95 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from modules import image_storage, metadata_index, retention
+
+DAY = 86400
+
+
+def store(base, name, age_days, size=1000):
+    """One stored image as ``image_storage`` writes it, plus its record."""
+    path = base / "objects" / name[:2] / f"{name}.jpg"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"\xff" * size)
+    mtime = time.time() - age_days * DAY
+    os.utime(path, (mtime, mtime))
+    rel = path.relative_to(base).as_posix()
+    return {"ticket": name, "path": str(retention.BASE_DIR / rel), "stored": mtime, "tags": []}
+
+
+def test_plan_splits_by_age_then_budget():
+    now = time.time()
+    files = [retention.StoredFile(f"f{i}", 100, now - (5 - i) * DAY) for i in range(5)]
+    planned = retention.plan(files, max_age_days=3.5, max_bytes=250, now=now)
+    assert [f.path for f in planned["expired"]] == ["f0", "f1"]
+    assert [f.path for f in planned["over_budget"]] == ["f2"]
+    assert [f.path for f in planned["keep"]] == ["f3", "f4"]
+
+
+def test_cli_cleans_index_and_compacts_below_base(tmp_path, capsys):
+    base = tmp_path / "archive"
+    old = [store(base, f"aa{i:02d}", 100) for i in range(3)]
+    new = [store(base, "bb00", 1)]
+    month = base / "2000_01"
+    month.mkdir()
+    (month / retention.INDEX_NAME).write_text(
+        "".join(json.dumps(r) + "\n" for r in old + new), encoding="utf-8"
+    )
+    db = base / metadata_index.INDEX_DB.name
+    index = metadata_index.MetadataIndex(db)
+    index.add(old + new)
+    index.close()
+
+    assert retention.main([str(base), "--days", "30"]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["dry_run"] and report["delete"]["files"] == 3
+    assert len(retention.scan(base)) == 4
+
+    assert retention.main([str(base), "--days", "30", "--apply"]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["deleted"] == 3
+    assert report["unindexed"] == 3
+    assert report["index_records_dropped"] == 3
+    assert [f.path.stem for f in retention.scan(base)] == ["bb00"]
+    lines = (month / retention.INDEX_NAME).read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["ticket"] for line in lines] == ["bb00"]
+    index = metadata_index.MetadataIndex(db)
+    try:
+        assert index.count() == 1
+    finally:
+        index.close()
+
+
+def test_reupload_after_planning_keeps_the_object(tmp_path):
+    store(tmp_path, "aa00", 100)
+    planned = retention.plan(retention.scan(tmp_path), max_age_days=30)
+    assert image_storage._reference(planned["expired"][0].path)
+    assert retention._delete(planned["expired"]) == []
+    assert len(retention.scan(tmp_path)) == 1
+
+
+def test_reference_waits_for_a_running_delete(tmp_path, monkeypatch):
+    store(tmp_path, "aa00", 100)
+    (old,) = retention.scan(tmp_path)
+    referenced = []
+    reference = threading.Thread(target=lambda: referenced.append(image_storage._reference(old.path)))
+    unlink = Path.unlink
+
+    def racing_unlink(path, *args, **kwargs):
+        if path == old.path:
+            # Duplikat kommt zwischen Prüfung und Löschen an
+            reference.start()
+            reference.join(0.2)
+            assert reference.is_alive()
+        unlink(path, *args, **kwargs)
+
+    monkeypatch.setattr(Path, "unlink", racing_unlink)
+    assert retention._delete([old]) == [old]
+    monkeypatch.setattr(Path, "unlink", unlink)
+    reference.join()
+    # das Duplikat sieht das Objekt als fehlend statt als referenziert
+    assert referenced == [False]
+    assert not old.path.exists()
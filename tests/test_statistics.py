@@ -0,0 +1,180 @@
+import random
+from collections import Counter
+
+import pytest
+
+from modules.statistics import RollingWindow, TopTags
+
+
+def assert_consistent(top: TopTags):
+    """``_order`` descending, ``_pos`` its inverse, ``_first`` the group starts."""
+    counts = [top.counts[t] for t in top._order]
+    assert counts == sorted(counts, reverse=True)
+    assert sorted(top._order) == sorted(top.counts)
+    assert all(top._order[i] == t for t, i in top._pos.items())
+    starts = {}
+    for i, c in enumerate(counts):
+        starts.setdefault(c, i)
+    assert top._first == starts
+
+
+def test_increments_keep_order():
+    top = TopTags()
+    for tag in ["b", "a", "b", "c", "c", "c", "a", "d"]:
+        top.increment(tag)
+        assert_consistent(top)
+    assert top.top(3) == [("c", 3), ("b", 2), ("a", 2)]
+    assert len(top) == 4
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_counter_on_random_increments(seed):
+    rng = random.Random(seed)
+    tags = [f"tag{i}" for i in range(40)]
+    # schiefe Verteilung wie bei echten Tags
+    stream = rng.choices(tags, weights=[1 / (i + 1) for i in range(40)], k=3000)
+    top = TopTags()
+    for tag in stream:
+        top.increment(tag)
+    assert_consistent(top)
+    expected = Counter(stream)
+    assert [c for _, c in top.top(10)] == [c for _, c in expected.most_common(10)]
+    assert all(expected[t] == c for t, c in top.top(len(top)))
+
+
+def test_starts_from_existing_counts():
+    counts = {"x": 1, "y": 5, "z": 3}
+    top = TopTags(counts)
+    assert_consistent(top)
+    assert top.top(2) == [("y", 5), ("z", 3)]
+    top.increment("x")
+    top.increment("x")
+    top.increment("x")
+    assert top.top(2) == [("y", 5), ("x", 4)]
+    # teilt das Dict mit dem Aufrufer
+    assert counts["x"] == 4
+    assert_consistent(top)
+
+
+def test_top_beyond_length():
+    top = TopTags()
+    top.increment("only")
+    assert top.top(5) == [("only", 1)]
+    assert TopTags().top(3) == []
+
+
+@pytest.fixture
+def stats(tmp_path, monkeypatch):
+    """Statistics module on empty files in ``tmp_path``, without flusher thread."""
+    from modules import statistics
+
+    for name in ("_count", "tag_counts", "_top", "_top_by_category", "_seq", "_window",
+                 "_pending_count", "_pending_tags", "_pending_records"):
+        monkeypatch.setattr(statistics, name, getattr(statistics, name))
+    monkeypatch.setattr(statistics, "STATS_FILE", tmp_path / "statistics.json")
+    monkeypatch.setattr(statistics, "DELTA_LOG", tmp_path / "statistics.log")
+    monkeypatch.setattr(statistics, "_ensure_flusher", lambda: None)
+    monkeypatch.setattr(statistics, "_pending_count", 0)
+    monkeypatch.setattr(statistics, "_pending_tags", {})
+    monkeypatch.setattr(statistics, "_pending_records", 0)
+    statistics._load()
+    return statistics
+
+
+def reloaded(stats):
+    stats._load()
+    return stats._count, dict(stats.tag_counts), stats._seq
+
+
+def test_deltas_replay_after_restart(stats):
+    stats.record_scan(["cat", "dog"])
+    stats.record_scan(["cat"])
+    stats._flush()
+    stats.record_tags(["dog"])
+    stats._flush()
+    stats._flush()  # ohne neue Deltas keine neue Zeile
+
+    assert len(stats.DELTA_LOG.read_text().splitlines()) == 2
+    assert not stats.STATS_FILE.exists()
+    assert reloaded(stats) == (2, {"cat": 2, "dog": 2}, 2)
+
+
+def test_compaction_keeps_counts_and_sequence(stats):
+    stats.record_scan(["cat", "dog"])
+    stats._flush()
+    stats.record_scan(["cat"])
+    stats._flush(compact=True)
+
+    assert not stats.DELTA_LOG.exists()
+    assert reloaded(stats) == (2, {"cat": 2, "dog": 1}, 2)
+
+    # nach dem Reload geht es mit der nächsten Sequenznummer weiter
+    stats.record_scan(["bird"])
+    stats._flush()
+    assert '"seq": 3' in stats.DELTA_LOG.read_text()
+    assert reloaded(stats) == (3, {"cat": 2, "dog": 1, "bird": 1}, 3)
+    assert stats.get_statistics()["top_tags"] == ["cat", "dog", "bird"]
+
+
+def test_crash_between_snapshot_and_unlink_does_not_count_twice(stats):
+    stats.record_scan(["cat"])
+    stats._flush()
+    stats.record_scan(["cat", "dog"])
+    stats._flush()
+    log = stats.DELTA_LOG.read_text()
+    stats._flush(compact=True)
+    # Absturz vor dem Löschen des Logs, dazu eine abgeschnittene Zeile
+    stats.DELTA_LOG.write_text(log + '{"seq": 3, "cou')
+
+    assert reloaded(stats) == (2, {"cat": 2, "dog": 1}, 2)
+
+
+def test_automatic_compaction_above_threshold(stats, monkeypatch):
+    monkeypatch.setattr(stats, "COMPACT_BYTES", 64)
+    for n in range(5):
+        stats.record_scan([f"tag{n}"])
+        stats._flush()
+    assert stats.STATS_FILE.exists()
+    assert reloaded(stats) == (5, {f"tag{n}": 1 for n in range(5)}, 5)
+
+
+T0 = 1_800_000_000.0  # volle Minute
+
+
+def test_window_rolls_over_into_new_buckets():
+    window = RollingWindow(minutes=3)
+    window.record(["cat"], nsfw=True, latency=0.2, now=T0)
+    window.record(["cat", "dog"], latency=0.4, now=T0 + 59)
+    window.record(["dog"], now=T0 + 60)
+
+    last = window.aggregate(1, now=T0 + 61)
+    assert (last["count"], last["nsfw"], last["avg_latency_ms"]) == (1, 0, None)
+    both = window.aggregate(2, now=T0 + 61)
+    assert (both["count"], both["nsfw"], both["nsfw_rate"]) == (3, 1, 0.333)
+    assert both["avg_latency_ms"] == 300.0
+    assert both["top_tags"] == [{"tag": "cat", "count": 2}, {"tag": "dog", "count": 2}]
+
+
+def test_window_drops_buckets_older_than_its_length():
+    window = RollingWindow(minutes=3)
+    for minute in range(3):
+        window.record([f"m{minute}"], now=T0 + minute * 60)
+    assert window.aggregate(3, now=T0 + 150)["count"] == 3
+    assert window.aggregate(3, now=T0 + 180)["count"] == 2  # Minute 0 ist heraus
+    # Minute 3 überschreibt den Slot von Minute 0 statt ihn fortzuschreiben
+    window.record(["m3"], now=T0 + 180)
+    out = window.aggregate(3, now=T0 + 180)
+    assert out["count"] == 3
+    assert {t["tag"] for t in out["top_tags"]} == {"m1", "m2", "m3"}
+    assert window.aggregate(3, now=T0 + 3600)["count"] == 0
+
+
+def test_window_length_is_clamped(monkeypatch):
+    from modules import statistics
+
+    window = RollingWindow(minutes=3)
+    monkeypatch.setattr(statistics.time, "time", lambda: T0 + 30)
+    window.record(["cat"])
+    assert window.aggregate(60)["minutes"] == 3
+    out = window.aggregate(0)
+    assert (out["minutes"], out["count"], out["per_minute"]) == (1, 1, 1.0)
@@ -0,0 +1,37 @@
+import json
+
+import numpy as np
+
+from modules import tagging
+
+
+def test_class_index_is_complete():
+    labels = tagging.class_labels()
+    assert len(labels) == tagging.CLASSES
+    with open(tagging.CLASS_INDEX, encoding="utf-8") as f:
+        index = json.load(f)
+    wnids = [index[str(i)][0] for i in range(tagging.CLASSES)]
+    assert wnids == sorted(set(wnids))
+    assert labels[0] == "tench" and labels[999] == "toilet_tissue"
+
+
+def test_decode_top_scores_in_order():
+    preds = np.zeros((2, tagging.CLASSES), dtype=np.float32)
+    preds[0, [5, 7, 1]] = [0.2, 0.9, 0.5]
+    preds[1, 999] = 1.0
+    rows = tagging.decode(preds, top=3)
+    labels = tagging.class_labels()
+    assert [t["label"] for t in rows[0]] == [labels[7], labels[1], labels[5]]
+    assert rows[0][0]["score"] == np.float32(0.9)
+    assert rows[1][0] == {"label": "toilet_tissue", "score": 1.0}
+
+
+def test_stub_backend_runs_offline(monkeypatch):
+    from modules.image_context import ImageContext
+
+    monkeypatch.setenv("PIXAI_BACKEND", "stub")
+    monkeypatch.setattr(tagging, "_model", None)
+    arr = np.random.default_rng(0).integers(0, 256, (64, 48, 3), dtype=np.uint8)
+    result = tagging.process_image(b"", context=ImageContext.from_array(arr))
+    assert len(result["tags"]) == 3
+    assert all(t["label"] in tagging.class_labels() for t in result["tags"])
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+import token_manager as tm
+
+DAY = 86400
+
+
+class Clock:
+    def __init__(self, now: float = 1_800_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(tm, "TOKENS_FILE", tmp_path / "tokens.json")
+    monkeypatch.setattr(tm, "_STORE", tm._TokenStore())
+    monkeypatch.setattr(tm.time, "time", clock)
+    return clock
+
+
+def stored() -> dict:
+    return json.loads(tm.TOKENS_FILE.read_text())
+
+
+def test_tokens_are_reused_until_renewed(clock):
+    token = tm.get_token("a@example.org")
+    assert tm.is_valid_token(token)
+    assert tm.get_token("a@example.org") == token
+    renewed = tm.get_token("a@example.org", renew=True)
+    assert renewed != token
+    assert tm.is_valid_token(renewed) and not tm.is_valid_token(token)
+    assert stored()["a@example.org"]["token"] == renewed
+
+
+def test_expired_tokens_are_removed_write_behind(clock):
+    old = tm.get_token("old@example.org")
+    clock.now += 20 * DAY
+    new = tm.get_token("new@example.org")
+    clock.now += 11 * DAY
+
+    assert not tm.is_valid_token(old)
+    assert tm.is_valid_token(new)
+    # Entfernen wird erst nach FLUSH_INTERVAL zurückgeschrieben
+    assert "old@example.org" in stored()
+    clock.now += tm.FLUSH_INTERVAL + 1
+    tm.is_valid_token(new)
+    assert set(stored()) == {"new@example.org"}
+
+
+def test_flush_persists_pending_removals(clock):
+    tm.get_token("old@example.org")
+    clock.now += tm.EXPIRY_SECONDS + 1
+    tm.is_valid_token("unknown")
+    assert "old@example.org" in stored()
+    tm.flush()
+    assert stored() == {}
+
+
+def test_external_edit_is_picked_up_after_refresh_interval(clock):
+    tm.get_token("a@example.org")
+    tokens = stored()
+    tokens["b@example.org"] = {"token": "external-token", "ts": int(clock.now)}
+    tm.TOKENS_FILE.write_text(json.dumps(tokens))
+
+    assert not tm.is_valid_token("external-token")  # Index noch im Intervall
+    clock.now += tm.REFRESH_INTERVAL + 0.1
+    assert tm.is_valid_token("external-token")
+
+
+def test_legacy_entries_count_as_expired(clock):
+    tm.TOKENS_FILE.write_text(json.dumps({"legacy@example.org": "legacy-token"}))
+    assert not tm.is_valid_token("legacy-token")
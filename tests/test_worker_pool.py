@@ -0,0 +1,61 @@
+import gc
+import sys
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import worker_pool
+from modules.image_context import ImageContext
+
+SMALL = ((8, 8), Image.NEAREST)
+LARGE = ((16, 16), Image.BICUBIC)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Pool without processes whose modules declare their inputs."""
+    for name, variants in (("tests_fake_small", (SMALL,)), ("tests_fake_large", (LARGE, SMALL))):
+        mod = types.ModuleType(name)
+        mod.INPUT_VARIANTS = variants
+        monkeypatch.setitem(sys.modules, name, mod)
+    pool = worker_pool.WorkerPool(1, ("tests_fake_small", "tests_fake_large"))
+    yield pool
+    pool._results.close()
+
+
+def context() -> ImageContext:
+    rng = np.random.default_rng(0)
+    return ImageContext.from_array(rng.integers(0, 256, (120, 160, 3), dtype=np.uint8))
+
+
+def test_input_variants_fall_back_to_original():
+    declared = types.SimpleNamespace(INPUT_VARIANTS=(SMALL,))
+    assert worker_pool.input_variants([declared, declared]) == [SMALL]
+    assert worker_pool.input_variants([declared, object()]) == [SMALL, None]
+
+
+def test_stages_share_one_block_of_model_inputs(pool):
+    ctx = context()
+    first = pool._shared(ctx)
+    second = pool._shared(ctx)
+    assert first is second
+    assert [key for key, _, _ in first.layout] == [SMALL, LARGE]
+    # nur die Modell-Eingaben, nicht das 160x120-Original
+    assert sum(int(np.prod(shape)) for _, _, shape in first.layout) == (8 * 8 + 16 * 16) * 3
+
+    shared = worker_pool._context(first.shm, first.layout)
+    for key in (SMALL, LARGE):
+        assert np.array_equal(shared.resized_array(*key), ctx.resized_array(*key))
+    with pytest.raises(ValueError):
+        shared.image
+    shared = None
+
+    name = first.shm.name
+    first.release()
+    second.release()
+    ctx = None
+    gc.collect()
+    with pytest.raises(FileNotFoundError):
+        worker_pool.shared_memory.SharedMemory(name=name)
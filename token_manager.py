@@ -1,5 +1,18 @@
+"""API token storage.
+
+``tokens.json`` (guarded by a file lock) stays the source of truth so that
+several processes can share it. Lookups on the hot path go through an
+in-process index instead: token -> email in a dict, expiry times in a heap.
+The index is rebuilt only when the file's mtime/size changes, and removal of
+expired tokens is written back in batches at most every ``FLUSH_INTERVAL``
+seconds.
+"""
+
+import heapq
 import json
+import os
 import secrets
+import threading
 from pathlib import Path
 import time
 
@@ -27,6 +40,8 @@ except Exception:  # pragma: no cover - depends on platform
 
 TOKENS_FILE = Path('tokens.json')
 EXPIRY_SECONDS = 3600 * 24 * 30  # 30 days
+REFRESH_INTERVAL = 1.0  # seconds between mtime checks of TOKENS_FILE
+FLUSH_INTERVAL = 60.0  # write-behind interval for expiry removals
 
 
 def _load_tokens() -> dict:
@@ -45,55 +60,157 @@ def _load_tokens() -> dict:
         return {}
 
 
-def _save_tokens(tokens: dict) -> None:
-    try:
-        with TOKENS_FILE.open('w') as f:
-            _lock(f, LOCK_EX)
+def _update_tokens(fn) -> dict:
+    """Read-modify-write ``TOKENS_FILE`` under one exclusive lock."""
+    TOKENS_FILE.touch(exist_ok=True)
+    with TOKENS_FILE.open('r+') as f:
+        _lock(f, LOCK_EX)
+        try:
+            try:
+                tokens = json.load(f)
+            except Exception:
+                tokens = {}
+            fn(tokens)
+            f.seek(0)
+            f.truncate()
             json.dump(tokens, f)
+            f.flush()
+        finally:
             _unlock(f)
-    except Exception:
-        pass
-
-
-def _cleanup(tokens: dict) -> None:
-    now = int(time.time())
-    removed = []
-    for email, info in list(tokens.items()):
-        if isinstance(info, dict):
-            token = info.get("token")
-            ts = int(info.get("ts", 0))
-        else:  # legacy format
-            token = info
-            ts = 0
-        if now - ts > EXPIRY_SECONDS:
-            removed.append(email)
-    for email in removed:
-        tokens.pop(email, None)
-    if removed:
-        _save_tokens(tokens)
+    return tokens
+
+
+def _record(info) -> tuple:
+    """Return ``(token, ts)`` for new-style and legacy entries."""
+    if isinstance(info, dict):
+        return info.get("token"), int(info.get("ts", 0))
+    return info, 0  # legacy format
+
+
+def _expired(tokens: dict, now: int) -> list:
+    return [
+        email for email, info in tokens.items()
+        if now - _record(info)[1] > EXPIRY_SECONDS
+    ]
+
+
+class _TokenStore:
+    """Process-level index over ``TOKENS_FILE``."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._path = None
+        self._signature = None
+        self._next_check = 0.0
+        self._by_token: dict = {}
+        self._by_email: dict = {}
+        self._heap: list = []
+        self._dirty = False
+        self._next_flush = 0.0
+
+    def _file_signature(self):
+        try:
+            st = os.stat(TOKENS_FILE)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _rebuild(self, tokens: dict, signature) -> None:
+        self._by_token = {}
+        self._by_email = {}
+        self._heap = []
+        for email, info in tokens.items():
+            token, ts = _record(info)
+            if not token:
+                continue
+            self._by_token[token] = email
+            self._by_email[email] = (token, ts)
+            self._heap.append((ts + EXPIRY_SECONDS, email, token))
+        heapq.heapify(self._heap)
+        self._signature = signature
+        self._path = TOKENS_FILE
+
+    def _refresh(self, now: float) -> None:
+        if self._path != TOKENS_FILE:
+            self._next_check = 0.0
+        if now < self._next_check:
+            return
+        self._next_check = now + REFRESH_INTERVAL
+        signature = self._file_signature()
+        if signature != self._signature or self._path != TOKENS_FILE:
+            self._rebuild(_load_tokens(), signature)
+
+    def _expire(self, now: float) -> None:
+        while self._heap and self._heap[0][0] < now:
+            _, email, token = heapq.heappop(self._heap)
+            if self._by_email.get(email, (None,))[0] != token:
+                continue  # bereits erneuert
+            del self._by_email[email]
+            self._by_token.pop(token, None)
+            if not self._dirty:
+                self._dirty = True
+                self._next_flush = now + FLUSH_INTERVAL
+
+    def _flush(self, now: float, force: bool = False) -> None:
+        if not self._dirty or (not force and now < self._next_flush):
+            return
+
+        def _apply(tokens):
+            for email in _expired(tokens, int(now)):
+                tokens.pop(email, None)
+
+        try:
+            tokens = _update_tokens(_apply)
+            self._rebuild(tokens, self._file_signature())
+            self._dirty = False
+        except Exception:
+            self._next_flush = now + FLUSH_INTERVAL
+
+    def _sync(self) -> float:
+        now = time.time()
+        self._refresh(now)
+        self._expire(now)
+        return now
+
+    def is_valid(self, token: str) -> bool:
+        with self._lock:
+            now = self._sync()
+            valid = token in self._by_token
+            self._flush(now)
+            return valid
+
+    def get(self, email: str, renew: bool) -> str:
+        with self._lock:
+            now = self._sync()
+            if not renew and email in self._by_email:
+                return self._by_email[email][0]
+            token = secrets.token_hex(16)
+
+            def _apply(tokens):
+                for expired in _expired(tokens, int(now)):
+                    tokens.pop(expired, None)
+                tokens[email] = {"token": token, "ts": int(now)}
+
+            self._rebuild(_update_tokens(_apply), self._file_signature())
+            self._dirty = False
+            return token
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush(time.time(), force=True)
+
+
+_STORE = _TokenStore()
 
 
 def get_token(email: str, *, renew: bool = False) -> str:
-    tokens = _load_tokens()
-    _cleanup(tokens)
-    if renew or email not in tokens:
-        tokens[email] = {"token": secrets.token_hex(16), "ts": int(time.time())}
-        _save_tokens(tokens)
-    else:
-        info = tokens[email]
-        if isinstance(info, dict):
-            return info.get("token")
-        return info
-    return tokens[email]["token"]
+    return _STORE.get(email, renew)
 
 
 def is_valid_token(token: str) -> bool:
-    tokens = _load_tokens()
-    _cleanup(tokens)
-    for info in tokens.values():
-        if isinstance(info, dict):
-            if info.get("token") == token:
-                return True
-        elif info == token:  # legacy
-            return True
-    return False
+    return _STORE.is_valid(token)
+
+
+def flush() -> None:
+    """Write pending expiry removals to ``TOKENS_FILE`` now."""
+    _STORE.flush()
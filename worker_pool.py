@@ -0,0 +1,524 @@
+"""Multi-process inference workers.
+
+By default every model runs inside the API process, where TensorFlow and
+PIL share one GIL with the HTTP threads and a crashing model takes the
+server down. With ``PIXAI_WORKER_PROCESSES=N`` (or ``--processes N`` for
+``async_server.py``) the API starts N worker processes instead. Each worker
+imports the model modules listed in ``modules.cfg`` and warms them up.
+
+The API decodes an upload once and copies the model inputs the worker
+modules declare (``INPUT_VARIANTS``, e.g. 224x224 and 512x512) into one
+``multiprocessing.shared_memory`` block per image; modules without that
+declaration get the full RGB array. The block is created on the first job
+of an image and reused by the jobs of its other stages. Only the block name
+and layout go through the worker's request queue; the worker maps the
+arrays without pickling the pixels. Results come back over one shared
+result queue.
+
+A monitor thread pings idle workers, and restarts a worker whose process
+exited, whose job ran longer than ``PIXAI_WORKER_JOB_TIMEOUT`` or whose
+heartbeat stopped. Jobs of a restarted worker fail with
+:class:`WorkerCrashed`, so their modules answer with an error entry.
+"""
+
+from __future__ import annotations
+
+import importlib
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from modules.image_context import ImageContext, call_process_image
+from modules.preload import MODEL_MODULES
+
+logger = logging.getLogger(__name__)
+
+PROCESSES = int(os.getenv("PIXAI_WORKER_PROCESSES", "0"))
+JOB_TIMEOUT = float(os.getenv("PIXAI_WORKER_JOB_TIMEOUT", "60"))
+STARTUP_TIMEOUT = float(os.getenv("PIXAI_WORKER_STARTUP_TIMEOUT", "300"))
+HEALTH_INTERVAL = float(os.getenv("PIXAI_WORKER_HEALTH_INTERVAL", "2"))
+HEARTBEAT_INTERVALS = 3  # verpasste Pings bis zum Neustart
+JOIN_TIMEOUT = 5.0
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker handling a job died, hung or no worker is available."""
+
+
+def model_modules(cfg: Optional[Path] = None) -> List[str]:
+    """Model modules from ``modules.cfg`` that the workers should load."""
+    if cfg is None:
+        from main import MODULES_CFG as cfg
+    try:
+        with open(cfg, "r", encoding="utf-8") as f:
+            names = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    except OSError:
+        names = list(MODEL_MODULES)
+    return [n for n in names if n in MODEL_MODULES]
+
+
+# ---------- worker process ----------
+def _limit_threads(threads: int) -> None:
+    """Keep N workers from each spawning one thread per core."""
+    if threads <= 0:
+        return
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+    try:
+        import tensorflow as tf
+
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except Exception:
+        pass
+
+
+def _load(names: Sequence[str]) -> Dict[str, object]:
+    modules = {}
+    for name in names:
+        try:
+            mod = importlib.import_module(name)
+        except Exception:
+            logger.exception("Worker: Import von %s fehlgeschlagen", name)
+            continue
+        modules[name] = mod
+        try:
+            if hasattr(mod, "warmup"):
+                mod.warmup()
+        except Exception:
+            # Modul bleibt geladen und liefert pro Bild einen Fehler-Eintrag
+            logger.exception("Worker: Aufwärmen von %s fehlgeschlagen", name)
+    return modules
+
+
+def _states(modules: Dict[str, object]) -> Dict[str, object]:
+    states = {}
+    for name, mod in modules.items():
+        try:
+            states[name] = mod.load_state()
+        except Exception as exc:
+            states[name] = {"state": "error", "error": str(exc)}
+    return states
+
+
+# (Variante, Offset, Form); Variante ``None`` ist das ganze RGB-Array
+Layout = List[Tuple[Optional[tuple], int, Tuple[int, ...]]]
+
+
+def input_variants(modules: Sequence[object]) -> List[Optional[tuple]]:
+    """``(size, resample)`` inputs of ``modules``; ``None`` if one needs the original."""
+    keys: List[Optional[tuple]] = []
+    for mod in modules:
+        declared = getattr(mod, "INPUT_VARIANTS", None)
+        for key in [None] if declared is None else [(tuple(size), resample) for size, resample in declared]:
+            if key not in keys:
+                keys.append(key)
+    return keys
+
+
+def _context(shm: shared_memory.SharedMemory, layout: Layout) -> ImageContext:
+    arrays = {
+        key: np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+        for key, offset, shape in layout
+    }
+    full = arrays.pop(None, None)
+    return ImageContext.from_variants(arrays, array=full)
+
+
+def _scan(
+    modules: Dict[str, object],
+    shm_name: str,
+    layout: Layout,
+    names: Optional[Sequence[str]] = None,
+) -> dict:
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ctx = None
+    try:
+        ctx = _context(shm, layout)
+        results = {}
+        for name, mod in modules.items():
+            if names is not None and name not in names:
+                continue
+            try:
+                results[name] = call_process_image(mod.process_image, ctx)
+            except Exception as exc:
+                results[name] = {"error": str(exc)}
+                logger.exception("Worker: Modul %s fehlgeschlagen", name)
+        return results
+    finally:
+        # Ansicht auf den Puffer freigeben, sonst schlägt close() fehl
+        ctx = None
+        shm.close()
+
+
+def _worker_main(index: int, names: Sequence[str], requests, results, threads: int) -> None:
+    """Entry point of a worker process."""
+    logging.basicConfig(
+        filename="scanner.log",
+        level=logging.INFO,
+        format="%(asctime)s %(name)s[worker-%(process)d] %(levelname)s: %(message)s",
+    )
+    _limit_threads(threads)
+    modules = _load(names)
+    results.put(("ready", index, os.getpid(), _states(modules)))
+    while True:
+        msg = requests.get()
+        if msg is None:
+            break
+        if msg[0] == "ping":
+            results.put(("pong", index, msg[1]))
+            continue
+        _, job_id, shm_name, layout, only = msg
+        try:
+            out = _scan(modules, shm_name, layout, only)
+        except Exception as exc:
+            logger.exception("Worker: Job %d fehlgeschlagen", job_id)
+            out = {"error": str(exc)}
+        results.put(("result", index, job_id, out))
+
+
+# ---------- pool ----------
+class _Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.requests = None
+        self.pid: Optional[int] = None
+        self.ready = False
+        self.models: Dict[str, object] = {}
+        self.pending: Dict[int, float] = {}  # job_id -> Startzeit
+        self.started = 0.0
+        self.last_seen = 0.0
+        self.completed = 0
+        self.restarts = 0
+        self.last_error: Optional[str] = None
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "index": self.index,
+            "pid": self.pid,
+            "alive": self.alive(),
+            "ready": self.ready,
+            "pending": len(self.pending),
+            "completed": self.completed,
+            "restarts": self.restarts,
+            "last_error": self.last_error,
+        }
+
+
+def _release(shm: shared_memory.SharedMemory) -> None:
+    try:
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class _SharedImage:
+    """The shared-memory block of one image, freed after its last user.
+
+    Users are the image's :class:`ImageContext` (until it is garbage
+    collected) and every job still running on the block.
+    """
+
+    def __init__(self, context: ImageContext, variants: Sequence[Optional[tuple]]):
+        arrays = [
+            (key, context.array if key is None else context.resized_array(*key))
+            for key in variants
+        ]
+        self.shm = shared_memory.SharedMemory(create=True, size=max(sum(a.nbytes for _, a in arrays), 1))
+        self.layout: Layout = []
+        offset = 0
+        for key, arr in arrays:
+            arr = np.ascontiguousarray(arr, dtype=np.uint8)
+            np.ndarray(arr.shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset)[...] = arr
+            self.layout.append((key, offset, arr.shape))
+            offset += arr.nbytes
+        self._users = 1
+        self._lock = threading.Lock()
+        # gibt die Nutzung durch den Kontext frei, spätestens bei dessen GC
+        self.forget = weakref.finalize(context, self.release)
+
+    def acquire(self) -> None:
+        with self._lock:
+            self._users += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self._users -= 1
+            last = self._users == 0
+        if last:
+            _release(self.shm)
+
+
+class WorkerPool:
+    """N inference processes fed through shared memory."""
+
+    def __init__(
+        self,
+        size: int = PROCESSES,
+        names: Optional[Sequence[str]] = None,
+        *,
+        job_timeout: float = JOB_TIMEOUT,
+        health_interval: float = HEALTH_INTERVAL,
+        threads: Optional[int] = None,
+    ):
+        if size < 1:
+            raise ValueError("WorkerPool needs at least one process")
+        self.size = size
+        self.names = tuple(model_modules() if names is None else names)
+        self.job_timeout = job_timeout
+        self.health_interval = health_interval
+        self.threads = threads if threads is not None else max(1, (os.cpu_count() or 1) // size)
+        # spawn: kein geerbter TensorFlow-Zustand aus dem API-Prozess
+        self._ctx = mp.get_context("spawn")
+        self._results = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._jobs: Dict[int, Tuple[Future, _SharedImage, int]] = {}
+        self._images: "weakref.WeakKeyDictionary[ImageContext, _SharedImage]" = weakref.WeakKeyDictionary()
+        self._ids = itertools.count(1)
+        self._workers = [_Worker(i) for i in range(size)]
+        self._closed = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    # ---------- lifecycle ----------
+    def start(self) -> "WorkerPool":
+        for worker in self._workers:
+            self._spawn(worker)
+        for target, name in ((self._collect, "worker-results"), (self._monitor, "worker-monitor")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("%d Worker-Prozesse gestartet (%s)", self.size, ", ".join(self.names))
+        return self
+
+    def _spawn(self, worker: _Worker) -> None:
+        worker.requests = self._ctx.Queue()
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker.index, self.names, worker.requests, self._results, self.threads),
+            name=f"pixai-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        worker.pid = worker.process.pid
+        worker.ready = False
+        worker.started = worker.last_seen = time.monotonic()
+
+    def close(self) -> None:
+        """Stop all workers and fail jobs that are still pending."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        for worker in self._workers:
+            try:
+                worker.requests.put(None)
+            except Exception:
+                pass
+        for worker in self._workers:
+            worker.process.join(JOIN_TIMEOUT)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join(JOIN_TIMEOUT)
+        self._results.put(None)
+        for job_id in list(self._jobs):
+            self._finish(job_id, error=WorkerCrashed("worker pool closed"))
+
+    # ---------- jobs ----------
+    def _pick(self) -> Optional[_Worker]:
+        alive = [w for w in self._workers if w.alive()]
+        if not alive:
+            return None
+        # bereite Worker bevorzugen, dann den mit der kürzesten Warteschlange
+        return min(alive, key=lambda w: (not w.ready, len(w.pending)))
+
+    def _shared(self, context: ImageContext) -> _SharedImage:
+        """The block of ``context``, created on its first job (one more user)."""
+        with self._lock:
+            image = self._images.get(context)
+            if image is not None:
+                image.acquire()
+                return image
+        modules = []
+        for name in self.names:
+            try:
+                modules.append(importlib.import_module(name))
+            except Exception:
+                modules.append(None)  # ohne Angabe: ganzes Bild
+        # außerhalb des Locks kopieren; bei einem parallelen ersten Job gewinnt einer
+        created = _SharedImage(context, input_variants(modules))
+        with self._lock:
+            image = self._images.setdefault(context, created)
+            image.acquire()
+        if image is not created:
+            created.forget()
+        return image
+
+    def submit(self, context: ImageContext, names: Optional[Sequence[str]] = None) -> Future:
+        """Queue one decoded image; the future resolves to the module results.
+
+        ``names`` restricts the job to some of the worker's modules, so the
+        pipeline can run the models of one image on different workers; all
+        jobs of one context share its block.
+        """
+        if self._closed.is_set():
+            raise WorkerCrashed("worker pool closed")
+        image = self._shared(context)
+        future: Future = Future()
+        with self._lock:
+            worker = self._pick()
+            if worker is None:
+                image.release()
+                raise WorkerCrashed("no worker process alive")
+            job_id = next(self._ids)
+            self._jobs[job_id] = (future, image, worker.index)
+            worker.pending[job_id] = time.monotonic()
+            worker.requests.put(("job", job_id, image.shm.name, image.layout, names))
+        return future
+
+    def run(self, context: ImageContext, names: Optional[Sequence[str]] = None) -> dict:
+        """Blocking :meth:`submit`; raises :class:`WorkerCrashed` on failure."""
+        future = self.submit(context, names)
+        try:
+            return future.result(self.job_timeout + 2 * self.health_interval)
+        except FutureTimeout:
+            raise WorkerCrashed("worker did not answer") from None
+
+    def _finish(self, job_id: int, result=None, error: Optional[Exception] = None) -> None:
+        with self._lock:
+            entry = self._jobs.pop(job_id, None)
+            if entry is None:
+                return
+            future, image, index = entry
+            worker = self._workers[index]
+            worker.pending.pop(job_id, None)
+            if error is None:
+                worker.completed += 1
+        image.release()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _collect(self) -> None:
+        while True:
+            try:
+                msg = self._results.get()
+            except (EOFError, OSError):
+                return
+            if msg is None:
+                return
+            kind, index = msg[0], msg[1]
+            worker = self._workers[index]
+            worker.last_seen = time.monotonic()
+            if kind == "ready":
+                worker.pid, worker.models, worker.ready = msg[2], msg[3], True
+                logger.info("Worker %d (pid %d) bereit", index, msg[2])
+            elif kind == "result":
+                self._finish(msg[2], result=msg[3])
+
+    # ---------- health ----------
+    def _problem(self, worker: _Worker, now: float) -> Optional[str]:
+        if not worker.alive():
+            code = worker.process.exitcode if worker.process is not None else None
+            return f"process exited (code {code})"
+        with self._lock:
+            oldest = min(worker.pending.values(), default=None)
+        if oldest is not None and now - oldest > self.job_timeout:
+            return f"job running for {now - oldest:.0f}s"
+        if not worker.ready:
+            if now - worker.started > STARTUP_TIMEOUT:
+                return "startup timeout"
+        elif oldest is None and now - worker.last_seen > HEARTBEAT_INTERVALS * self.health_interval:
+            return "no heartbeat"
+        return None
+
+    def _restart(self, worker: _Worker, reason: str) -> None:
+        logger.warning("Worker %d (pid %s) wird neu gestartet: %s", worker.index, worker.pid, reason)
+        if worker.process.is_alive():
+            worker.process.kill()
+        worker.process.join(JOIN_TIMEOUT)
+        worker.requests.cancel_join_thread()
+        worker.requests.close()
+        worker.restarts += 1
+        worker.last_error = reason
+        with self._lock:
+            failed = list(worker.pending)
+        for job_id in failed:
+            self._finish(job_id, error=WorkerCrashed(f"worker {worker.index}: {reason}"))
+        self._spawn(worker)
+
+    def check(self) -> None:
+        """One health-check round: restart broken workers, ping the rest."""
+        now = time.monotonic()
+        for worker in self._workers:
+            if self._closed.is_set():
+                return
+            reason = self._problem(worker, now)
+            if reason is not None:
+                self._restart(worker, reason)
+            elif worker.ready and not worker.pending:
+                try:
+                    worker.requests.put(("ping", now))
+                except Exception:
+                    pass
+
+    def _monitor(self) -> None:
+        while not self._closed.wait(self.health_interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Worker-Healthcheck fehlgeschlagen")
+
+    # ---------- reporting ----------
+    def get_statistics(self) -> Dict[str, object]:
+        workers = [w.as_dict() for w in self._workers]
+        return {
+            "processes": self.size,
+            "alive": sum(w["alive"] for w in workers),
+            "ready": sum(w["alive"] and w["ready"] for w in workers),
+            "pending": len(self._jobs),
+            "workers": workers,
+        }
+
+    def get_health(self) -> Dict[str, object]:
+        """``/health`` payload: ready once at least one worker is ready."""
+        stats = self.get_statistics()
+        models = next((w.models for w in self._workers if w.ready and w.alive()), {})
+        return {
+            "ready": stats["ready"] > 0,
+            "preload": "workers",
+            "models": models,
+            "workers": stats["workers"],
+        }
+
+
+_pool: Optional[WorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def start(size: int = PROCESSES) -> Optional[WorkerPool]:
+    """Start the process-wide pool once; ``None`` if ``size`` is 0."""
+    global _pool
+    if size < 1:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(size).start()
+        return _pool
+
+
+def get_pool() -> Optional[WorkerPool]:
+    return _pool